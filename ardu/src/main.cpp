@@ -26,30 +26,184 @@ ELB_ARDU_DISC4
 Commands:
   *IDN?
     Gets the instrument's identification string
+
+  *SAV
+    Store the register image in the EEPROM. The image holds the last value
+    written to every DAC channel and reference register since start
+    (SENd, MULticast or *RCL), and which of them were written. It is saved
+    with a CRC-CCITT (avr-libc _crc_ccitt_update, start 0xFFFF) of the image.
+    Answer with the checksum (hex):
+    SAV,<checksum>
+
+  *RCL
+    Write the registers of the stored image to the DACs again, references
+    first. Nothing is written if there is no valid image.
+    Answer with the number of restored registers:
+    RCL,<registers>
+
+  SYSTem:CONFig?
+  SYSTem:CONFig:AUTO <0|1>
+    Get the state of the stored image / restore it at every start, before
+    the welcome message (needs a stored image, *SAV keeps the setting).
+    Answer (<valid> = 0: no image or checksum error):
+    CONF,<valid>,<auto_restore>,<checksum>
+
+  SYSTem:CONFig:DATA?
+    Get the stored image as hex bytes, empty if there is none. Layout
+    (little endian): written registers per chip (8 x u8, bits 0 ... 3 =
+    channels, bit 4 = references), channel codes (8 x 4 x u16), reference
+    registers (8 x u16).
+    Answer:
+    CONFDATA,<hex>
   
-  SYSTem:SPI:SENd <index>, <command>, <payload>
+  SYSTem:SPI:SENd <index>, <command>, <payload>[, <trigger>]
     Send 24 bit of data via SPI.
     Use chip select <index>, 8 bit <command>, and 16 bit <payload>.
+    With <trigger> = 1 the trigger output pulses after the transfer.
     Answer:
     SPIRESP,<index>,<command>,<payload>,<data_read_from_spi>
 
+  SYSTem:SPI:MULticast <mask>, <command>, <payload>[, <trigger>]
+    Send the same 24 bit write to several chips in one SPI transaction.
+    Bit i of the 8 bit <mask> selects chip select index i. Only write
+    commands are allowed: all selected chips answer a valid write
+    identically, so their SDO outputs agree. <trigger> as for SENd.
+    Answer (<data_read_from_spi> is 0 if the command was rejected):
+    SPIMRESP,<mask>,<command>,<payload>,<data_read_from_spi>
+
   SYSTem:PULser:ENAble
     Enble the integrated testpulser.
 
   SYSTem:PULser:DISable
     Disable the integrated testpulser.
 
+  SYSTem:PULser:PERiod <period_us>
+  SYSTem:PULser:PERiod?
+    Set / get the testpulser period (1 ... 1000000 us).
+    Answer with the period the timer actually achieved:
+    PULPER,<period_ns>
+
+  SYSTem:PULser:DUTY <duty>
+  SYSTem:PULser:DUTY?
+    Set / get the testpulser duty cycle (0 ... 1023 = 0 ... 100 %).
+    Answer:
+    PULDUTY,<duty>
+
+  SYSTem:PULser:BURSt <n>
+    Emit <n> pulses, then stop the testpulser.
+    Answer:
+    PULBURST,<n>
+
+  SYSTem:COUNt? <gate_ms>[, <channel>]
+    Count rising edges on the rate input of <channel> (0 ... 3, A0 ... A3,
+    default 0: the aux input A0) for <gate_ms> milliseconds.
+    Answer:
+    COUNT,<gate_ms>,<counts>
+
+  SYSTem:FLOW?
+    Get the number of bytes the host may send without waiting for an answer
+    (credit based flow control). Every command is read completely from the
+    receive buffer before it is answered, so each answer returns the bytes of
+    its command to the host.
+    Answer:
+    FLOW,<credits>
+
+  SYSTem:SPI:CLOCk <hz>
+  SYSTem:SPI:CLOCk?
+    Set / get the SPI clock. The fastest clock F_CPU / 2^n (n = 1 ... 7)
+    not above <hz> is used, i.e. 125 kHz ... 8 MHz on the Uno.
+    Answer with the clock in use:
+    SPICLK,<hz>
+
+  SYSTem:STATistics?
+    Performance counters since start or reset: executed commands, SPI
+    transfers, cumulative microseconds spent parsing commands (until the
+    handler is called), in SPI transfers and writing answers to the serial
+    output, and how often the serial receive buffer was found full (the
+    host sent more than its credits, bytes may have been lost).
+    Answer:
+    STAT,<commands>,<spi_transfers>,<parse_us>,<spi_us>,<tx_us>,<rx_overflows>
+
+  SYSTem:STATistics:RESet
+    Reset the performance counters.
+    Answer:
+    STAT,0,0,0,0,0,0
+
+  SYSTem:CAPabilities?
+    Get the features of this firmware as a hex bitmap:
+      0x01 credit based flow control (SYSTem:FLOW?)
+      0x02 multicast SPI writes (SYSTem:SPI:MULticast)
+      0x04 performance counters (SYSTem:STATistics?)
+      0x08 configurable SPI clock (SYSTem:SPI:CLOCk)
+      0x10 higher baud rates (SYSTem:BAUD)
+      0x20 binary framing (reserved, not implemented)
+      0x40 trigger output (SYSTem:TRIGger)
+      0x80 streamed input rates (SYSTem:RATE)
+      0x100 stored configuration (*SAV, *RCL, SYSTem:CONFig)
+      0x200 gated counter (SYSTem:COUNt?)
+      0x400 testpulser timing (SYSTem:PULser:PERiod, DUTY and BURSt)
+      0x800 counter of every channel (<channel> of SYSTem:COUNt?)
+    Answer:
+    CAP,<hex bitmap>
+
+  SYSTem:BAUD <baud>
+  SYSTem:BAUD?
+    Set / get the serial baud rate: 115200, 250000, 500000 or 1000000.
+    The answer is sent at the old rate, then the rate is changed. If no valid
+    command arrives at the new rate within 1 s, the old rate is restored.
+    Answer with the (new) rate, the current one if <baud> is not supported:
+    BAUD,<baud>
+
+  SYSTem:TRIGger
+    Pulse the trigger output (A5) now. The output is high for 10 us after
+    every SPI write sent with <trigger> = 1, when the DAC outputs have
+    been updated (the DACs latch on the rising chip select).
+    Answer with the number of trigger pulses since start:
+    TRIG,<count>
+
+  SYSTem:RATE <interval_ms>
+  SYSTem:RATE?
+    Stream the rising edges on the rate inputs A0 ... A3 (the discriminator
+    outputs of channels 0 ... 3) every <interval_ms> (10 ... 10000 ms,
+    0 stops the stream). The samples are sent between the answers, without
+    a request, and all numbers are hex:
+    RATE,<sequence>,<elapsed_us>,<counts_0>,<counts_1>,<counts_2>,<counts_3>
+    <elapsed_us> is the time the counts were collected in. If the transmit
+    buffer is full, a sample is postponed and the next one covers the longer
+    time, so no edges are lost. Commands that take long (SYSTem:COUNt?) also
+    postpone the samples.
+    Answer with the interval in use:
+    RATEMON,<interval_ms>
+
 */
 
 #include <ArduinoLog.h>
+#include <EEPROM.h>
 #include <SPI.h>
 #include <TimerOne.h>
 #include <inttypes.h>
+#include <util/crc16.h>
 
 #include "Arduino.h"
+
+// more commands and tokens than the parser defaults
+#define SCPI_MAX_TOKENS 40
+#define SCPI_MAX_COMMANDS 40
+#define SCPI_HASH_TYPE uint16_t
 #include "Vrekrer_scpi_parser.h"
 
 #define TEST_PULSER_PIN 9
+#define PULSER_DEFAULT_PERIOD_US 500
+#define PULSER_MAX_PERIOD_US 1000000UL
+#define PULSER_MAX_DUTY 1023
+
+// rate inputs A0 ... A3 (aux input = A0), counted by a pin change
+// interrupt (PCINT8 ... PCINT11)
+#define RATE_CHANNELS 4
+#define RATE_INPUT_MASK 0x0F
+#define RATE_MIN_INTERVAL_MS 10
+#define RATE_MAX_INTERVAL_MS 10000
+#define MAX_COUNT_GATE_MS 10000
 
 #define CS_LOGIC_TIMING_I 2
 #define CS_PULSE_I 3
@@ -62,7 +216,49 @@ Commands:
 
 #define CS_COUNT 8
 
-#define ARDU_DISC_FW_VER "0.0.1"
+// receive buffer of HardwareSerial, one byte of the ring buffer stays empty.
+// One more byte is kept free, so a full buffer means the host sent more than
+// its credits (see Check_Rx_Overflow).
+#ifndef SERIAL_RX_BUFFER_SIZE
+#define SERIAL_RX_BUFFER_SIZE 64
+#endif
+#define FLOW_CREDITS (SERIAL_RX_BUFFER_SIZE - 2)
+
+#define SPI_DEFAULT_CLOCK_HZ 1000000UL
+
+#define SERIAL_DEFAULT_BAUD 115200UL
+#define BAUD_CONFIRM_MS 1000
+
+#define CAP_FLOW_CONTROL 0x01
+#define CAP_MULTICAST 0x02
+#define CAP_STATISTICS 0x04
+#define CAP_SPI_CLOCK 0x08
+#define CAP_BAUD 0x10
+#define CAP_BINARY 0x20
+#define CAP_TRIGGER 0x40
+#define CAP_RATE 0x80
+#define CAP_CONFIG 0x100
+#define CAP_COUNTER 0x200
+#define CAP_PULSER 0x400
+#define CAP_COUNTER_CHANNELS 0x800
+#define CAPABILITIES                                                           \
+    (CAP_FLOW_CONTROL | CAP_MULTICAST | CAP_STATISTICS | CAP_SPI_CLOCK |        \
+     CAP_BAUD | CAP_TRIGGER | CAP_RATE | CAP_CONFIG | CAP_COUNTER |            \
+     CAP_PULSER | CAP_COUNTER_CHANNELS)
+
+// spare pin, marks completed DAC updates for external instruments
+#define TRIGGER_PIN A5
+#define TRIGGER_PULSE_US 10
+
+#define ARDU_DISC_FW_VER "0.1.6"
+
+// register image of *SAV / *RCL
+#define IMAGE_CHANNELS 4
+#define IMAGE_VREF_BIT 0x10
+#define DAC_ADDRESS_VREF 0x08
+#define CONFIG_MAGIC 0xED5A
+#define CONFIG_AUTO_RESTORE 0x01
+#define CONFIG_EEPROM_ADDRESS 0
 
 // this array needs to have the same order in python:
 const int CS_ARRAY[8] = {CS_LOGIC_TIMING_I, CS_PULSE_I,     CS_DELAY_I,
@@ -73,6 +269,122 @@ SCPI_Parser my_instrument;
 
 const int intensity[11] = {0, 3, 5, 9, 15, 24, 38, 62, 99, 159, 255};
 
+// rising edges per rate input since start, wrap around
+volatile uint32_t edge_counts[RATE_CHANNELS] = {0, 0, 0, 0};
+
+// rate stream, see SYSTem:RATE (interval 0: off)
+uint32_t rate_interval_us = 0;
+uint32_t rate_last_us = 0;
+uint32_t rate_last_counts[RATE_CHANNELS];
+uint32_t rate_sequence = 0;
+
+uint32_t spi_clock_hz = SPI_DEFAULT_CLOCK_HZ;
+
+// performance counters, see SYSTem:STATistics?
+uint32_t stat_commands = 0;
+uint32_t stat_spi_transfers = 0;
+uint32_t stat_parse_us = 0;
+uint32_t stat_spi_us = 0;
+uint32_t stat_tx_us = 0;
+uint32_t stat_rx_overflows = 0;
+uint32_t execute_start_us = 0;
+bool handler_entered = false;
+
+// baud rates with less than 0.2 % error at 16 MHz
+const uint32_t BAUD_RATES[4] = {115200, 250000, 500000, 1000000};
+uint32_t serial_baud = SERIAL_DEFAULT_BAUD;
+uint32_t previous_baud = SERIAL_DEFAULT_BAUD;
+bool baud_pending = false;
+uint32_t baud_changed_ms = 0;
+
+uint32_t trigger_count = 0;
+
+// same layout in python (configstore.py), no padding on the AVR
+struct RegisterImage {
+    uint8_t written[CS_COUNT]; // bits 0 ... 3: channels, bit 4: VREF
+    uint16_t codes[CS_COUNT][IMAGE_CHANNELS];
+    uint16_t vref[CS_COUNT];
+};
+
+struct StoredConfig {
+    uint16_t magic;
+    uint8_t flags;
+    uint16_t checksum; // of the image
+    RegisterImage image;
+};
+
+// the registers written since start
+RegisterImage register_image;
+
+uint32_t pulser_period_us = PULSER_DEFAULT_PERIOD_US;
+uint16_t pulser_duty = 512;
+bool pulser_running = false;
+volatile uint32_t burst_remaining = 0;
+
+ISR(PCINT1_vect) {
+    static uint8_t previous = 0;
+    uint8_t state = PINC & RATE_INPUT_MASK;
+    // count rising edges only
+    uint8_t rising = state & ~previous;
+    previous = state;
+    if (rising & _BV(PINC0)) {
+        edge_counts[0]++;
+    }
+    if (rising & _BV(PINC1)) {
+        edge_counts[1]++;
+    }
+    if (rising & _BV(PINC2)) {
+        edge_counts[2]++;
+    }
+    if (rising & _BV(PINC3)) {
+        edge_counts[3]++;
+    }
+}
+
+void Init_Counter() {
+    pinMode(A0, INPUT);
+    pinMode(A1, INPUT);
+    pinMode(A2, INPUT);
+    pinMode(A3, INPUT);
+    PCMSK1 |= RATE_INPUT_MASK;
+    PCIFR |= _BV(PCIF1);
+    PCICR |= _BV(PCIE1);
+}
+
+void Snapshot_Counts(uint32_t *counts) {
+    noInterrupts();
+    for (uint8_t i = 0; i < RATE_CHANNELS; i++) {
+        counts[i] = edge_counts[i];
+    }
+    interrupts();
+}
+
+void Handler_Enter() {
+    // first statement of every command handler: the time since Execute
+    // started was spent parsing the command
+    stat_parse_us += micros() - execute_start_us;
+    handler_entered = true;
+    // a valid command confirms a new baud rate
+    baud_pending = false;
+}
+
+void Reply(Stream &interface, const char *response) {
+    uint32_t start = micros();
+    interface.print(response);
+    stat_tx_us += micros() - start;
+}
+
+void Check_Rx_Overflow() {
+    // HardwareSerial drops received bytes silently when its buffer is full,
+    // which a host that keeps to FLOW_CREDITS never fills
+    static bool rx_full = false;
+    bool full = Serial.available() >= SERIAL_RX_BUFFER_SIZE - 1;
+    if (full && !rx_full) {
+        stat_rx_overflows++;
+    }
+    rx_full = full;
+}
+
 void Init_CS() {
     for (uint8_t i = 0; i < CS_COUNT; i++) {
         pinMode(CS_ARRAY[i], OUTPUT);
@@ -90,8 +402,9 @@ void Set_CS(uint8_t cs_index, uint8_t value) {
 }
 
 uint32_t SPI_IO(uint8_t cs_index, uint8_t command, uint16_t data) {
+    uint32_t start = micros();
 
-    SPISettings spiSettings(1000000, MSBFIRST, SPI_MODE0);
+    SPISettings spiSettings(spi_clock_hz, MSBFIRST, SPI_MODE0);
     SPI.beginTransaction(spiSettings);
 
     Set_CS(cs_index, LOW);
@@ -100,9 +413,100 @@ uint32_t SPI_IO(uint8_t cs_index, uint8_t command, uint16_t data) {
     Set_CS(cs_index, HIGH);
     SPI.endTransaction();
 
+    stat_spi_transfers++;
+    stat_spi_us += micros() - start;
     return ((uint32_t)ret1 << 16) | ret2;
 }
 
+uint32_t SPI_Multicast(uint8_t cs_mask, uint8_t command, uint16_t data) {
+    uint32_t start = micros();
+
+    SPISettings spiSettings(spi_clock_hz, MSBFIRST, SPI_MODE0);
+    SPI.beginTransaction(spiSettings);
+
+    for (uint8_t i = 0; i < CS_COUNT; i++) {
+        if (cs_mask & (1 << i)) {
+            digitalWrite(CS_ARRAY[i], LOW);
+        }
+    }
+    uint8_t ret1 = SPI.transfer(command);
+    uint16_t ret2 = SPI.transfer16(data);
+    for (uint8_t i = 0; i < CS_COUNT; i++) {
+        digitalWrite(CS_ARRAY[i], HIGH);
+    }
+    SPI.endTransaction();
+
+    stat_spi_transfers++;
+    stat_spi_us += micros() - start;
+    return ((uint32_t)ret1 << 16) | ret2;
+}
+
+
+void Image_Write(uint8_t cs_index, uint8_t command, uint16_t data) {
+    // bits 7:3 of the command are the register address, bits 2:1 the
+    // operation, 00 = write
+    if (cs_index >= CS_COUNT || (command & 0x06) != 0) {
+        return;
+    }
+    uint8_t address = command >> 3;
+    if (address < IMAGE_CHANNELS) {
+        register_image.codes[cs_index][address] = data;
+        register_image.written[cs_index] |= 1 << address;
+    } else if (address == DAC_ADDRESS_VREF) {
+        register_image.vref[cs_index] = data;
+        register_image.written[cs_index] |= IMAGE_VREF_BIT;
+    }
+}
+
+uint16_t Image_Checksum(const RegisterImage &image) {
+    const uint8_t *bytes = (const uint8_t *)&image;
+    uint16_t crc = 0xFFFF;
+    for (uint16_t i = 0; i < sizeof(RegisterImage); i++) {
+        crc = _crc_ccitt_update(crc, bytes[i]);
+    }
+    return crc;
+}
+
+bool Load_Config(StoredConfig &config) {
+    EEPROM.get(CONFIG_EEPROM_ADDRESS, config);
+    return config.magic == CONFIG_MAGIC &&
+           config.checksum == Image_Checksum(config.image);
+}
+
+uint8_t Restore_Image(const RegisterImage &image) {
+    uint8_t restored = 0;
+    for (uint8_t i = 0; i < CS_COUNT; i++) {
+        if (image.written[i] & IMAGE_VREF_BIT) {
+            SPI_IO(i, DAC_ADDRESS_VREF << 3, image.vref[i]);
+            Image_Write(i, DAC_ADDRESS_VREF << 3, image.vref[i]);
+            restored++;
+        }
+        for (uint8_t channel = 0; channel < IMAGE_CHANNELS; channel++) {
+            if (image.written[i] & (1 << channel)) {
+                SPI_IO(i, channel << 3, image.codes[i][channel]);
+                Image_Write(i, channel << 3, image.codes[i][channel]);
+                restored++;
+            }
+        }
+    }
+    return restored;
+}
+
+void Init_Trigger() {
+    pinMode(TRIGGER_PIN, OUTPUT);
+    digitalWrite(TRIGGER_PIN, LOW);
+}
+
+void Pulse_Trigger() {
+    digitalWrite(TRIGGER_PIN, HIGH);
+    delayMicroseconds(TRIGGER_PULSE_US);
+    digitalWrite(TRIGGER_PIN, LOW);
+    trigger_count++;
+}
+
+bool Trigger_Requested(SCPI_P parameters, uint8_t index) {
+    return parameters.Size() > index && strtol(parameters[index], NULL, 0) == 1;
+}
 
 void send_identify_message(Stream *interface) {
     interface->println(F("ELB,ARDUDISC,#00," ARDU_DISC_FW_VER));
@@ -111,10 +515,14 @@ void send_identify_message(Stream *interface) {
 }
 
 void Identify(SCPI_C commands, SCPI_P parameters, Stream &interface) {  // NOLINT
-  send_identify_message(&interface);
+    Handler_Enter();
+    uint32_t start = micros();
+    send_identify_message(&interface);
+    stat_tx_us += micros() - start;
 }
 
 void SendSpi(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
     Log.info(F("SPI IO"));
 
     // Parameters: Index, command, data
@@ -134,40 +542,478 @@ void SendSpi(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
     Log.info("Payload: %d\n", payload_data);
 
     uint32_t answer = SPI_IO(cs_index, command, payload_data);
+    Image_Write(cs_index, command, payload_data);
+    if (Trigger_Requested(parameters, 3)) {
+        Pulse_Trigger();
+    }
 
     char response[32];
     snprintf(response, sizeof(response),
              "SPIRESP,%u,%u,%u,%lu\r\n",
              cs_index, command, payload_data, (unsigned long)answer);
-    interface.print(response);
+    Reply(interface, response);
+}
+
+void MulticastSpi(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    // Parameters: chip select mask, command, data
+    uint32_t cs_mask = 0;
+    uint8_t command = 0;
+    uint16_t payload_data = 0;
+    if (parameters.Size() == 3 || parameters.Size() == 4) {
+        cs_mask = strtoul(parameters[0], NULL, 0);
+        command = strtol(parameters[1], NULL, 0);
+        payload_data = strtol(parameters[2], NULL, 0);
+    }
+
+    uint32_t answer = 0;
+    // bits 2:1 of the command are the operation, 00 = write
+    if (cs_mask > 0 && cs_mask <= 0xFF && (command & 0x06) == 0) {
+        answer = SPI_Multicast(cs_mask, command, payload_data);
+        for (uint8_t i = 0; i < CS_COUNT; i++) {
+            if (cs_mask & (1 << i)) {
+                Image_Write(i, command, payload_data);
+            }
+        }
+        if (Trigger_Requested(parameters, 3)) {
+            Pulse_Trigger();
+        }
+    } else {
+        Log.error("Invalid multicast: %l, %d", cs_mask, command);
+    }
+
+    char response[40];
+    snprintf(response, sizeof(response),
+             "SPIMRESP,%lu,%u,%u,%lu\r\n",
+             (unsigned long)cs_mask, command, payload_data,
+             (unsigned long)answer);
+    Reply(interface, response);
+}
+
+uint32_t Pulser_Period_ns() {
+    // Same prescaler selection as TimerOne::setPeriod. The half period in timer
+    // ticks is in ICR1 (phase correct PWM counts up and down).
+    const uint32_t ticks = ICR1;
+    uint16_t prescaler = 1;
+    const uint32_t half_period_cycles =
+        ((F_CPU / 100000 * pulser_period_us) / 20);
+    if (half_period_cycles >= TIMER1_RESOLUTION * 256UL) {
+        prescaler = 1024;
+    } else if (half_period_cycles >= TIMER1_RESOLUTION * 64UL) {
+        prescaler = 256;
+    } else if (half_period_cycles >= TIMER1_RESOLUTION * 8UL) {
+        prescaler = 64;
+    } else if (half_period_cycles >= TIMER1_RESOLUTION) {
+        prescaler = 8;
+    }
+    return ticks * prescaler * (2000000000UL / F_CPU);
+}
+
+void Burst_ISR() {
+    // called at every timer overflow, i.e. once per pulse
+    if (burst_remaining > 1) {
+        burst_remaining--;
+    } else if (burst_remaining == 1) {
+        // suppress the following pulses, OCR1A is updated at TOP
+        burst_remaining = 0;
+        Timer1.setPwmDuty(TEST_PULSER_PIN, 0);
+    } else {
+        Timer1.stop();
+        Timer1.detachInterrupt();
+        pulser_running = false;
+    }
+}
+
+void Pulser_Start() {
+    Timer1.detachInterrupt();
+    burst_remaining = 0;
+    Timer1.pwm(TEST_PULSER_PIN, pulser_duty);
+    Timer1.start();
+    pulser_running = true;
+}
+
+void Pulser_Stop() {
+    Timer1.stop();
+    Timer1.detachInterrupt();
+    burst_remaining = 0;
+    pulser_running = false;
 }
 
 void DoTimer(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
     String last_header = String(commands.Last());
 
     last_header.toUpperCase();
     if (last_header.startsWith("ENA")) {
-        Timer1.start();
-        interface.print("Pulser,1\n");
+        Pulser_Start();
+        Reply(interface, "Pulser,1\n");
     } else if (last_header.startsWith("DIS")) {
-        Timer1.stop();
-        interface.print("Pulser,0\n");
+        Pulser_Stop();
+        Reply(interface, "Pulser,0\n");
+    } else {
+        Reply(interface, "Invalid Paramter\n");
+    }
+}
+
+void PulserPeriod(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    if (parameters.Size() > 0) {
+        pulser_period_us = strtoul(parameters[0], NULL, 0);
+        pulser_period_us = constrain(pulser_period_us, 1, PULSER_MAX_PERIOD_US);
+
+        // setPeriod restarts the clock and the duty is relative to the period
+        Timer1.setPeriod(pulser_period_us);
+        Timer1.setPwmDuty(TEST_PULSER_PIN, pulser_duty);
+        if (!pulser_running) {
+            Timer1.stop();
+        }
+    }
+
+    char response[32];
+    snprintf(response, sizeof(response), "PULPER,%lu\r\n",
+             (unsigned long)Pulser_Period_ns());
+    Reply(interface, response);
+}
+
+void PulserDuty(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    if (parameters.Size() > 0) {
+        uint32_t duty = strtoul(parameters[0], NULL, 0);
+        pulser_duty = constrain(duty, 0, PULSER_MAX_DUTY);
+        if (burst_remaining == 0) {
+            Timer1.setPwmDuty(TEST_PULSER_PIN, pulser_duty);
+        }
+    }
+
+    char response[32];
+    snprintf(response, sizeof(response), "PULDUTY,%u\r\n", pulser_duty);
+    Reply(interface, response);
+}
+
+void PulserBurst(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    uint32_t pulses = 1;
+    if (parameters.Size() > 0) {
+        pulses = strtoul(parameters[0], NULL, 0);
+    }
+
+    if (pulses == 0) {
+        Pulser_Stop();
     } else {
-        interface.print("Invalid Paramter\n");
+        Pulser_Stop();
+        Timer1.pwm(TEST_PULSER_PIN, pulser_duty);
+        burst_remaining = pulses;
+        Timer1.attachInterrupt(Burst_ISR);
+        Timer1.start();
+        pulser_running = true;
+    }
+
+    char response[32];
+    snprintf(response, sizeof(response), "PULBURST,%lu\r\n",
+             (unsigned long)pulses);
+    Reply(interface, response);
+}
+
+void GatedCount(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    uint32_t gate_ms = 100;
+    if (parameters.Size() > 0) {
+        gate_ms = strtoul(parameters[0], NULL, 0);
+    }
+    gate_ms = constrain(gate_ms, 1, MAX_COUNT_GATE_MS);
+    uint8_t channel = 0;
+    if (parameters.Size() > 1) {
+        uint32_t requested = strtoul(parameters[1], NULL, 0);
+        channel = constrain(requested, 0, RATE_CHANNELS - 1);
+    }
+
+    uint32_t start_counts[RATE_CHANNELS];
+    uint32_t end_counts[RATE_CHANNELS];
+    Snapshot_Counts(start_counts);
+    delay(gate_ms);
+    Snapshot_Counts(end_counts);
+    uint32_t counts = end_counts[channel] - start_counts[channel];
+
+    char response[32];
+    snprintf(response, sizeof(response), "COUNT,%lu,%lu\r\n",
+             (unsigned long)gate_ms, (unsigned long)counts);
+    Reply(interface, response);
+}
+
+void FlowCredits(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    char response[16];
+    snprintf(response, sizeof(response), "FLOW,%u\r\n",
+             (unsigned int)FLOW_CREDITS);
+    Reply(interface, response);
+}
+
+uint32_t Spi_Clock(uint32_t hz) {
+    // same choice as SPISettings: the fastest F_CPU / 2^n not above hz
+    uint32_t clock = F_CPU / 2;
+    while (clock > hz && clock > F_CPU / 128) {
+        clock /= 2;
+    }
+    return clock;
+}
+
+void SpiClock(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    if (parameters.Size() > 0) {
+        spi_clock_hz = Spi_Clock(strtoul(parameters[0], NULL, 0));
+    }
+
+    char response[32];
+    snprintf(response, sizeof(response), "SPICLK,%lu\r\n",
+             (unsigned long)Spi_Clock(spi_clock_hz));
+    Reply(interface, response);
+}
+
+void Statistics(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    String last_header = String(commands.Last());
+    last_header.toUpperCase();
+    if (last_header.startsWith("RES")) {
+        stat_commands = 0;
+        stat_spi_transfers = 0;
+        stat_parse_us = 0;
+        stat_spi_us = 0;
+        stat_tx_us = 0;
+        stat_rx_overflows = 0;
+    }
+
+    char response[80];
+    snprintf(response, sizeof(response), "STAT,%lu,%lu,%lu,%lu,%lu,%lu\r\n",
+             (unsigned long)stat_commands, (unsigned long)stat_spi_transfers,
+             (unsigned long)stat_parse_us, (unsigned long)stat_spi_us,
+             (unsigned long)stat_tx_us, (unsigned long)stat_rx_overflows);
+    Reply(interface, response);
+}
+
+void Capabilities(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    char response[16];
+    snprintf(response, sizeof(response), "CAP,%X\r\n", CAPABILITIES);
+    Reply(interface, response);
+}
+
+void Change_Baud(uint32_t baud) {
+    Serial.flush();
+    Serial.end();
+    Serial.begin(baud);
+    serial_baud = baud;
+}
+
+void Check_Baud_Confirmation() {
+    if (baud_pending && millis() - baud_changed_ms >= BAUD_CONFIRM_MS) {
+        // the host did not follow, go back
+        baud_pending = false;
+        Change_Baud(previous_baud);
+    }
+}
+
+void SetBaud(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    uint32_t baud = serial_baud;
+    if (parameters.Size() > 0) {
+        uint32_t requested = strtoul(parameters[0], NULL, 0);
+        for (uint8_t i = 0; i < 4; i++) {
+            if (BAUD_RATES[i] == requested) {
+                baud = requested;
+            }
+        }
+    }
+
+    char response[24];
+    snprintf(response, sizeof(response), "BAUD,%lu\r\n", (unsigned long)baud);
+    Reply(interface, response);
+
+    if (baud != serial_baud) {
+        previous_baud = serial_baud;
+        Change_Baud(baud);
+        baud_pending = true;
+        baud_changed_ms = millis();
+    }
+}
+
+void Trigger(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    Pulse_Trigger();
+    char response[24];
+    snprintf(response, sizeof(response), "TRIG,%lu\r\n",
+             (unsigned long)trigger_count);
+    Reply(interface, response);
+}
+
+void RateMonitor(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    if (parameters.Size() > 0) {
+        uint32_t interval_ms = strtoul(parameters[0], NULL, 0);
+        if (interval_ms == 0) {
+            rate_interval_us = 0;
+        } else {
+            interval_ms = constrain(interval_ms, RATE_MIN_INTERVAL_MS,
+                                    RATE_MAX_INTERVAL_MS);
+            rate_interval_us = interval_ms * 1000UL;
+            rate_sequence = 0;
+            rate_last_us = micros();
+            Snapshot_Counts(rate_last_counts);
+        }
+    }
+
+    char response[24];
+    snprintf(response, sizeof(response), "RATEMON,%lu\r\n",
+             (unsigned long)(rate_interval_us / 1000));
+    Reply(interface, response);
+}
+
+void Stream_Rates() {
+    if (rate_interval_us == 0) {
+        return;
+    }
+    uint32_t now = micros();
+    uint32_t elapsed_us = now - rate_last_us;
+    if (elapsed_us < rate_interval_us) {
+        return;
+    }
+    uint32_t counts[RATE_CHANNELS];
+    Snapshot_Counts(counts);
+
+    char sample[72];
+    int length = snprintf(
+        sample, sizeof(sample), "RATE,%lx,%lx,%lx,%lx,%lx,%lx\r\n",
+        (unsigned long)rate_sequence, (unsigned long)elapsed_us,
+        (unsigned long)(counts[0] - rate_last_counts[0]),
+        (unsigned long)(counts[1] - rate_last_counts[1]),
+        (unsigned long)(counts[2] - rate_last_counts[2]),
+        (unsigned long)(counts[3] - rate_last_counts[3]));
+    // writing to a full transmit buffer would block the commands, the
+    // next sample covers the time instead
+    if (Serial.availableForWrite() < length) {
+        return;
+    }
+    Reply(Serial, sample);
+    rate_sequence++;
+    rate_last_us = now;
+    for (uint8_t i = 0; i < RATE_CHANNELS; i++) {
+        rate_last_counts[i] = counts[i];
+    }
+}
+
+void SaveConfig(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    StoredConfig config;
+    if (!Load_Config(config)) {
+        config.flags = 0;
+    }
+    config.magic = CONFIG_MAGIC;
+    config.image = register_image;
+    config.checksum = Image_Checksum(config.image);
+    // put only writes the bytes that change
+    EEPROM.put(CONFIG_EEPROM_ADDRESS, config);
+
+    char response[16];
+    snprintf(response, sizeof(response), "SAV,%X\r\n", config.checksum);
+    Reply(interface, response);
+}
+
+void RecallConfig(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    StoredConfig config;
+    uint8_t restored = 0;
+    if (Load_Config(config)) {
+        restored = Restore_Image(config.image);
+    }
+
+    char response[16];
+    snprintf(response, sizeof(response), "RCL,%u\r\n", restored);
+    Reply(interface, response);
+}
+
+void ConfigState(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    StoredConfig config;
+    bool valid = Load_Config(config);
+    String last_header = String(commands.Last());
+    last_header.toUpperCase();
+    if (valid && last_header.startsWith("AUTO") && parameters.Size() > 0) {
+        if (strtol(parameters[0], NULL, 0) == 1) {
+            config.flags |= CONFIG_AUTO_RESTORE;
+        } else {
+            config.flags &= ~CONFIG_AUTO_RESTORE;
+        }
+        EEPROM.put(CONFIG_EEPROM_ADDRESS, config);
+    }
+
+    char response[24];
+    snprintf(response, sizeof(response), "CONF,%u,%u,%X\r\n", valid,
+             valid && (config.flags & CONFIG_AUTO_RESTORE),
+             valid ? config.checksum : 0);
+    Reply(interface, response);
+}
+
+void ConfigData(SCPI_C commands, SCPI_P parameters, Stream &interface) { // NOLINT
+    Handler_Enter();
+    StoredConfig config;
+    bool valid = Load_Config(config);
+    uint32_t start = micros();
+    interface.print(F("CONFDATA,"));
+    if (valid) {
+        const uint8_t *bytes = (const uint8_t *)&config.image;
+        for (uint16_t i = 0; i < sizeof(RegisterImage); i++) {
+            if (bytes[i] < 0x10) {
+                interface.print('0');
+            }
+            interface.print(bytes[i], HEX);
+        }
+    }
+    interface.print(F("\r\n"));
+    stat_tx_us += micros() - start;
+}
+
+void Restore_At_Start() {
+    StoredConfig config;
+    if (Load_Config(config) && (config.flags & CONFIG_AUTO_RESTORE)) {
+        Restore_Image(config.image);
     }
 }
 
 void setup() {
+    my_instrument.RegisterCommand(F("*SAV"), &SaveConfig);
+    my_instrument.RegisterCommand(F("*RCL"), &RecallConfig);
     my_instrument.RegisterCommand(F("*IDN?"), &Identify);
 
     my_instrument.SetCommandTreeBase(F("SYSTem:SPI"));
     my_instrument.RegisterCommand(F(":SENd"), &SendSpi);
+    my_instrument.RegisterCommand(F(":MULticast"), &MulticastSpi);
+    my_instrument.RegisterCommand(F(":CLOCk"), &SpiClock);
+    my_instrument.RegisterCommand(F(":CLOCk?"), &SpiClock);
 
     my_instrument.SetCommandTreeBase(F("SYSTem:PULser"));
     my_instrument.RegisterCommand(F(":DISable"), &DoTimer);
     my_instrument.RegisterCommand(F(":ENAble"), &DoTimer);
+    my_instrument.RegisterCommand(F(":PERiod"), &PulserPeriod);
+    my_instrument.RegisterCommand(F(":PERiod?"), &PulserPeriod);
+    my_instrument.RegisterCommand(F(":DUTY"), &PulserDuty);
+    my_instrument.RegisterCommand(F(":DUTY?"), &PulserDuty);
+    my_instrument.RegisterCommand(F(":BURSt"), &PulserBurst);
+
+    my_instrument.SetCommandTreeBase(F("SYSTem"));
+    my_instrument.RegisterCommand(F(":COUNt?"), &GatedCount);
+    my_instrument.RegisterCommand(F(":FLOW?"), &FlowCredits);
+    my_instrument.RegisterCommand(F(":STATistics?"), &Statistics);
+    my_instrument.RegisterCommand(F(":STATistics:RESet"), &Statistics);
+    my_instrument.RegisterCommand(F(":CAPabilities?"), &Capabilities);
+    my_instrument.RegisterCommand(F(":BAUD"), &SetBaud);
+    my_instrument.RegisterCommand(F(":BAUD?"), &SetBaud);
+    my_instrument.RegisterCommand(F(":TRIGger"), &Trigger);
+    my_instrument.RegisterCommand(F(":RATE"), &RateMonitor);
+    my_instrument.RegisterCommand(F(":RATE?"), &RateMonitor);
+    my_instrument.RegisterCommand(F(":CONFig?"), &ConfigState);
+    my_instrument.RegisterCommand(F(":CONFig:AUTO"), &ConfigState);
+    my_instrument.RegisterCommand(F(":CONFig:DATA?"), &ConfigData);
 
-    Serial.begin(115200);
+    Serial.begin(SERIAL_DEFAULT_BAUD);
     Log.begin(LOG_LEVEL_ERROR, &Serial);
 
     Init_CS();
@@ -176,11 +1022,33 @@ void setup() {
     SPI.setClockDivider(SPI_CLOCK_DIV8);
 
     pinMode(TEST_PULSER_PIN, OUTPUT);
-    Timer1.initialize(500);
-    Timer1.pwm(TEST_PULSER_PIN, 512);
+    Timer1.initialize(pulser_period_us);
+    Timer1.pwm(TEST_PULSER_PIN, pulser_duty);
     Timer1.stop();
 
+    Init_Counter();
+    Init_Trigger();
+
+    // the DACs are set before the host hears from the board
+    Restore_At_Start();
+
     send_identify_message(&Serial);
 }
 
-void loop() { my_instrument.ProcessInput(Serial, "\n"); }
+void loop() {
+    // ProcessInput split up to measure the parse time
+    Check_Rx_Overflow();
+    Check_Baud_Confirmation();
+    Stream_Rates();
+    char *message = my_instrument.GetMessage(Serial, "\n");
+    if (message != NULL) {
+        stat_commands++;
+        handler_entered = false;
+        execute_start_us = micros();
+        my_instrument.Execute(message, Serial);
+        if (!handler_entered) {
+            // unknown command
+            stat_parse_us += micros() - execute_start_us;
+        }
+    }
+}
@@ -23,7 +23,7 @@ logging.basicConfig(level=logging.INFO)
 from elb_ardu_disc import ELBArduDisc
 from typing import List
 
-ead = ELBArduDisc(serial_port="COM4")
+ead = ELBArduDisc()  # the only connected board, or e.g. serial_port="COM4"
 
 NUM_OF_CHANNELS = 4
 
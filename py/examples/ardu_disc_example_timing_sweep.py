@@ -17,7 +17,7 @@ Configuration:
 from elb_ardu_disc import ELBArduDisc
 
 if __name__ == "__main__":
-    ead = ELBArduDisc(serial_port="COM4")
+    ead = ELBArduDisc()  # the only connected board, or e.g. serial_port="COM4"
     ead._scpi.testpulser.switch_testpulser(on=True)
 
     for i in range(4):
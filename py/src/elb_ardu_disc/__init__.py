@@ -1,3 +1,69 @@
-from .dacs import DacMCP48FVB14, DacMCP48FXBX4, DacAddrV, DacVrefOptions, DacMCP48FVB24
-from .spi import SpiIO
-from .module import ELBArduDisc
+"""
+Python library to control the ELB_ARDU_DISC.
+
+The submodules are imported on first access, so that importing the package
+(e.g. for the command line tool) is fast and has no side effects.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "DacMCP48FVB14": ".dacs",
+    "DacMCP48FXBX4": ".dacs",
+    "DacAddrV": ".dacs",
+    "DacVrefOptions": ".dacs",
+    "DacMCP48FVB24": ".dacs",
+    "DacCs": ".dacs",
+    "SpiIO": ".spi",
+    "Capability": ".spi",
+    "ELBArduDisc": ".module",
+    "CommandScheduler": ".scheduler",
+    "CommandPriority": ".scheduler",
+    "ScheduledControl": ".scheduler",
+    "ELBArduDiscServer": ".daemon",
+    "ELBArduDiscClient": ".daemon",
+    "SCurveEdge": ".scan",
+    "SCurvePoint": ".scan",
+    "find_scurve_edge": ".scan",
+    "RegisterMap": ".registers",
+    "IntegrityVerifier": ".verifier",
+    "FirmwareModel": ".loopback",
+    "LoopbackSerial": ".loopback",
+    "LoopbackSpiIO": ".loopback",
+    "open_loopback": ".loopback",
+    "SimulatedBoard": ".simulator",
+    "PulseStream": ".simulator",
+    "SpiIoSpidev": ".spidev_io",
+    "open_spidev": ".spidev_io",
+    "discover_boards": ".discovery",
+    "LinearAxis": ".sweep",
+    "LogAxis": ".sweep",
+    "ListAxis": ".sweep",
+    "Product": ".sweep",
+    "Zip": ".sweep",
+    "SweepRunner": ".sweep",
+    "measure_link": ".planner",
+    "estimate_all": ".planner",
+    "recommend": ".planner",
+    "RateMonitor": ".ratemonitor",
+    "RateHistory": ".ratemonitor",
+    "Calibration": ".calibration",
+    "fit_measurements": ".calibration",
+    "read_measurements": ".calibration",
+    "ProvenanceLog": ".provenance",
+    "read_provenance": ".provenance",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,367 @@
+"""
+Calibration curves of the thresholds (code -> V) and of the timing
+(current and threshold code -> ns), fitted from measurement tables.
+
+Measurement table (CSV, e.g. collected from the oscilloscope), one row per point:
+
+    quantity,channel,current,code,value
+    threshold,0,,2048,0.012             code of the threshold DAC, V
+    delay,0,512,350,41.5                current and threshold code, ns
+    pulse_width,2,512,700,18.2
+    logic_delay,1,256,400,35.0          logic channels 0 (CH 01) and 1 (CH 23)
+
+fit_measurements() fits all channels of a quantity at once with vectorized
+numpy, large tables are split over processes. The result is saved as a small
+.npz file, which the library loads when connecting (needs numpy):
+
+    calibration = fit_measurements(read_measurements("scope.csv"))
+    calibration.save("board7.npz")
+    ead = ELBArduDisc(calibration_path="board7.npz")
+    ead.channel_control.set_threshold_v(0, 0.05)
+    ead.timing_control.set_channel_delay_ns(0, 40.0)  # keeps the delay current
+
+Models, per channel, fitted by linear least squares:
+    threshold   V = a + b * code
+    timing      ns = a + b * th / i + c / i + d * th
+A current i charging a capacitor up to the threshold th takes a time
+proportional to th / i; the other terms take up the offsets of the current
+source and of the comparator.
+"""
+
+import csv
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .registers import REGISTER_LAYOUT
+
+THRESHOLD = "threshold"
+DELAY = "delay"
+PULSE_WIDTH = "pulse_width"
+LOGIC_DELAY = "logic_delay"
+LOGIC_PULSE_WIDTH = "logic_pulse_width"
+
+# quantity -> register of the code, register of the current (None: no current)
+QUANTITIES: Dict[str, Tuple[str, Optional[str]]] = {
+    THRESHOLD: ("thr", None),
+    DELAY: ("delay_th", "delay_i"),
+    PULSE_WIDTH: ("pulse_th", "pulse_i"),
+    LOGIC_DELAY: ("logic_delay_th", "logic_delay_i"),
+    LOGIC_PULSE_WIDTH: ("logic_pw_th", "logic_pw_i"),
+}
+
+# tables with at least this many points are fitted in several processes
+PARALLEL_POINTS = 200000
+
+FORMAT_VERSION = 1
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The calibration needs numpy (pip install elb_ardu_disc[numpy])"
+        ) from None
+    return numpy
+
+
+def channel_count(quantity: str) -> int:
+    if quantity not in QUANTITIES:
+        raise ValueError(f"Unknown quantity {quantity!r}")
+    return len(REGISTER_LAYOUT[QUANTITIES[quantity][0]][1])
+
+
+def max_code(quantity: str) -> int:
+    # 12 bit MCP48FVB24 for the thresholds, 10 bit MCP48FVB14 for the timing
+    return (1 << (12 if quantity == THRESHOLD else 10)) - 1
+
+
+def term_count(quantity: str) -> int:
+    return 2 if QUANTITIES[quantity][1] is None else 4
+
+
+def _features(numpy, quantity: str, code, current):
+    """
+    Design matrix of the model of quantity, points x terms.
+    """
+    code = numpy.asarray(code, dtype=float)
+    if QUANTITIES[quantity][1] is None:
+        return numpy.stack([numpy.ones_like(code), code], axis=-1)
+    current = numpy.asarray(current, dtype=float)
+    return numpy.stack(
+        [numpy.ones_like(code), code / current, 1 / current, code], axis=-1
+    )
+
+
+class MeasurementTable(NamedTuple):
+    """
+    Measured points of one quantity, one array entry per point.
+    current is ignored for the threshold.
+    """
+
+    channel: "numpy.ndarray"
+    current: "numpy.ndarray"
+    code: "numpy.ndarray"
+    value: "numpy.ndarray"
+
+
+def read_measurements(path: str) -> Dict[str, MeasurementTable]:
+    """
+    Measurement tables of a CSV file (see the module docstring), by quantity.
+    """
+    numpy = _numpy()
+    rows: Dict[str, List[Tuple[int, float, int, float]]] = {}
+    with open(path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                quantity = row["quantity"].strip()
+                channel_count(quantity)
+                current = row["current"].strip() if row.get("current") else ""
+                rows.setdefault(quantity, []).append(
+                    (
+                        int(row["channel"]),
+                        float(current) if current else math.nan,
+                        int(row["code"]),
+                        float(row["value"]),
+                    )
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{path}, line {line}: {e}") from None
+    tables = {}
+    for quantity, points in rows.items():
+        columns = list(zip(*points))
+        tables[quantity] = MeasurementTable(
+            numpy.array(columns[0], dtype=int),
+            numpy.array(columns[1], dtype=float),
+            numpy.array(columns[2], dtype=int),
+            numpy.array(columns[3], dtype=float),
+        )
+    return tables
+
+
+class Curves(NamedTuple):
+    """
+    Fitted curves of all channels of a quantity. The rows of channels
+    without measurements are NaN.
+    """
+
+    quantity: str
+    coefficients: "numpy.ndarray"  # channels x terms
+    rms: "numpy.ndarray"  # residual of every channel, V or ns
+    points: "numpy.ndarray"  # measurements of every channel
+
+    def calibrated(self, channel: int) -> bool:
+        return 0 <= channel < len(self.points) and bool(self.points[channel])
+
+    def value(self, channel: int, code: int, current: int = None) -> float:
+        """
+        V or ns of the setting.
+        """
+        numpy = _numpy()
+        self._check(channel)
+        if QUANTITIES[self.quantity][1] is not None and not current:
+            raise ValueError(f"Invalid current code {current}")
+        features = _features(numpy, self.quantity, code, current)
+        return float(features @ self.coefficients[channel])
+
+    def code(self, channel: int, value: float, current: int = None) -> int:
+        """
+        Threshold code of the setting closest to value (V or ns) at current.
+        """
+        self._check(channel)
+        if QUANTITIES[self.quantity][1] is None:
+            a, b = self.coefficients[channel]
+            offset, slope = a, b
+        else:
+            if not current or current < 0:
+                raise ValueError(f"Invalid current code {current}")
+            a, b, c, d = self.coefficients[channel]
+            offset, slope = a + c / current, b / current + d
+        if slope == 0:
+            raise ValueError(f"{self.quantity} of channel {channel} does not change")
+        code = round((value - offset) / slope)
+        highest = max_code(self.quantity)
+        if code < 0 or code > highest:
+            raise ValueError(
+                f"Invalid {self.quantity}: {value} for channel {channel}. "
+                f"Calibrated range: {self.value(channel, 0, current):.4g} ... "
+                f"{self.value(channel, highest, current):.4g}"
+            )
+        return int(code)
+
+    def _check(self, channel: int):
+        if not self.calibrated(channel):
+            raise ValueError(f"No {self.quantity} calibration for channel {channel}")
+
+
+def _fit_channels(
+    quantity: str, channels: int, table: MeasurementTable
+) -> Tuple["numpy.ndarray", "numpy.ndarray", "numpy.ndarray"]:
+    """
+    Least squares fit of all channels at once: the points of every channel
+    are placed in a zero padded channels x points x terms array, padding
+    rows do not change the pseudo inverse.
+    """
+    numpy = _numpy()
+    terms = term_count(quantity)
+    channel = numpy.asarray(table.channel, dtype=int)
+    if channel.size and (channel.min() < 0 or channel.max() >= channels):
+        raise ValueError(f"Invalid channel in the {quantity} table")
+    features = _features(numpy, quantity, table.code, table.current)
+    if not numpy.all(numpy.isfinite(features)):
+        raise ValueError(f"The {quantity} table needs a current > 0 for every point")
+
+    order = numpy.argsort(channel, kind="stable")
+    channel = channel[order]
+    points = numpy.bincount(channel, minlength=channels)
+    sparse = (points > 0) & (points < terms)
+    if numpy.any(sparse):
+        raise ValueError(
+            f"{quantity}: channels {numpy.flatnonzero(sparse).tolist()} need "
+            f"at least {terms} points"
+        )
+    position = numpy.arange(len(channel)) - numpy.repeat(
+        numpy.cumsum(points) - points, points
+    )
+    design = numpy.zeros((channels, max(points.max(initial=0), 1), terms))
+    target = numpy.zeros(design.shape[:2])
+    design[channel, position] = features[order]
+    target[channel, position] = numpy.asarray(table.value, dtype=float)[order]
+
+    coefficients = numpy.einsum("ctp,cp->ct", numpy.linalg.pinv(design), target)
+    residuals = numpy.einsum("cpt,ct->cp", design, coefficients) - target
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        rms = numpy.sqrt((residuals**2).sum(axis=1) / points)
+    coefficients[points == 0] = numpy.nan
+    return coefficients, rms, points
+
+
+def _fit_job(job):
+    quantity, channels, table = job
+    return _fit_channels(quantity, channels, table)
+
+
+def _split(numpy, table: MeasurementTable, channel: int) -> MeasurementTable:
+    """
+    Points of one channel, renumbered as channel 0.
+    """
+    mask = numpy.asarray(table.channel) == channel
+    return MeasurementTable(
+        numpy.zeros(int(mask.sum()), dtype=int),
+        numpy.asarray(table.current)[mask],
+        numpy.asarray(table.code)[mask],
+        numpy.asarray(table.value)[mask],
+    )
+
+
+def fit_measurements(
+    tables: Dict[str, MeasurementTable], processes: int = None
+) -> "Calibration":
+    """
+    Fit the curves of all quantities in tables.
+    processes: 1 to fit in this process, None to use a process per CPU for
+    tables with PARALLEL_POINTS or more
+    """
+    numpy = _numpy()
+    for quantity in tables:
+        channel_count(quantity)
+    total = sum(len(table.value) for table in tables.values())
+    if processes is None:
+        processes = 1 if total < PARALLEL_POINTS else 0
+    if processes == 1:
+        results = {
+            quantity: _fit_channels(quantity, channel_count(quantity), table)
+            for quantity, table in tables.items()
+        }
+    else:
+        # imported here, it takes longer than the rest of the module
+        from concurrent.futures import ProcessPoolExecutor
+
+        # one job per channel, the channels are joined again afterwards
+        jobs = [
+            (quantity, channel)
+            for quantity in tables
+            for channel in range(channel_count(quantity))
+        ]
+        with ProcessPoolExecutor(max_workers=processes or None) as pool:
+            fits = pool.map(
+                _fit_job,
+                [(q, 1, _split(numpy, tables[q], channel)) for q, channel in jobs],
+            )
+            parts: Dict[str, List] = {}
+            for (quantity, _), fit in zip(jobs, fits):
+                parts.setdefault(quantity, []).append(fit)
+        results = {
+            quantity: tuple(
+                numpy.concatenate([fit[index] for fit in fits]) for index in range(3)
+            )
+            for quantity, fits in parts.items()
+        }
+    return Calibration(
+        {
+            quantity: Curves(quantity, coefficients, rms, points)
+            for quantity, (coefficients, rms, points) in results.items()
+        }
+    )
+
+
+class Calibration:
+    """
+    Curves by quantity. Quantities without curves use the nominal values.
+    """
+
+    def __init__(self, curves: Dict[str, Curves] = None):
+        self.curves = dict(curves or {})
+
+    def __contains__(self, quantity: str) -> bool:
+        return quantity in self.curves
+
+    def __getitem__(self, quantity: str) -> Curves:
+        if quantity not in self.curves:
+            raise ValueError(f"No {quantity} calibration")
+        return self.curves[quantity]
+
+    def calibrated(self, quantity: str, channel: int) -> bool:
+        return quantity in self.curves and self.curves[quantity].calibrated(channel)
+
+    def summary(self) -> Iterable[Tuple[str, int, int, float]]:
+        """
+        (quantity, channel, points, rms residual) of the fitted channels.
+        """
+        for quantity, curves in self.curves.items():
+            for channel, points in enumerate(curves.points):
+                if points:
+                    yield quantity, channel, int(points), float(curves.rms[channel])
+
+    def save(self, path: str):
+        numpy = _numpy()
+        arrays = {"version": numpy.array(FORMAT_VERSION)}
+        for quantity, curves in self.curves.items():
+            arrays[f"{quantity}.coefficients"] = curves.coefficients
+            arrays[f"{quantity}.rms"] = curves.rms.astype(numpy.float32)
+            arrays[f"{quantity}.points"] = curves.points.astype(numpy.uint32)
+        numpy.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Calibration":
+        numpy = _numpy()
+        with numpy.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported calibration file {path}")
+            curves = {}
+            for quantity in QUANTITIES:
+                if f"{quantity}.coefficients" not in arrays:
+                    continue
+                coefficients = arrays[f"{quantity}.coefficients"]
+                if coefficients.shape != (
+                    channel_count(quantity),
+                    term_count(quantity),
+                ):
+                    raise ValueError(f"Invalid {quantity} curves in {path}")
+                curves[quantity] = Curves(
+                    quantity,
+                    coefficients,
+                    arrays[f"{quantity}.rms"].astype(float),
+                    arrays[f"{quantity}.points"].astype(int),
+                )
+        return cls(curves)
@@ -0,0 +1,339 @@
+"""
+Command line tool for the ELB_ARDU_DISC.
+
+    elb-ardu-disc --port COM4 apply config.json
+    elb-ardu-disc --port COM4 sweep channel_delay_threshold 350 900 --channels 0 1 2 3
+    elb-ardu-disc --port COM4 read
+    elb-ardu-disc --port COM4 bench -n 200
+    elb-ardu-disc discover
+    elb-ardu-disc calibrate scope.csv board7.npz
+    elb-ardu-disc --port COM4 --calibration board7.npz apply config.json
+
+The library is only imported by the subcommands, so --help starts quickly.
+
+Configuration file (JSON), all entries are optional:
+    {
+        "channels": [{"threshold_v": 0.05, "hysteresis": 500, "delay_current": 512}, ...],
+        (the *_ns settings need --calibration)
+        "logic": [{"delay_current": 512, "pulse_width_threshold": 512}, ...],
+        "pulser": {"enabled": true, "period_us": 500, "duty_cycle": 0.5}
+    }
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+PORT_ENVIRONMENT_VARIABLE = "ELB_ARDU_DISC_PORT"
+
+# configuration key -> (control attribute, setter)
+CHANNEL_SETTINGS = {
+    "threshold": ("channel_control", "set_threshold"),
+    "threshold_v": ("channel_control", "set_threshold_v"),
+    "hysteresis": ("channel_control", "set_hysteresis"),
+    "delay_current": ("timing_control", "set_channel_delay_current"),
+    "delay_threshold": ("timing_control", "set_channel_delay_threshold"),
+    "pulse_width_current": ("timing_control", "set_channel_pulse_width_current"),
+    "pulse_width_threshold": ("timing_control", "set_channel_pulse_width_threshold"),
+    "delay_ns": ("timing_control", "set_channel_delay_ns"),
+    "pulse_width_ns": ("timing_control", "set_channel_pulse_width_ns"),
+}
+
+LOGIC_SETTINGS = {
+    "delay_current": ("timing_control", "set_logic_delay_current"),
+    "delay_threshold": ("timing_control", "set_logic_delay_threshold"),
+    "pulse_width_current": ("timing_control", "set_logic_pulse_width_current"),
+    "pulse_width_threshold": ("timing_control", "set_logic_pulse_width_threshold"),
+    "delay_ns": ("timing_control", "set_logic_delay_ns"),
+    "pulse_width_ns": ("timing_control", "set_logic_pulse_width_ns"),
+}
+
+# sweepable settings: "channel_<key>" or "logic_<key>"
+SWEEP_SETTINGS = {
+    **{f"channel_{key}": value for key, value in CHANNEL_SETTINGS.items()},
+    **{f"logic_{key}": value for key, value in LOGIC_SETTINGS.items()},
+}
+
+
+def _setter(ead, setting):
+    control, method = setting
+    return getattr(getattr(ead, control), method)
+
+
+def apply_configuration(ead, config: dict):
+    for group, settings in (("channels", CHANNEL_SETTINGS), ("logic", LOGIC_SETTINGS)):
+        for channel, channel_config in enumerate(config.get(group, [])):
+            for key, value in (channel_config or {}).items():
+                if key not in settings:
+                    raise ValueError(f"Unknown setting {group}[{channel}].{key}")
+                if value is not None:
+                    _setter(ead, settings[key])(channel, value)
+
+    pulser = config.get("pulser")
+    if pulser:
+        if "period_us" in pulser:
+            ead.testpulser_control.set_period_us(pulser["period_us"])
+        if "duty_cycle" in pulser:
+            ead.testpulser_control.set_duty_cycle(pulser["duty_cycle"])
+        if "enabled" in pulser:
+            ead.testpulser_control.set_pulser(on=bool(pulser["enabled"]))
+
+
+def read_state(ead) -> dict:
+    """
+    Read back all DAC registers.
+    """
+    dac_control = ead._dac_control
+    state = {}
+    for name, dac in sorted(vars(dac_control).items()):
+        if not name.endswith("_dac"):
+            continue
+        state[name] = {
+            "codes": [dac.get_channel(channel) for channel in range(dac.channels)],
+            "refs": [ref.name for ref in dac.get_refs()],
+        }
+    return state
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def benchmark(ead, iterations: int = 100, spi_clock_hz: int = None) -> dict:
+    """
+    Round trip times of DAC reads (non-destructive) on the current link.
+    If the firmware has performance counters, the time per read spent in the
+    firmware is reported too; the rest of the round trip is the host and the
+    serial link.
+    """
+    from .spi import Capability
+
+    dac = ead._dac_control.channel_threshold_dac
+    scpi = ead._scpi
+    # without scpi the DACs are on a direct SPI link (see spidev_io.py)
+    statistics = scpi is not None and Capability.STATISTICS in scpi.capabilities
+    if spi_clock_hz is not None:
+        if scpi is None:
+            raise ValueError(
+                "The SPI clock can only be set through the firmware, the clock "
+                "of a direct SPI link is set when it is opened"
+            )
+        scpi.set_spi_clock(spi_clock_hz)
+    if statistics:
+        scpi.reset_statistics()
+
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        dac.get_channel(i % dac.channels)
+        durations.append(time.perf_counter() - start)
+    result = {
+        "iterations": iterations,
+        "mean_ms": 1e3 * sum(durations) / iterations,
+        "p50_ms": 1e3 * _percentile(durations, 0.5),
+        "p95_ms": 1e3 * _percentile(durations, 0.95),
+        "max_ms": 1e3 * max(durations),
+        "ops_per_s": iterations / sum(durations),
+    }
+    if statistics:
+        counters = scpi.get_statistics()
+        firmware_ms = {
+            "parse_ms": counters.parse_us / 1e3 / iterations,
+            "spi_ms": counters.spi_us / 1e3 / iterations,
+            "tx_ms": counters.tx_us / 1e3 / iterations,
+        }
+        firmware_ms["host_and_link_ms"] = result["mean_ms"] - sum(firmware_ms.values())
+        result["per_read"] = firmware_ms
+        result["spi_clock_hz"] = scpi.get_spi_clock()
+        result["rx_overflows"] = counters.rx_overflows
+    return result
+
+
+def _connect(args):
+    from .discovery import find_board
+    from .module import ELBArduDisc
+
+    port = args.port
+    if not port:
+        try:
+            port = find_board()
+        except RuntimeError as e:
+            raise SystemExit(
+                f"{e}. Use --port or set {PORT_ENVIRONMENT_VARIABLE}."
+            ) from None
+    return ELBArduDisc(
+        serial_port=port,
+        calibration_path=args.calibration,
+        max_baudrate=args.max_baudrate,
+    )
+
+
+def _cmd_apply(args):
+    with open(args.config) as f:
+        config = json.load(f)
+    ead = _connect(args)
+    try:
+        with ead.transaction():
+            apply_configuration(ead, config)
+    finally:
+        ead.close()
+
+
+def _cmd_sweep(args):
+    ead = _connect(args)
+    try:
+        setter = _setter(ead, SWEEP_SETTINGS[args.setting])
+        step = args.step if args.stop >= args.start else -args.step
+        for value in range(args.start, args.stop + (1 if step > 0 else -1), step):
+            for channel in args.channels:
+                setter(channel, value)
+            if args.dwell:
+                time.sleep(args.dwell)
+            if args.verbose:
+                print(value)
+    finally:
+        ead.close()
+
+
+def _cmd_read(args):
+    ead = _connect(args)
+    try:
+        print(json.dumps(read_state(ead), indent=2))
+    finally:
+        ead.close()
+
+
+def _cmd_bench(args):
+    ead = _connect(args)
+    try:
+        if args.spi_clock is not None and ead._scpi is None:
+            raise SystemExit("--spi-clock needs the serial link to the firmware")
+        print(json.dumps(benchmark(ead, args.iterations, args.spi_clock), indent=2))
+    finally:
+        ead.close()
+
+
+def _cmd_discover(args):
+    from .discovery import discover_boards
+
+    boards = discover_boards(timeout=args.timeout)
+    print(
+        json.dumps(
+            {number: board._asdict() for number, board in boards.items()}, indent=2
+        )
+    )
+
+
+def _cmd_rates(args):
+    ead = _connect(args)
+    try:
+        monitor = ead.start_rate_monitor(args.interval)
+        monitor.subscribe(
+            lambda sample: print(
+                " ".join(f"{rate:10.1f}" for rate in sample.rates), flush=True
+            )
+        )
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ead.close()
+
+
+def _cmd_calibrate(args):
+    from .calibration import fit_measurements, read_measurements
+
+    calibration = fit_measurements(
+        read_measurements(args.measurements), processes=args.processes
+    )
+    calibration.save(args.output)
+    for quantity, channel, points, rms in calibration.summary():
+        print(f"{quantity:18} channel {channel}: {points:7} points, rms {rms:.4g}")
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, not {value}")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="elb-ardu-disc", description="Control the ELB_ARDU_DISC4"
+    )
+    parser.add_argument(
+        "--port",
+        default=os.environ.get(PORT_ENVIRONMENT_VARIABLE),
+        help=f"serial port, e.g. COM4 (default: ${PORT_ENVIRONMENT_VARIABLE}, "
+        "else the only connected board)",
+    )
+    parser.add_argument(
+        "--calibration", help="calibration curves of the board (.npz, see calibrate)"
+    )
+    parser.add_argument(
+        "--max-baudrate",
+        type=_positive_int,
+        help="switch to the fastest serial baud rate up to this one "
+        "(default: stay at 115200)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    apply = commands.add_parser("apply", help="apply a JSON configuration file")
+    apply.add_argument("config")
+    apply.set_defaults(function=_cmd_apply)
+
+    sweep = commands.add_parser("sweep", help="sweep one setting over a range")
+    sweep.add_argument("setting", choices=sorted(SWEEP_SETTINGS))
+    sweep.add_argument("start", type=int)
+    sweep.add_argument("stop", type=int, help="inclusive")
+    sweep.add_argument(
+        "--step", type=_positive_int, default=1, help="the direction is stop - start"
+    )
+    sweep.add_argument("--channels", type=int, nargs="+", default=[0])
+    sweep.add_argument("--dwell", type=float, default=0, help="seconds per step")
+    sweep.add_argument("-v", "--verbose", action="store_true")
+    sweep.set_defaults(function=_cmd_sweep)
+
+    read = commands.add_parser("read", help="read back all DAC registers")
+    read.set_defaults(function=_cmd_read)
+
+    bench = commands.add_parser("bench", help="measure the link round trip time")
+    bench.add_argument("-n", "--iterations", type=int, default=100)
+    bench.add_argument("--spi-clock", type=int, help="set the SPI clock in Hz first")
+    bench.set_defaults(function=_cmd_bench)
+
+    rates = commands.add_parser(
+        "rates", help="print the rates of the discriminator outputs (Hz)"
+    )
+    rates.add_argument("--interval", type=int, default=100, help="ms")
+    rates.add_argument("--duration", type=float, default=10, help="seconds")
+    rates.set_defaults(function=_cmd_rates)
+
+    discover = commands.add_parser("discover", help="list the connected boards")
+    discover.add_argument("--timeout", type=float, default=0.5, help="seconds")
+    discover.set_defaults(function=_cmd_discover)
+
+    calibrate = commands.add_parser(
+        "calibrate", help="fit calibration curves to a measurement table (CSV)"
+    )
+    calibrate.add_argument("measurements")
+    calibrate.add_argument("output", help=".npz file")
+    calibrate.add_argument(
+        "--processes", type=int, help="default: several for large tables"
+    )
+    calibrate.set_defaults(function=_cmd_calibrate)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Register image of the configuration the firmware stores (firmware 0.1.3 or newer).
+
+The firmware keeps the last value written to every DAC channel and reference
+register. *SAV stores this image in the EEPROM, *RCL writes it to the DACs
+again, and with auto restore the board does that at power up, before the
+welcome message:
+
+    ead.save_configuration(auto_restore=True)
+    ead.configuration_matches()     # stored image == host register map
+    ead.recall_configuration()      # e.g. after a brown-out
+
+Layout of the image (RegisterImage in ardu/src/main.cpp, little endian):
+    written registers per chip (8 x u8, bits 0 ... 3 channels, bit 4 references),
+    channel codes (8 x 4 x u16), reference registers (8 x u16)
+The host builds the same image from its RegisterMap, so the checksums of
+both can be compared.
+"""
+
+import struct
+from typing import List, Tuple
+
+from .registers import CHANNELS_PER_CHIP, CHIP_COUNT, UNKNOWN, RegisterMap
+
+IMAGE = struct.Struct(f"<{CHIP_COUNT}B{CHIP_COUNT * CHANNELS_PER_CHIP}H{CHIP_COUNT}H")
+REFS_WRITTEN = 0x10
+
+
+def crc_ccitt(data: bytes, crc: int = 0xFFFF) -> int:
+    """
+    Checksum of the firmware, same as _crc_ccitt_update of avr-libc.
+    """
+    for byte in data:
+        byte ^= crc & 0xFF
+        byte = (byte ^ (byte << 4)) & 0xFF
+        crc = ((byte << 8) | (crc >> 8)) ^ (byte >> 4) ^ (byte << 3)
+    return crc & 0xFFFF
+
+
+def encode_image(register_map: RegisterMap) -> bytes:
+    """
+    Image of the registers the host has written.
+    """
+    written = [0] * CHIP_COUNT
+    codes = [0] * (CHIP_COUNT * CHANNELS_PER_CHIP)
+    refs = [0] * CHIP_COUNT
+    for index, code in enumerate(register_map.codes):
+        if code != UNKNOWN:
+            written[index // CHANNELS_PER_CHIP] |= 1 << (index % CHANNELS_PER_CHIP)
+            codes[index] = code
+    for cs_index, refs_word in enumerate(register_map.refs):
+        if refs_word != UNKNOWN:
+            written[cs_index] |= REFS_WRITTEN
+            refs[cs_index] = refs_word
+    return IMAGE.pack(*written, *codes, *refs)
+
+
+def decode_image(
+    image: bytes,
+) -> Tuple[List[Tuple[int, int, int]], List[Tuple[int, int]]]:
+    """
+    (cs_index, dac_channel, code) and (cs_index, refs_word) of the written
+    registers of an image.
+    """
+    if len(image) != IMAGE.size:
+        raise ValueError(f"Invalid register image of {len(image)} bytes")
+    values = IMAGE.unpack(image)
+    written = values[:CHIP_COUNT]
+    codes = values[CHIP_COUNT : CHIP_COUNT * (CHANNELS_PER_CHIP + 1)]
+    refs = values[CHIP_COUNT * (CHANNELS_PER_CHIP + 1) :]
+    channel_writes = []
+    refs_writes = []
+    for cs_index in range(CHIP_COUNT):
+        if written[cs_index] & REFS_WRITTEN:
+            refs_writes.append((cs_index, refs[cs_index]))
+        for dac_channel in range(CHANNELS_PER_CHIP):
+            if written[cs_index] & (1 << dac_channel):
+                code = codes[cs_index * CHANNELS_PER_CHIP + dac_channel]
+                channel_writes.append((cs_index, dac_channel, code))
+    return channel_writes, refs_writes
+
+
+def apply_image(register_map: RegisterMap, image: bytes, refs: bool = True):
+    """
+    Take over the registers the firmware restored from image.
+    refs: also the VREF settings, False if they were written since
+    """
+    channel_writes, refs_writes = decode_image(image)
+    for cs_index, refs_word in refs_writes if refs else []:
+        register_map.update_refs(cs_index, refs_word)
+    for cs_index, dac_channel, code in channel_writes:
+        register_map.update_channel(cs_index, dac_channel, code)
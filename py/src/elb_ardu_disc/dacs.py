@@ -1,5 +1,6 @@
-from typing import List
+from typing import List, Sequence
 from enum import Enum
+import time
 
 from .spi import SpiIO
 
@@ -11,6 +12,21 @@ DACs used:
 LOGIC_ANALYZER_DEV_MODE = True  # if true, don't check if the answer of the dac was correct. this allows development with logic analyzer and without ardudisc
 
 
+class DacCs(Enum):
+    """
+    Chip select index of each DAC, same order as CS_ARRAY in the firmware.
+    """
+
+    LOGIC_TIMING_I: int = 0
+    PULSE_I: int = 1
+    DELAY_I: int = 2
+    CHANNEL_HYS: int = 3
+    CHANNEL_THR: int = 4
+    LOGIC_TIMING_TH: int = 5
+    PULSE_TH: int = 6
+    DELAY_TH: int = 7
+
+
 class DacAddrV(Enum):
     Channel: List[int] = [0x00, 0x08, 0x10, 0x18]
     Vref: int = 0x40
@@ -27,6 +43,17 @@ class DacVrefOptions(Enum):
     VDD: int = 0b00
 
 
+# command bytes of the channel registers, without the Enum lookups
+_CHANNEL_WRITE_COMMANDS = tuple(
+    DacAddrV.CmdWrite.value | address for address in DacAddrV.Channel.value
+)
+_CHANNEL_READ_COMMANDS = tuple(
+    DacAddrV.CmdRead.value | address for address in DacAddrV.Channel.value
+)
+# 24 bit answer to a valid write: CMDERR bit high, SDO pulled up
+WRITE_OK_ANSWER = 0x01FFFF
+
+
 def _spi_io_error(spi_answer: List[int]):
     if spi_answer[0] == 1 and spi_answer[1] == 0xFF and spi_answer[2] == 0xFF:
         return False
@@ -40,8 +67,10 @@ class DacMCP48FXBX4:
         self.cs_index = cs_index
         self.channels = -1
         self.resolution = -1
+        # shadow of the written values, see registers.RegisterMap
+        self.register_map = None
 
-    def set_refs(self, ref_settings: List[DacVrefOptions]):
+    def _refs_word(self, ref_settings: List[DacVrefOptions]) -> int:
         if len(ref_settings) != 4:
             raise ValueError(
                 f"set_refs: wrong number reference selection settings given {len(ref_settings)}"
@@ -50,46 +79,114 @@ class DacMCP48FXBX4:
         data_word: int = 0
         for i, setting in enumerate(ref_settings):
             data_word |= (setting.value) << (i * 2)
+        return data_word
+
+    def set_refs(self, ref_settings: List[DacVrefOptions]):
+        data_word = self._refs_word(ref_settings)
         cmd_byte = DacAddrV.CmdWrite.value | DacAddrV.Vref.value
 
-        self._spi_w(command_byte=cmd_byte, data_word=data_word)
+        start = time.perf_counter()
+        self._spi_w(cmd_byte, data_word)
+        if self.register_map is not None:
+            self.register_map.update_refs(
+                self.cs_index, data_word, time.perf_counter() - start
+            )
 
     def set_all_refs_same(self, ref_setting: DacVrefOptions):
         ref_settings = [ref_setting] * self.channels
         self.set_refs(ref_settings)
 
-    def set_channel(self, channel: int, setting: int):
+    def refs_transfer(self, ref_settings: List[DacVrefOptions]) -> List[int]:
+        """
+        The 3 bytes set_refs sends, see channel_transfer.
+        """
+        data_word = self._refs_word(ref_settings)
+        cmd_byte = DacAddrV.CmdWrite.value | DacAddrV.Vref.value
+        return self._spi_bytes(command_byte=cmd_byte, data_word=data_word)
+
+    def _channel_write_command(self, channel: int, setting: int) -> int:
         if channel < 0 or channel >= self.channels:
             raise ValueError(f"Invalid channel {channel}")
-        if setting < 0 or setting >= 2**self.resolution:
+        if setting < 0 or setting >> self.resolution:
             raise ValueError(f"Invalid dac value {setting}")
+        return _CHANNEL_WRITE_COMMANDS[channel]
 
-        cmd_byte: bytes = DacAddrV.CmdWrite.value
-        cmd_byte |= DacAddrV.Channel.value[channel]
-        self._spi_w(command_byte=cmd_byte, data_word=setting)
+    def set_channel(self, channel: int, setting: int):
+        cmd_byte = self._channel_write_command(channel, setting)
+        start = time.perf_counter()
+        self._spi_w(cmd_byte, setting)
+        if self.register_map is not None:
+            self.register_map.update_channel(
+                self.cs_index, channel, setting, time.perf_counter() - start
+            )
 
-    def get_channel(self):
-        raise NotImplementedError("This method is not implemented yet")
+    def channel_transfer(self, channel: int, setting: int) -> List[int]:
+        """
+        The 3 bytes set_channel sends, for SpiIO.do_io_24_many.
+        Pass the answer to check_write_answer.
+        """
+        cmd_byte = self._channel_write_command(channel, setting)
+        return self._spi_bytes(command_byte=cmd_byte, data_word=setting)
 
-    def get_refs(self):
-        raise NotImplementedError("This method is not implemented yet")
+    def get_channel(self, channel: int) -> int:
+        if channel < 0 or channel >= self.channels:
+            raise ValueError(f"Invalid channel {channel}")
+
+        data_word = self._spi_r(_CHANNEL_READ_COMMANDS[channel])
+        return data_word & ((1 << self.resolution) - 1)
+
+    def get_refs(self) -> List[DacVrefOptions]:
+        cmd_byte = DacAddrV.CmdRead.value | DacAddrV.Vref.value
+        data_word = self._spi_r(command_byte=cmd_byte)
+        return [
+            DacVrefOptions((data_word >> (i * 2)) & 0b11) for i in range(self.channels)
+        ]
 
     def set_power_down(self):
         raise NotImplementedError("This method is not implemented yet")
 
-    def _execute_spi(self, command_byte: int, data_word: int):
+    @staticmethod
+    def _spi_bytes(command_byte: int, data_word: int) -> List[int]:
         bytes_to_send: List[int] = [command_byte]
         bytes_to_send.append((data_word & 0xFF00) >> 8)
         bytes_to_send.append((data_word & 0xFF))
-        answer: List[int] = self.spi.do_io_24(bytes_to_send, self.cs_index)
-        return answer
+        return bytes_to_send
 
-    def _spi_w(self, command_byte: int, data_word: int):
-        spi_answer = self._execute_spi(command_byte=command_byte, data_word=data_word)
+    def _spi_r(self, command_byte: int) -> int:
+        answer = self.spi.transfer_24(command_byte, 0, self.cs_index)
+        if not LOGIC_ANALYZER_DEV_MODE:
+            # bit 0 of the first byte is the CMDERR bit, low on an invalid command
+            if not answer & 0x010000:
+                raise IOError(f"SPI Communication Error. Answer was {answer:06X}")
+        return answer & 0xFFFF
+
+    @staticmethod
+    def check_write_answer(spi_answer: List[int]):
         if not LOGIC_ANALYZER_DEV_MODE:
             if _spi_io_error(spi_answer=spi_answer):
                 raise IOError(f"SPI Communication Error. Answer was {spi_answer}")
 
+    def _spi_w(self, command_byte: int, data_word: int):
+        answer = self.spi.transfer_24(command_byte, data_word, self.cs_index)
+        if not LOGIC_ANALYZER_DEV_MODE and answer != WRITE_OK_ANSWER:
+            raise IOError(f"SPI Communication Error. Answer was {answer:06X}")
+
+
+def multicast_write(
+    dacs: Sequence[DacMCP48FXBX4], data_out: List[int], trigger: bool = False
+):
+    """
+    Send the same write (e.g. from channel_transfer) to several DACs on one
+    SPI link, in one transaction if the link supports multicast.
+    trigger: pulse the trigger output afterwards
+    """
+    spi = dacs[0].spi
+    if any(dac.spi is not spi for dac in dacs):
+        raise ValueError("Multicast to DACs on different SPI links")
+    answers = spi.do_io_24_multicast(data_out, [dac.cs_index for dac in dacs], trigger)
+    for dac, answer in zip(dacs, answers):
+        dac.check_write_answer(answer)
+
 
 class DacMCP48FVB14(DacMCP48FXBX4):
     def __init__(self, spi, cs_index: int = -1):
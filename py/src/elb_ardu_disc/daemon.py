@@ -0,0 +1,388 @@
+"""
+Local control daemon for the ELB_ARDU_DISC.
+
+The daemon owns the serial port and serves any number of client processes
+(GUI, sweep scripts, monitoring) on a TCP localhost port or a Unix socket.
+Requests of all clients are collected in one queue. The dispatcher drains the
+queue in batches and executes them back to back on the link. Consecutive DAC
+writes of a batch are sent in one transaction (ead.transaction()), writes that
+are superseded by a later one of the same run are not sent to the board at all
+and answered with the result of the write that was sent.
+
+Protocol: one JSON object per line.
+Request:  {"id": 1, "target": "channel_control", "method": "set_threshold", "args": [0, 100]}
+Response: {"id": 1, "result": null} or {"id": 1, "error": "ValueError", "message": "..."}
+
+Usage:
+    python -m elb_ardu_disc.daemon COM4 --listen 127.0.0.1:5025
+
+    ead = ELBArduDiscClient("127.0.0.1:5025")  # instead of ELBArduDisc("COM4")
+    ead.channel_control.set_threshold_v(0, 0.05)
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+from enum import Enum
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "127.0.0.1:5025"
+# longer than the longest count gate (10 s) and its answer
+CLIENT_TIMEOUT_S = 30.0
+
+CONTROL_TARGETS = ("channel_control", "timing_control", "testpulser_control")
+# controls whose setters only write DAC registers and return nothing, so
+# they can be staged in a transaction and merged
+REGISTER_TARGETS = ("channel_control", "timing_control")
+
+_REMOTE_EXCEPTIONS = {
+    "ValueError": ValueError,
+    "RuntimeError": RuntimeError,
+    "TimeoutError": TimeoutError,
+    "NotImplementedError": NotImplementedError,
+    "OSError": OSError,
+    "AttributeError": AttributeError,
+    "TypeError": TypeError,
+}
+
+
+def _parse_address(address: str) -> Tuple[int, Any]:
+    """
+    "host:port" -> TCP, everything else is a Unix socket path.
+    """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError(f"Unix sockets are not supported here: {address}")
+    return socket.AF_UNIX, address
+
+
+def _json_result(result: Any) -> Any:
+    """
+    Futures of a scheduled ELBArduDisc are waited for, enums are sent as
+    their value and named tuples (e.g. SCurveEdge) as lists.
+    """
+    if isinstance(result, Future):
+        result = result.result()
+    if isinstance(result, Enum):
+        return _json_result(result.value)
+    if isinstance(result, (list, tuple)):
+        return [_json_result(item) for item in result]
+    if isinstance(result, dict):
+        return {key: _json_result(value) for key, value in result.items()}
+    return result
+
+
+class _PendingRequest:
+    def __init__(self, request: Dict, reply: Callable[[Dict], None]):
+        self.request = request
+        self.reply = reply
+
+    def key(self):
+        """
+        Writes with the same key replace each other (last write wins).
+        The last positional argument is the value, the others address the register.
+        None for everything else, e.g. reads and the pulser setters, which
+        return the achieved values.
+        """
+        method: str = self.request.get("method", "")
+        if (
+            self.request.get("target") not in REGISTER_TARGETS
+            or not method.startswith("set_")
+            or self.request.get("kwargs")
+        ):
+            return None
+        args = self.request.get("args", [])
+        return (self.request.get("target"), method, json.dumps(args[:-1]))
+
+
+class _ClientHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        write_lock = threading.Lock()
+
+        def reply(response: Dict):
+            try:
+                data = json.dumps(response)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Response {response.get('id')} not sent: {e}")
+                error = {"error": type(e).__name__, "message": str(e)}
+                data = json.dumps({"id": response.get("id"), **error})
+            data = (data + "\n").encode("utf-8")
+            with write_lock:
+                try:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                except (OSError, ValueError):
+                    # ValueError: the handler already closed the file
+                    logger.info("Client disconnected before reply")
+
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                reply({"id": None, "error": "ValueError", "message": str(e)})
+                continue
+            self.server.owner.enqueue(_PendingRequest(request, reply))
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class ELBArduDiscServer:
+    """
+    Serves the controls of one ELBArduDisc to many clients.
+    """
+
+    def __init__(self, ead, address: str = DEFAULT_ADDRESS, max_batch: int = 64):
+        self.ead = ead
+        self.address = address
+        self.max_batch = max_batch
+        self._requests = queue.Queue()
+
+        family, server_address = _parse_address(address)
+        if family == socket.AF_INET:
+            self._server = _TCPServer(server_address, _ClientHandler)
+        else:
+            self._server = _UnixServer(server_address, _ClientHandler)
+        self._server.owner = self
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="ELBArduDiscDispatcher", daemon=True
+        )
+
+    @property
+    def server_address(self):
+        return self._server.server_address
+
+    def enqueue(self, pending: _PendingRequest):
+        self._requests.put(pending)
+
+    def start(self):
+        """
+        Start serving in background threads.
+        """
+        self._dispatcher.start()
+        threading.Thread(
+            target=self._server.serve_forever, name="ELBArduDiscServer", daemon=True
+        ).start()
+
+    def serve_forever(self):
+        self._dispatcher.start()
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._requests.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+        if isinstance(self.server_address, str):
+            # Unix socket, else the next start fails with "address in use"
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.server_address)
+
+    def _next_batch(self) -> List[_PendingRequest]:
+        first = self._requests.get()
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                pending = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                self._requests.put(None)
+                break
+            batch.append(pending)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            # runs of consecutive register writes, anything else in between
+            # is executed on its own
+            run: List[_PendingRequest] = []
+            for pending in batch:
+                if pending.key() is not None:
+                    run.append(pending)
+                    continue
+                if run:
+                    self._execute_writes(run)
+                    run = []
+                pending.reply(self._execute(pending.request))
+            if run:
+                self._execute_writes(run)
+
+    def _transaction(self):
+        transaction = getattr(self.ead, "transaction", None)
+        if transaction is None or getattr(self.ead, "scheduler", None) is not None:
+            return contextlib.nullcontext()
+        return transaction()
+
+    def _execute_writes(self, run: List[_PendingRequest]):
+        """
+        Only the last write of every register, staged and sent in one burst.
+        If the last write fails, the one before it is tried, as a local
+        ELBArduDisc would have kept that value. Superseded writes are answered
+        with the response of the write that was sent, when the burst is through.
+        """
+        writes: Dict[Any, List[_PendingRequest]] = {}
+        for pending in run:
+            key = pending.key()
+            # in the order of the last write of every register
+            writes[key] = writes.pop(key, []) + [pending]
+
+        responses: Dict[int, Dict] = {}
+        sent: List[_PendingRequest] = []
+        try:
+            with self._transaction() if len(writes) > 1 else contextlib.nullcontext():
+                for candidates in writes.values():
+                    for index in range(len(candidates) - 1, -1, -1):
+                        response = self._execute(candidates[index].request)
+                        responses[id(candidates[index])] = response
+                        if "error" not in response:
+                            sent.append(candidates[index])
+                            for superseded in candidates[:index]:
+                                responses[id(superseded)] = response
+                            break
+        except Exception as e:
+            # sending the staged writes failed, none of them is known to be set
+            error = self._error(None, "commit", e)
+            for pending in sent:
+                for candidate in writes[pending.key()]:
+                    if responses[id(candidate)] is responses[id(pending)]:
+                        responses[id(candidate)] = error
+
+        for pending in run:
+            response = dict(responses[id(pending)])
+            response["id"] = pending.request.get("id")
+            pending.reply(response)
+
+    @staticmethod
+    def _error(request_id, name: str, e: Exception) -> Dict:
+        logger.info(f"Request {name} failed: {e}")
+        error = type(e).__name__
+        if error not in _REMOTE_EXCEPTIONS and isinstance(e, OSError):
+            error = "OSError"
+        return {"id": request_id, "error": error, "message": str(e)}
+
+    def _execute(self, request: Dict) -> Dict:
+        request_id = request.get("id")
+        target = request.get("target")
+        method: str = request.get("method", "")
+        try:
+            if target not in CONTROL_TARGETS or method.startswith("_"):
+                raise AttributeError(f"Invalid target {target}.{method}")
+            function = getattr(getattr(self.ead, target), method)
+            result = function(*request.get("args", []), **request.get("kwargs", {}))
+            return {"id": request_id, "result": _json_result(result)}
+        except Exception as e:
+            return self._error(request_id, f"{target}.{method}", e)
+
+
+class _RemoteControl:
+    def __init__(self, client: "ELBArduDiscClient", target: str):
+        self._client = client
+        self._target = target
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self._client._call(self._target, method, list(args), kwargs)
+
+        return call
+
+
+class ELBArduDiscClient:
+    """
+    Same controls as ELBArduDisc, executed by an ELBArduDiscServer.
+    """
+
+    def __init__(
+        self, address: str = DEFAULT_ADDRESS, timeout: float = CLIENT_TIMEOUT_S
+    ):
+        family, server_address = _parse_address(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(server_address)
+        if family == socket.AF_INET:
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile("rb")
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+        self.channel_control = _RemoteControl(self, "channel_control")
+        self.timing_control = _RemoteControl(self, "timing_control")
+        self.testpulser_control = _RemoteControl(self, "testpulser_control")
+
+    def _call(self, target: str, method: str, args: List, kwargs: Dict):
+        with self._lock:
+            self._next_id += 1
+            request = {"id": self._next_id, "target": target, "method": method}
+            request["args"] = args
+            if kwargs:
+                request["kwargs"] = kwargs
+            self._socket.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection to ELB_ARDU_DISC daemon closed")
+
+        response = json.loads(line)
+        if "error" in response:
+            exception = _REMOTE_EXCEPTIONS.get(response["error"], RuntimeError)
+            raise exception(response.get("message", ""))
+        return response.get("result")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ELB_ARDU_DISC control daemon")
+    parser.add_argument("serial_port", help="serial port of the board, e.g. COM4")
+    parser.add_argument(
+        "--listen",
+        default=DEFAULT_ADDRESS,
+        help="host:port for TCP or a path for a Unix socket",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from .module import ELBArduDisc
+
+    ead = ELBArduDisc(serial_port=args.serial_port)
+    server = ELBArduDiscServer(ead, args.listen)
+    logger.info(f"Serving {args.serial_port} on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
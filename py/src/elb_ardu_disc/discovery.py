@@ -0,0 +1,129 @@
+"""
+Find ELB_ARDU_DISC boards on the serial ports.
+
+All candidate ports are probed at the same time, so a search takes about one
+probe timeout, no matter how many ports there are. The ports are opened
+without DTR, so the boards are not reset (and keep their DAC settings).
+ELBArduDisc resets the board when it connects, unless reset=False:
+
+    boards = discover_boards()          # {usb serial number: BoardInfo}
+    ead = ELBArduDisc(serial_port=boards["5573932393735151F0C1"].port)
+    ead = ELBArduDisc()                 # the only connected board
+    ead = ELBArduDisc(reset=False)      # keeps running with its DAC settings
+
+The USB serial number stays the same across reboots, unlike ttyACM<n> or COM<n>.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+import serial
+from serial.tools import list_ports
+
+from .spi import ELBArduDiscSCPI
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT_S = 0.5
+
+
+class BoardInfo(NamedTuple):
+    port: str
+    serial_number: str  # USB serial number, the port if there is none
+    identification: str
+    firmware_version: str
+
+
+def _open_port(port: str, timeout: float):
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = 115200
+    ser.timeout = timeout
+    ser.write_timeout = timeout
+    # no reset of the board
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    return ser
+
+
+def probe_port(
+    port: str,
+    timeout: float = PROBE_TIMEOUT_S,
+    open_port: Optional[Callable[[str, float], object]] = None,
+) -> Optional[str]:
+    """
+    Identification of the ELB_ARDU_DISC on port, None if there is none.
+    open_port: returns an open serial-like object with the read timeout set
+    """
+    if open_port is None:
+        open_port = _open_port
+    try:
+        ser = open_port(port, timeout)
+    except (serial.SerialException, OSError) as e:
+        logger.debug(f"Cannot open {port}: {e}")
+        return None
+    try:
+        ser.reset_input_buffer()
+        ser.write(b"*IDN?\n")
+        # a board that is reset anyway sends the same line as welcome message
+        reply = ser.readline().decode("ascii", errors="ignore").strip()
+    except (serial.SerialException, OSError) as e:
+        logger.debug(f"Probing {port} failed: {e}")
+        return None
+    finally:
+        ser.close()
+    try:
+        compatible = ELBArduDiscSCPI.check_message_compatibility(reply)
+    except IndexError:
+        compatible = False
+    return reply if compatible else None
+
+
+def discover_boards(
+    ports: Optional[Sequence[str]] = None,
+    timeout: float = PROBE_TIMEOUT_S,
+    open_port: Optional[Callable[[str, float], object]] = None,
+) -> Dict[str, BoardInfo]:
+    """
+    Boards on ports (default: all serial ports), keyed by USB serial number.
+    """
+    serial_numbers = {info.device: info.serial_number for info in list_ports.comports()}
+    if ports is None:
+        ports = sorted(serial_numbers)
+    if not ports:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        replies = list(
+            executor.map(lambda port: probe_port(port, timeout, open_port), ports)
+        )
+
+    boards = {}
+    for port, reply in zip(ports, replies):
+        if reply is None:
+            continue
+        serial_number = serial_numbers.get(port) or port
+        boards[serial_number] = BoardInfo(
+            port, serial_number, reply, reply.split(",")[3]
+        )
+        logger.info(f"ELB_ARDU_DISC {serial_number} on {port}: {reply}")
+    return boards
+
+
+def find_board(serial_number: str = None, timeout: float = PROBE_TIMEOUT_S) -> str:
+    """
+    Port of the board with serial_number, or of the only connected board.
+    """
+    boards = discover_boards(timeout=timeout)
+    if serial_number is not None:
+        if serial_number not in boards:
+            raise RuntimeError(f"ELB_ARDU_DISC {serial_number} not found")
+        return boards[serial_number].port
+    if len(boards) != 1:
+        raise RuntimeError(
+            f"Found {len(boards)} ELB_ARDU_DISC boards "
+            f"({', '.join(sorted(boards)) or 'none'}), select one by serial number"
+        )
+    return next(iter(boards.values())).port
@@ -0,0 +1,831 @@
+"""
+In-memory loopback transports for tests and benchmarks.
+
+FirmwareModel models the request/response behaviour of the firmware and the
+registers of the DACs. LoopbackSerial is a serial.Serial replacement that
+answers every command line immediately, so the complete library including the
+SCPI encoding and the reply parsing runs without any OS I/O:
+
+    ead = open_loopback()
+    ead.channel_control.set_threshold(0, 100)
+    ead.loopback.dacs[DacCs.CHANNEL_THR.value].registers[0]  # -> 100
+
+LoopbackSpiIO skips the SCPI layer and talks to the DAC models directly.
+FakeSpiDev and FakeChipSelects replace spidev and the GPIO chip selects of
+spidev_io.SpiIoSpidev.
+"""
+
+import time
+from typing import Callable, Dict, List, Optional
+
+from .configstore import IMAGE, REFS_WRITTEN, crc_ccitt
+from .dacs import DacCs
+from .spi import SpiIO
+from .spidev_io import ChipSelects
+
+FIRMWARE_VERSION = "0.1.6"
+
+# same numbers as the firmware
+PULSER_MAX_PERIOD_US = 1000000
+PULSER_MAX_DUTY = 1023
+MAX_COUNT_GATE_MS = 10000
+F_CPU = 16000000
+TIMER1_RESOLUTION = 65536
+SERIAL_RX_BUFFER_SIZE = 64
+# one byte of the ring buffer is always empty, one more is kept free so a
+# full buffer means the host sent more than its credits
+FLOW_CREDITS = SERIAL_RX_BUFFER_SIZE - 2
+SPI_DEFAULT_CLOCK_HZ = 1000000
+SERIAL_DEFAULT_BAUD = 115200
+BAUD_RATES = (115200, 250000, 500000, 1000000)
+BAUD_CONFIRM_S = 1.0
+CAPABILITIES = 0x1F
+CAPABILITY_TRIGGER = 0x40
+TRIGGER_FW_VERSION = "0.1.1"
+CAPABILITY_RATE = 0x80
+RATE_FW_VERSION = "0.1.2"
+RATE_CHANNELS = 4
+RATE_MIN_INTERVAL_MS = 10
+RATE_MAX_INTERVAL_MS = 10000
+CAPABILITY_CONFIG = 0x100
+CONFIG_FW_VERSION = "0.1.3"
+# the counter and the pulser timing are older (0.0.2), only their bits are new
+CAPABILITY_COUNTER = 0x200
+COUNTER_BIT_FW_VERSION = "0.1.4"
+CAPABILITY_PULSER = 0x400
+PULSER_BIT_FW_VERSION = "0.1.5"
+CAPABILITY_COUNTER_CHANNELS = 0x800
+COUNTER_CHANNELS_FW_VERSION = "0.1.6"
+
+# (long form, short form) of all SCPI keywords of the firmware
+SCPI_KEYWORDS = [
+    ("SYSTEM", "SYST"),
+    ("SPI", "SPI"),
+    ("SEND", "SEN"),
+    ("MULTICAST", "MUL"),
+    ("PULSER", "PUL"),
+    ("ENABLE", "ENA"),
+    ("DISABLE", "DIS"),
+    ("PERIOD", "PER"),
+    ("DUTY", "DUTY"),
+    ("BURST", "BURS"),
+    ("COUNT", "COUN"),
+    ("FLOW", "FLOW"),
+    ("CLOCK", "CLOC"),
+    ("STATISTICS", "STAT"),
+    ("RESET", "RES"),
+    ("CAPABILITIES", "CAP"),
+    ("BAUD", "BAUD"),
+    ("TRIGGER", "TRIG"),
+    ("RATE", "RATE"),
+    ("CONFIG", "CONF"),
+    ("AUTO", "AUTO"),
+    ("DATA", "DATA"),
+]
+
+# firmware version that introduced a command, older models ignore it
+COMMAND_VERSIONS = {
+    "SYST:COUN?": "0.0.2",
+    "SYST:PUL:PER": "0.0.2",
+    "SYST:PUL:PER?": "0.0.2",
+    "SYST:PUL:DUTY": "0.0.2",
+    "SYST:PUL:DUTY?": "0.0.2",
+    "SYST:PUL:BURS": "0.0.2",
+    "SYST:FLOW?": "0.0.2",
+    "SYST:SPI:MUL": "0.0.3",
+    "SYST:SPI:CLOC": "0.0.4",
+    "SYST:SPI:CLOC?": "0.0.4",
+    "SYST:STAT?": "0.0.4",
+    "SYST:STAT:RES": "0.0.4",
+    "SYST:CAP?": "0.1.0",
+    "SYST:BAUD": "0.1.0",
+    "SYST:BAUD?": "0.1.0",
+    "SYST:TRIG": TRIGGER_FW_VERSION,
+    "SYST:RATE": RATE_FW_VERSION,
+    "SYST:RATE?": RATE_FW_VERSION,
+    "*SAV": CONFIG_FW_VERSION,
+    "*RCL": CONFIG_FW_VERSION,
+    "SYST:CONF?": CONFIG_FW_VERSION,
+    "SYST:CONF:AUTO": CONFIG_FW_VERSION,
+    "SYST:CONF:DATA?": CONFIG_FW_VERSION,
+}
+
+
+class DacModel:
+    """
+    Register file of one MCP48FVBx4.
+    Answers are the 24 bit read back from SDO, as returned by the firmware.
+    """
+
+    ANSWER_WRITE_OK = 0x01FFFF
+    ANSWER_ERROR = 0x00FFFF
+
+    def __init__(self, resolution: int = 10, channels: int = 4):
+        self.resolution = resolution
+        self.channels = channels
+        self.registers: List[int] = [0] * channels
+        self.vref = 0
+        self.power_down = 0
+        self.gain_status = 0
+
+    def reset(self):
+        """
+        Power on reset, e.g. after a brown-out.
+        """
+        self.registers = [0] * self.channels
+        self.vref = 0
+        self.power_down = 0
+        self.gain_status = 0
+
+    def _address_value(self, address: int) -> Optional[int]:
+        if address < self.channels:
+            return self.registers[address]
+        return {0x08: self.vref, 0x09: self.power_down, 0x0A: self.gain_status}.get(
+            address
+        )
+
+    def transfer(self, command: int, data: int) -> int:
+        address = command >> 3
+        operation = (command >> 1) & 0b11
+        current = self._address_value(address)
+        if current is None:
+            return self.ANSWER_ERROR
+
+        if operation == 0b11:  # read
+            return (0x01 << 16) | current
+        if operation != 0b00:
+            return self.ANSWER_ERROR
+
+        if address < self.channels:
+            self.registers[address] = data & ((1 << self.resolution) - 1)
+        elif address == 0x08:
+            self.vref = data & 0xFF
+        elif address == 0x09:
+            self.power_down = data & 0xFF
+        return self.ANSWER_WRITE_OK
+
+
+def _normalize_keyword(token: str) -> str:
+    token = token.upper()
+    for long_form, short_form in SCPI_KEYWORDS:
+        if token in (long_form, short_form):
+            return short_form
+    return token
+
+
+def _version_tuple(version: str):
+    return tuple(int(number) for number in version.split("."))
+
+
+class FirmwareModel:
+    """
+    Request/response behaviour of the firmware (see ardu/src/main.cpp).
+    Unknown commands are ignored, like the firmware does.
+
+    version: model an older firmware, without the commands added later
+    max_link_baudrate: fastest baud rate the serial link can carry
+    """
+
+    def __init__(
+        self, version: str = FIRMWARE_VERSION, max_link_baudrate: int = 1000000
+    ):
+        self.version = version
+        self.max_link_baudrate = max_link_baudrate
+        self.baudrate = SERIAL_DEFAULT_BAUD
+        self._previous_baudrate = SERIAL_DEFAULT_BAUD
+        self._baud_changed = None
+        self.dacs: Dict[int, DacModel] = {
+            cs.value: DacModel(resolution=12 if cs == DacCs.CHANNEL_THR else 10)
+            for cs in DacCs
+        }
+        self.pulser_running = False
+        self.pulser_period_us = 500
+        self.pulser_duty = 512
+        self.burst_pulses = 0
+        # count_source(gate_ms, channel): counts in a gate, override to model
+        # a signal on a rate input (channel 0 is the aux input)
+        self.count_source: Callable[[int, int], int] = lambda gate_ms, channel: 0
+        self.commands_processed = 0
+        self.has_trigger = _version_tuple(version) >= _version_tuple(TRIGGER_FW_VERSION)
+        self.has_rate = _version_tuple(version) >= _version_tuple(RATE_FW_VERSION)
+        self.has_config = _version_tuple(version) >= _version_tuple(CONFIG_FW_VERSION)
+        self.has_counter_bit = _version_tuple(version) >= _version_tuple(
+            COUNTER_BIT_FW_VERSION
+        )
+        self.has_pulser_bit = _version_tuple(version) >= _version_tuple(
+            PULSER_BIT_FW_VERSION
+        )
+        self.has_counter_channels = _version_tuple(version) >= _version_tuple(
+            COUNTER_CHANNELS_FW_VERSION
+        )
+        # register image of the writes since start and the one in the EEPROM
+        self.reset_image()
+        self.stored_image: Optional[bytes] = None
+        self.auto_restore = False
+        # commands_processed at each pulse of the trigger output
+        self.triggers: List[int] = []
+        self.spi_clock_hz = SPI_DEFAULT_CLOCK_HZ
+        # rising edges per second on the rate inputs, and the clock of the
+        # rate stream (replace it to step the time in tests)
+        self.input_rates = [0.0] * RATE_CHANNELS
+        self.clock: Callable[[], float] = time.monotonic
+        self.rate_interval_ms = 0
+        self._rate_sequence = 0
+        self._rate_last = 0.0
+        self._edges = [0.0] * RATE_CHANNELS
+        # rx_overflows is counted by LoopbackSerial(deferred=True)
+        self.reset_statistics()
+
+        self._header_cache: Dict[str, str] = {}
+        self._handlers = {
+            "*IDN?": self._identify,
+            "SYST:SPI:SEN": self._send_spi,
+            "SYST:SPI:MUL": self._multicast_spi,
+            "SYST:PUL:ENA": self._pulser_enable,
+            "SYST:PUL:DIS": self._pulser_disable,
+            "SYST:PUL:PER": self._pulser_period,
+            "SYST:PUL:PER?": self._pulser_period,
+            "SYST:PUL:DUTY": self._pulser_duty,
+            "SYST:PUL:DUTY?": self._pulser_duty,
+            "SYST:PUL:BURS": self._pulser_burst,
+            "SYST:COUN?": self._count,
+            "SYST:FLOW?": self._flow,
+            "SYST:SPI:CLOC": self._spi_clock,
+            "SYST:SPI:CLOC?": self._spi_clock,
+            "SYST:STAT?": self._statistics,
+            "SYST:STAT:RES": self._statistics,
+            "SYST:CAP?": self._capabilities,
+            "SYST:BAUD": self._baud,
+            "SYST:BAUD?": self._baud,
+            "SYST:TRIG": self._trigger,
+            "SYST:RATE": self._rate,
+            "SYST:RATE?": self._rate,
+            "*SAV": self._save,
+            "*RCL": self._recall,
+            "SYST:CONF?": self._config,
+            "SYST:CONF:AUTO": self._config,
+            "SYST:CONF:DATA?": self._config_data,
+        }
+        for header, introduced in COMMAND_VERSIONS.items():
+            if _version_tuple(version) < _version_tuple(introduced):
+                del self._handlers[header]
+
+    @property
+    def identification(self) -> str:
+        return f"ELB,ARDUDISC,#00,{self.version}"
+
+    def welcome_message(self) -> bytes:
+        return (self.identification + "\r\n").encode("ascii")
+
+    def check_baud_confirmation(self):
+        if (
+            self._baud_changed is not None
+            and time.monotonic() - self._baud_changed >= BAUD_CONFIRM_S
+        ):
+            # the host did not follow, go back
+            self._baud_changed = None
+            self.baudrate = self._previous_baudrate
+
+    def process_line(self, line: str) -> str:
+        """
+        Process one command line, returns the reply ("" for no reply).
+        """
+        line = line.strip()
+        if not line:
+            return ""
+        raw_header, _, parameter_string = line.partition(" ")
+        header = self._header_cache.get(raw_header)
+        if header is None:
+            query = raw_header.endswith("?")
+            keywords = raw_header.rstrip("?").lstrip(":").split(":")
+            header = ":".join(_normalize_keyword(k) for k in keywords) + "?" * query
+            self._header_cache[raw_header] = header
+        parameters = [p.strip() for p in parameter_string.split(",") if p.strip()]
+
+        self.stat_commands += 1
+        handler = self._handlers.get(header)
+        if handler is None:
+            return ""
+        self.commands_processed += 1
+        # a valid command confirms a new baud rate
+        self._baud_changed = None
+        return handler(header, parameters)
+
+    def reset_statistics(self):
+        self.stat_commands = 0
+        self.stat_spi_transfers = 0
+        self.stat_spi_us = 0
+        self.rx_overflows = 0
+
+    def spi_transfer(self, cs_index: int, command: int, data: int) -> int:
+        if self.has_config:
+            self._image_write(cs_index, command, data)
+        self.stat_spi_transfers += 1
+        # 24 bits, the overhead of the firmware is not modelled
+        self.stat_spi_us += 24 * 1000000 // self.spi_clock_hz
+        if cs_index not in self.dacs:
+            # the firmware falls back to chip select 0
+            cs_index = 0
+        return self.dacs[cs_index].transfer(command & 0xFF, data & 0xFFFF)
+
+    @staticmethod
+    def _int(value: str) -> int:
+        return int(value, 0)
+
+    def _identify(self, header: str, parameters: List[str]) -> str:
+        return self.identification + "\r\n"
+
+    def _send_spi(self, header: str, parameters: List[str]) -> str:
+        cs_index = self._int(parameters[0]) & 0xFF
+        command = self._int(parameters[1]) & 0xFF
+        payload = self._int(parameters[2]) & 0xFFFF
+        answer = self.spi_transfer(cs_index, command, payload)
+        self._trigger_requested(parameters, 3)
+        return f"SPIRESP,{cs_index},{command},{payload},{answer}\r\n"
+
+    def _multicast_spi(self, header: str, parameters: List[str]) -> str:
+        cs_mask, command, payload = 0, 0, 0
+        if len(parameters) in (3, 4):
+            cs_mask = self._int(parameters[0])
+            command = self._int(parameters[1]) & 0xFF
+            payload = self._int(parameters[2]) & 0xFFFF
+        answer = 0
+        if 0 < cs_mask <= 0xFF and command & 0x06 == 0:
+            answer = 0xFFFFFF
+            for cs_index in range(len(self.dacs)):
+                if cs_mask & (1 << cs_index):
+                    # the SDO outputs of the selected chips are wired together
+                    answer &= self.spi_transfer(cs_index, command, payload)
+            self._trigger_requested(parameters, 3)
+        return f"SPIMRESP,{cs_mask},{command},{payload},{answer}\r\n"
+
+    def _pulser_enable(self, header: str, parameters: List[str]) -> str:
+        self.pulser_running = True
+        self.burst_pulses = 0
+        return "Pulser,1\n"
+
+    def _pulser_disable(self, header: str, parameters: List[str]) -> str:
+        self.pulser_running = False
+        return "Pulser,0\n"
+
+    def pulser_period_ns(self) -> int:
+        # same prescaler selection as TimerOne::setPeriod
+        half_period_cycles = F_CPU // 100000 * self.pulser_period_us // 20
+        for prescaler in (1, 8, 64, 256, 1024):
+            if half_period_cycles < TIMER1_RESOLUTION * prescaler:
+                ticks = half_period_cycles // prescaler
+                break
+        else:
+            prescaler, ticks = 1024, TIMER1_RESOLUTION - 1
+        return ticks * prescaler * (2000000000 // F_CPU)
+
+    def _pulser_period(self, header: str, parameters: List[str]) -> str:
+        if parameters:
+            period = self._int(parameters[0])
+            self.pulser_period_us = min(max(period, 1), PULSER_MAX_PERIOD_US)
+        return f"PULPER,{self.pulser_period_ns()}\r\n"
+
+    def _pulser_duty(self, header: str, parameters: List[str]) -> str:
+        if parameters:
+            self.pulser_duty = min(max(self._int(parameters[0]), 0), PULSER_MAX_DUTY)
+        return f"PULDUTY,{self.pulser_duty}\r\n"
+
+    def _pulser_burst(self, header: str, parameters: List[str]) -> str:
+        pulses = self._int(parameters[0]) if parameters else 1
+        self.burst_pulses = pulses
+        # the burst is over immediately in the model
+        self.pulser_running = False
+        return f"PULBURST,{pulses}\r\n"
+
+    def _count(self, header: str, parameters: List[str]) -> str:
+        gate_ms = self._int(parameters[0]) if parameters else 100
+        gate_ms = min(max(gate_ms, 1), MAX_COUNT_GATE_MS)
+        channel = 0
+        if len(parameters) > 1 and self.has_counter_channels:
+            channel = min(max(self._int(parameters[1]), 0), RATE_CHANNELS - 1)
+        return f"COUNT,{gate_ms},{int(self.count_source(gate_ms, channel))}\r\n"
+
+    @staticmethod
+    def achieved_spi_clock(clock_hz: int) -> int:
+        clock = F_CPU // 2
+        while clock > clock_hz and clock > F_CPU // 128:
+            clock //= 2
+        return clock
+
+    def _spi_clock(self, header: str, parameters: List[str]) -> str:
+        if parameters:
+            self.spi_clock_hz = self.achieved_spi_clock(self._int(parameters[0]))
+        return f"SPICLK,{self.spi_clock_hz}\r\n"
+
+    def _statistics(self, header: str, parameters: List[str]) -> str:
+        if header.endswith(":RES"):
+            self.reset_statistics()
+        # parse and tx times of the model are 0
+        return (
+            f"STAT,{self.stat_commands},{self.stat_spi_transfers},0,"
+            f"{self.stat_spi_us},0,{self.rx_overflows}\r\n"
+        )
+
+    def pulse_trigger(self):
+        self.triggers.append(self.commands_processed)
+
+    def _trigger_requested(self, parameters: List[str], index: int):
+        if self.has_trigger and len(parameters) > index:
+            if self._int(parameters[index]) == 1:
+                self.pulse_trigger()
+
+    def _trigger(self, header: str, parameters: List[str]) -> str:
+        self.pulse_trigger()
+        return f"TRIG,{len(self.triggers)}\r\n"
+
+    def _capabilities(self, header: str, parameters: List[str]) -> str:
+        capabilities = CAPABILITIES
+        if self.has_trigger:
+            capabilities |= CAPABILITY_TRIGGER
+        if self.has_rate:
+            capabilities |= CAPABILITY_RATE
+        if self.has_config:
+            capabilities |= CAPABILITY_CONFIG
+        if self.has_counter_bit:
+            capabilities |= CAPABILITY_COUNTER
+        if self.has_pulser_bit:
+            capabilities |= CAPABILITY_PULSER
+        if self.has_counter_channels:
+            capabilities |= CAPABILITY_COUNTER_CHANNELS
+        return f"CAP,{capabilities:X}\r\n"
+
+    def _baud(self, header: str, parameters: List[str]) -> str:
+        # the answer is still sent at the old rate, see LoopbackSerial.write
+        baudrate = self.baudrate
+        if parameters and self._int(parameters[0]) in BAUD_RATES:
+            baudrate = self._int(parameters[0])
+        if baudrate != self.baudrate:
+            self._previous_baudrate = self.baudrate
+            self.baudrate = baudrate
+            self._baud_changed = time.monotonic()
+        return f"BAUD,{baudrate}\r\n"
+
+    def _rate(self, header: str, parameters: List[str]) -> str:
+        if parameters:
+            interval_ms = self._int(parameters[0])
+            if interval_ms == 0:
+                self.rate_interval_ms = 0
+            else:
+                self.rate_interval_ms = min(
+                    max(interval_ms, RATE_MIN_INTERVAL_MS), RATE_MAX_INTERVAL_MS
+                )
+                self._rate_sequence = 0
+                self._rate_last = self.clock()
+        return f"RATEMON,{self.rate_interval_ms}\r\n"
+
+    def rate_output(self) -> str:
+        """
+        The rate sample that is due, "" if there is none. Like the firmware,
+        one sample covers all the time since the last one.
+        """
+        if not self.rate_interval_ms:
+            return ""
+        now = self.clock()
+        elapsed_us = int(round((now - self._rate_last) * 1e6))
+        if elapsed_us < self.rate_interval_ms * 1000:
+            return ""
+        counts = []
+        for channel, rate in enumerate(self.input_rates):
+            edges = self._edges[channel] + rate * elapsed_us / 1e6
+            counts.append(int(edges) - int(self._edges[channel]))
+            self._edges[channel] = edges
+        sample = f"RATE,{self._rate_sequence:x},{elapsed_us:x}," + ",".join(
+            f"{count:x}" for count in counts
+        )
+        self._rate_sequence = (self._rate_sequence + 1) & 0xFFFFFFFF
+        self._rate_last = now
+        return sample + "\r\n"
+
+    def reset_image(self):
+        self.image_written = [0] * len(DacCs)
+        self.image_codes = [0] * (len(DacCs) * 4)
+        self.image_refs = [0] * len(DacCs)
+
+    def _image_write(self, cs_index: int, command: int, data: int):
+        address = command >> 3
+        if cs_index not in self.dacs or command & 0x06:
+            return
+        if address < 4:
+            self.image_codes[cs_index * 4 + address] = data
+            self.image_written[cs_index] |= 1 << address
+        elif address == 0x08:
+            self.image_refs[cs_index] = data
+            self.image_written[cs_index] |= REFS_WRITTEN
+
+    def image(self) -> bytes:
+        return IMAGE.pack(*self.image_written, *self.image_codes, *self.image_refs)
+
+    def _restore(self, image: bytes) -> int:
+        values = IMAGE.unpack(image)
+        written, codes, refs = values[:8], values[8:40], values[40:]
+        restored = 0
+        for cs_index in range(len(written)):
+            if written[cs_index] & REFS_WRITTEN:
+                self.spi_transfer(cs_index, 0x08 << 3, refs[cs_index])
+                restored += 1
+            for channel in range(4):
+                if written[cs_index] & (1 << channel):
+                    self.spi_transfer(
+                        cs_index, channel << 3, codes[cs_index * 4 + channel]
+                    )
+                    restored += 1
+        return restored
+
+    def power_cycle(self):
+        """
+        Power on of the board: the DACs and the image are reset, the stored
+        image is restored if auto restore is on.
+        """
+        for dac in self.dacs.values():
+            dac.reset()
+        self.reset_image()
+        self.baudrate = SERIAL_DEFAULT_BAUD
+        self.rate_interval_ms = 0
+        if self.stored_image is not None and self.auto_restore:
+            self._restore(self.stored_image)
+
+    def _save(self, header: str, parameters: List[str]) -> str:
+        self.stored_image = self.image()
+        return f"SAV,{crc_ccitt(self.stored_image):X}\r\n"
+
+    def _recall(self, header: str, parameters: List[str]) -> str:
+        restored = 0
+        if self.stored_image is not None:
+            restored = self._restore(self.stored_image)
+        return f"RCL,{restored}\r\n"
+
+    def _config(self, header: str, parameters: List[str]) -> str:
+        valid = self.stored_image is not None
+        if valid and header.endswith(":AUTO") and parameters:
+            self.auto_restore = self._int(parameters[0]) == 1
+        checksum = crc_ccitt(self.stored_image) if valid else 0
+        return f"CONF,{int(valid)},{int(valid and self.auto_restore)},{checksum:X}\r\n"
+
+    def _config_data(self, header: str, parameters: List[str]) -> str:
+        data = self.stored_image.hex().upper() if self.stored_image else ""
+        return f"CONFDATA,{data}\r\n"
+
+    def _flow(self, header: str, parameters: List[str]) -> str:
+        return f"FLOW,{FLOW_CREDITS}\r\n"
+
+
+class LoopbackSerial:
+    """
+    serial.Serial replacement connected to a FirmwareModel.
+    Commands are processed as soon as their line is complete.
+
+    With deferred=True the model behaves like a busy firmware: commands are
+    only processed when the host polls for input, and bytes that do not fit
+    into the receive buffer of the firmware are dropped and counted in overruns.
+    """
+
+    def __init__(
+        self,
+        firmware: FirmwareModel = None,
+        port: str = "loop://",
+        deferred: bool = False,
+    ):
+        self.firmware = firmware if firmware is not None else FirmwareModel()
+        self.port = port
+        self.baudrate = SERIAL_DEFAULT_BAUD
+        self.timeout = 2
+        self.dtr = True
+        self.rts = True
+        self.is_open = True
+        self.deferred = deferred
+        self.overruns = 0
+        self._rx = bytearray(self.firmware.welcome_message())
+        self._tx = bytearray()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_waiting(self) -> int:
+        if self.deferred:
+            self._process()
+        if self.firmware.rate_interval_ms and self._link_ok():
+            self._rx += self.firmware.rate_output().encode("ascii")
+        return len(self._rx)
+
+    def _link_ok(self) -> bool:
+        """
+        Bytes only arrive if both sides use the same rate and the link carries it.
+        """
+        self.firmware.check_baud_confirmation()
+        return (
+            self.baudrate == self.firmware.baudrate
+            and self.baudrate <= self.firmware.max_link_baudrate
+        )
+
+    def write(self, data: bytes) -> int:
+        if not self._link_ok():
+            return len(data)
+        if self.deferred:
+            free = SERIAL_RX_BUFFER_SIZE - 1 - len(self._tx)
+            overrun = max(len(data) - free, 0)
+            self.overruns += overrun
+            if 0 < free <= len(data):
+                # the firmware counts every time the buffer becomes full
+                self.firmware.rx_overflows += 1
+            self._tx += data[: max(free, 0)]
+        else:
+            self._tx += data
+            self._process()
+        return len(data)
+
+    def _process(self):
+        while True:
+            end = self._tx.find(b"\n")
+            if end < 0:
+                break
+            line = self._tx[:end].decode("ascii", errors="ignore")
+            del self._tx[: end + 1]
+            if self.firmware.rate_interval_ms:
+                # the firmware loop sends a due sample before the next command
+                self._rx += self.firmware.rate_output().encode("ascii")
+            reply = self.firmware.process_line(line)
+            if reply:
+                self._rx += reply.encode("ascii")
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def read_until(self, expected: bytes = b"\n", size: int = None) -> bytes:
+        end = self._rx.find(expected)
+        length = end + len(expected) if end >= 0 else len(self._rx)
+        if size is not None:
+            length = min(length, size)
+        return self.read(length)
+
+    def readline(self, size: int = None) -> bytes:
+        return self.read_until(b"\n", size)
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def flush(self):
+        pass
+
+
+class LoopbackSpiIO(SpiIO):
+    """
+    SpiIO directly on the DAC models, without the SCPI layer.
+    """
+
+    def __init__(self, firmware: FirmwareModel = None):
+        self.firmware = firmware if firmware is not None else FirmwareModel()
+        self.trigger = self.firmware.has_trigger
+
+    def pulse_trigger(self):
+        if not self.trigger:
+            super().pulse_trigger()
+        self.firmware.pulse_trigger()
+
+    def do_io_24(self, data_out: List[int], cs_index: int) -> List[int]:
+        if len(data_out) != 3:
+            raise RuntimeError(
+                f"Invalid SPI Data. Expecting list of 3 ints. Provided {data_out}"
+            )
+        answer = self.firmware.spi_transfer(
+            cs_index, data_out[0], (data_out[1] << 8) | data_out[2]
+        )
+        return [(answer >> 16) & 0xFF, (answer >> 8) & 0xFF, answer & 0xFF]
+
+    def transfer_24(self, command: int, data_word: int, cs_index: int) -> int:
+        return self.firmware.spi_transfer(cs_index, command, data_word)
+
+
+class ConstantReplySerial:
+    """
+    serial.Serial replacement that answers every line with the same reply,
+    by default a successful DAC write. It does not parse the commands, so a
+    benchmark on it measures the host side of the SCPI transport only.
+    """
+
+    def __init__(self, reply: bytes = b"SPIRESP,0,0,0,131071\r\n"):
+        self.reply = reply
+        self.port = "const://"
+        self.baudrate = SERIAL_DEFAULT_BAUD
+        self.is_open = True
+        self.bytes_written = 0
+        self._rx = bytearray()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    def write(self, data: bytes) -> int:
+        self.bytes_written += len(data)
+        self._rx += self.reply * data.count(b"\n")
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeChipSelects(ChipSelects):
+    def __init__(self):
+        self.selected: List[int] = []
+
+    def select(self, cs_indices):
+        self.selected = list(cs_indices)
+
+    def release(self):
+        self.selected = []
+
+
+class FakeSpiDev:
+    """
+    spidev.SpiDev replacement on the DAC models of a FirmwareModel.
+    The chips selected by chip_selects answer, their SDO outputs are wired
+    together, without a selected chip the pull-ups answer 0xFF.
+    """
+
+    def __init__(self, chip_selects: FakeChipSelects, firmware: FirmwareModel = None):
+        self.chip_selects = chip_selects
+        self.firmware = firmware if firmware is not None else FirmwareModel()
+        self.max_speed_hz = SPI_DEFAULT_CLOCK_HZ
+        self.is_open = True
+
+    def xfer2(self, data: List[int]) -> List[int]:
+        if len(data) != 3:
+            # the DACs only decode 24 bit frames
+            return [0xFF] * len(data)
+        answer = 0xFFFFFF
+        for cs_index in self.chip_selects.selected:
+            answer &= self.firmware.spi_transfer(
+                cs_index, data[0], (data[1] << 8) | data[2]
+            )
+        return [(answer >> 16) & 0xFF, (answer >> 8) & 0xFF, answer & 0xFF]
+
+    def close(self):
+        self.is_open = False
+
+
+def open_spidev_loopback(firmware: FirmwareModel = None, **kwargs):
+    """
+    ELBArduDisc on a SpiIoSpidev with a FakeSpiDev, see open_loopback.
+    """
+    from .module import ELBArduDisc
+    from .spidev_io import SpiIoSpidev
+
+    chip_selects = FakeChipSelects()
+    spi_device = FakeSpiDev(chip_selects, firmware)
+    ead = ELBArduDisc(spi=SpiIoSpidev(spi_device, chip_selects), **kwargs)
+    ead.loopback = spi_device.firmware
+    return ead
+
+
+def open_loopback(firmware: FirmwareModel = None, **kwargs):
+    """
+    ELBArduDisc connected to a FirmwareModel through a LoopbackSerial.
+    The model is available as the attribute loopback of the returned object.
+    """
+    from .module import ELBArduDisc
+    from .spi import ELBArduDiscSCPI
+
+    serial_connection = LoopbackSerial(firmware)
+    scpi = ELBArduDiscSCPI(port=None, serial_connection=serial_connection)
+    ead = ELBArduDisc(scpi=scpi, **kwargs)
+    ead.loopback = serial_connection.firmware
+    return ead
+
+
+def benchmark(function: Callable[[int], None], iterations: int = 10000) -> dict:
+    """
+    Call function(i) for i in range(iterations) and report the time per call.
+    With the loopback transports this measures the host CPU cost only,
+    including the firmware model. Use ConstantReplySerial to leave it out:
+
+        dac = DacMCP48FVB24(SpiIoAScpi(ConstantReplySerial()), 4)
+        benchmark(lambda i: dac.set_channel(i & 3, i & 0xFFF))
+    """
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(i)
+    duration = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "total_s": duration,
+        "us_per_call": 1e6 * duration / iterations,
+        "calls_per_s": iterations / duration,
+    }
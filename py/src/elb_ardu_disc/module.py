@@ -1,81 +1,516 @@
-from enum import Enum
-from typing import List
+from contextlib import contextmanager
+from typing import Callable, List, Sequence
 import time
 
-from .dacs import DacMCP48FVB14, DacMCP48FVB24, DacVrefOptions
-from .spi import ELBArduDiscSCPI
+from .configstore import apply_image, crc_ccitt, encode_image
+from .dacs import (
+    DacCs,
+    DacMCP48FVB14,
+    DacMCP48FVB24,
+    DacMCP48FXBX4,
+    DacVrefOptions,
+    multicast_write,
+)
+from .discovery import find_board
+from .provenance import ProvenanceLog
+from .ratemonitor import RateMonitor
+from .registers import RegisterMap
+from .scan import SCurveEdge, find_scurve_edge
+from .scheduler import CommandScheduler, ScheduledControl
+from .spi import Capability, CounterScpi, ELBArduDiscSCPI, SpiIO
+from .sweep import Plan, SweepRunner
 
 
-class DacCs(Enum):
-    LOGIC_TIMING_I: int = 0
-    PULSE_I: int = 1
-    DELAY_I: int = 2
-    CHANNEL_HYS: int = 3
-    CHANNEL_THR: int = 4
-    LOGIC_TIMING_TH: int = 5
-    PULSE_TH: int = 6
-    DELAY_TH: int = 7
-
 class ELBArduDisc:
-    def __init__(self, serial_port):
-        self._scpi = ELBArduDiscSCPI(port=serial_port, reset=True)
-        self._dac_control = ELBArduDiscDacControl(self._scpi)
-        self.channel_control = ELBArduDiscChannelControl(self._dac_control)
+    def __init__(
+        self,
+        serial_port=None,
+        scheduled: bool = False,
+        prioritize: bool = True,
+        record_path: str = None,
+        scpi: ELBArduDiscSCPI = None,
+        provenance_path: str = None,
+        max_baudrate: int = None,
+        spi: SpiIO = None,
+        calibration_path: str = None,
+        reset: bool = True,
+    ):
+        """
+        serial_port: None to use the only connected board (see discovery.py)
+        scheduled: route every control method through a CommandScheduler.
+        The methods then return futures instead of blocking.
+        Use e.g. channel_control.with_priority(CommandPriority.BULK) for sweeps,
+        so that interactive commands are not stuck behind them (prioritize=True).
+        record_path: record the serial traffic for a later replay (see recorder.py).
+        scpi: use this connection instead of opening serial_port
+        (e.g. loopback.open_loopback).
+        provenance_path: append every acknowledged DAC write to this file
+        (see provenance.py).
+        max_baudrate: switch to the fastest serial baud rate up to this one
+        that works, if the firmware can change it (e.g. 1000000). None keeps
+        115200, which every USB serial adapter carries.
+        spi: control the DACs directly through this SPI link instead of the
+        firmware (e.g. spidev_io.open_spidev). There is no testpulser and no
+        counter then, testpulser_control is None.
+        calibration_path: calibration curves of the board (.npz, see
+        calibration.py), used by set_threshold_v and the *_ns setters.
+        reset: reset the board when opening serial_port. False keeps it
+        running with its DAC settings (e.g. a board of discover_boards()),
+        ead.registers does not know them then.
+        """
+        if scpi is None and spi is None:
+            if serial_port is None:
+                serial_port = find_board()
+            scpi = ELBArduDiscSCPI(
+                port=serial_port,
+                reset=reset,
+                record_path=record_path,
+                max_baudrate=max_baudrate,
+            )
+        self._scpi = scpi
+        self._spi = spi if spi is not None else scpi.spi
+        # serializes the use of the link, shared with the verifier
+        self._lock = scpi.lock if scpi is not None else spi.lock
+        self.provenance = None
+        if provenance_path is not None:
+            self.provenance = ProvenanceLog(provenance_path)
+        self._dac_control = ELBArduDiscDacControl(
+            self._scpi, self.provenance, spi=self._spi
+        )
+        self.channel_control = ELBArduDiscChannelControl(
+            self._dac_control, self._scpi.counter if self._scpi is not None else None
+        )
         self.timing_control = ELBArduDiscTimingControl(self._dac_control)
-        self.testpulser_control = ELBArduDiscPulserControl(self._scpi)
+        self.testpulser_control = None
+        if self._scpi is not None:
+            self.testpulser_control = ELBArduDiscPulserControl(self._scpi)
+        self._pulser_control = self.testpulser_control
+        self.registers = self._dac_control.registers
+        if self._scpi is not None and self._scpi.started:
+            self._take_over_restored_configuration()
+        if calibration_path is not None:
+            from .calibration import Calibration
+
+            self.calibration = Calibration.load(calibration_path)
+        self.verifier = None
+        self.rate_monitor = None
+        # planner.LinkProfile of the last estimate_sweep
+        self.link_profile = None
+
+        self.scheduler = None
+        if scheduled:
+            self.scheduler = CommandScheduler(prioritize=prioritize)
+            self.channel_control = ScheduledControl(
+                self.channel_control, self.scheduler
+            )
+            self.timing_control = ScheduledControl(self.timing_control, self.scheduler)
+            if self.testpulser_control is not None:
+                self.testpulser_control = ScheduledControl(
+                    self.testpulser_control, self.scheduler
+                )
+
+    @property
+    def calibration(self) -> "Calibration":
+        """
+        Calibration curves in use, None for the nominal values.
+        """
+        return self._dac_control.calibration
+
+    @calibration.setter
+    def calibration(self, calibration: "Calibration"):
+        self._dac_control.calibration = calibration
+
+    def start_verifier(
+        self,
+        max_reads_per_s: float = 5.0,
+        idle_s: float = 0.2,
+        repair: bool = True,
+        on_mismatch: Callable[["Mismatch"], None] = None,
+    ) -> "IntegrityVerifier":
+        """
+        Read back the DAC registers in the background while the link is idle.
+        Mismatches are repaired (repair=True) and reported to on_mismatch.
+        """
+        from .verifier import IntegrityVerifier
+
+        self.stop_verifier()
+        self.verifier = IntegrityVerifier(
+            self.registers,
+            self._lock,
+            max_reads_per_s=max_reads_per_s,
+            idle_s=idle_s,
+            repair=repair,
+            on_mismatch=on_mismatch,
+        )
+        self.verifier.start()
+        return self.verifier
+
+    def stop_verifier(self):
+        if self.verifier is not None:
+            self.verifier.stop()
+            self.verifier = None
+
+    def start_rate_monitor(
+        self, interval_ms: int = 100, capacity: int = 10000
+    ) -> RateMonitor:
+        """
+        Stream the rates of the discriminator outputs (inputs A0 ... A3 of
+        the board, firmware 0.1.2 or newer) into a ring buffer of capacity
+        samples, see ratemonitor.py.
+        """
+        if self._scpi is None:
+            raise RuntimeError("No rate monitor without the firmware")
+        self.stop_rate_monitor()
+        monitor = RateMonitor(self._scpi, interval_ms, capacity)
+        monitor.start()
+        self.rate_monitor = monitor
+        return monitor
+
+    def stop_rate_monitor(self):
+        if self.rate_monitor is not None:
+            self.rate_monitor.stop()
+            self.rate_monitor = None
+
+    def sweep(self, plan: Plan, checkpoint_path: str = None, **kwargs) -> SweepRunner:
+        """
+        Iterate over the points of plan, see sweep.SweepRunner:
+
+            for index, point in ead.sweep(plan, "sweep.json"):
+                ...
+        """
+        return SweepRunner(self.registers, plan, checkpoint_path, **kwargs)
+
+    def estimate_sweep(
+        self, plan: Plan, dwell_s: float = 0.0, profile: "LinkProfile" = None
+    ) -> "Estimate":
+        """
+        Predicted duration of the sweep with dwell_s per point, for the fastest
+        strategy the link supports (see planner.py). The link is measured on
+        the first call, unless profile is given.
+        """
+        from .planner import (
+            BATCHED,
+            PIPELINED,
+            SEQUENTIAL,
+            measure_link,
+            recommend,
+            sweep_steps,
+        )
+
+        if profile is None:
+            if self.link_profile is None:
+                self.link_profile = measure_link(self)
+            profile = self.link_profile
+        # every point is applied, no transaction
+        return recommend(
+            profile,
+            sweep_steps(self.registers, plan),
+            dwell_s,
+            strategies=(SEQUENTIAL, PIPELINED, BATCHED),
+        )
+
+    def _config_scpi(self) -> ELBArduDiscSCPI:
+        if self._scpi is None:
+            raise RuntimeError("No stored configuration without the firmware")
+        if self.registers.staging:
+            raise RuntimeError("Stored configuration inside a transaction")
+        return self._scpi
+
+    def _take_over_restored_configuration(self):
+        """
+        With auto restore the board starts with its stored registers, so the
+        host knows them without writing them again. The VREF settings were
+        broadcast at connect.
+        """
+        scpi = self._scpi
+        if Capability.CONFIG not in scpi.capabilities:
+            return
+        stored = scpi.get_config()
+        if stored.valid and stored.auto_restore:
+            apply_image(self.registers, scpi.get_config_image(), refs=False)
+
+    def save_configuration(self, auto_restore: bool = None) -> int:
+        """
+        Store the DAC registers on the board (firmware 0.1.3 or newer),
+        returns the checksum. auto_restore: restore them at every power up,
+        None keeps the setting. See configstore.py.
+        """
+        scpi = self._config_scpi()
+        checksum = scpi.save_config()
+        if auto_restore is not None:
+            scpi.set_config_auto_restore(auto_restore)
+        return checksum
+
+    def recall_configuration(self) -> int:
+        """
+        Write the stored registers to the DACs and take them over into the
+        register map. Returns the number of restored registers.
+        """
+        scpi = self._config_scpi()
+        with self._lock:
+            restored = scpi.recall_config()
+            image = scpi.get_config_image()
+        if image:
+            apply_image(self.registers, image)
+        return restored
+
+    def configuration_checksum(self) -> int:
+        """
+        Checksum of the register map, as the board would store it.
+        """
+        return crc_ccitt(encode_image(self.registers))
+
+    def configuration_matches(self) -> bool:
+        """
+        True if the board stores exactly the registers the host has written.
+        """
+        stored = self._config_scpi().get_config()
+        return stored.valid and stored.checksum == self.configuration_checksum()
+
+    def trigger(self):
+        """
+        Pulse the trigger output of the board (firmware 0.1.1 or newer).
+        """
+        self._spi.pulse_trigger()
+
+    @contextmanager
+    def transaction(self, trigger: bool = False):
+        """
+        Stage the set_* calls of the channel, timing and pulser controls
+        and send them in one burst at the end of the block:
+
+            with ead.transaction():
+                for channel in range(4):
+                    ead.channel_control.set_threshold_v(channel, 0.05)
+                ead.testpulser_control.set_period_us(100)
+
+        Only the last value of every setting is sent, nothing if the block raises.
+        The pulser setters return the requested instead of the achieved values.
+        trigger: pulse the trigger output when everything is sent
+        """
+        if self.scheduler is not None:
+            raise RuntimeError("Transactions are not available with scheduled=True")
+        if self.registers.staging:
+            yield self
+            return
+        pulser = self._pulser_control
+        self.registers.begin()
+        if pulser is not None:
+            pulser.begin()
+        try:
+            yield self
+        except BaseException:
+            self.registers.discard()
+            if pulser is not None:
+                pulser.discard()
+            raise
+        pulser_staged = pulser is not None and pulser.staged
+        try:
+            self.registers.commit(trigger and not pulser_staged)
+        finally:
+            if pulser is not None:
+                pulser.commit()
+        if trigger and pulser_staged:
+            self.trigger()
+
+    def close(self):
+        self.stop_verifier()
+        self.stop_rate_monitor()
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.provenance is not None:
+            self.provenance.close()
+        if self._scpi is not None:
+            self._scpi.ser.close()
+        elif hasattr(self._spi, "close"):
+            self._spi.close()
+
 
 class ELBArduDiscPulserControl:
     def __init__(self, scpi: ELBArduDiscSCPI):
         self.scpi = scpi
-    def set_pulser(self, on : bool = True):
+        self.min_period_us = 1
+        self.max_period_us = 1000000
+        self.max_duty = 1023
+        # setting -> value during a transaction, see ELBArduDisc.transaction
+        self._staged = None
+
+    def begin(self):
+        self._staged = {}
+
+    def discard(self):
+        self._staged = None
+
+    @property
+    def staged(self) -> bool:
+        return bool(self._staged)
+
+    def commit(self):
+        staged, self._staged = self._staged, None
+        if not staged:
+            return
+        # switch on after the new timing is set
+        if "period" in staged:
+            self.scpi.testpulser.set_period(staged["period"])
+        if "duty" in staged:
+            self.scpi.testpulser.set_duty(staged["duty"])
+        if "on" in staged:
+            self.scpi.testpulser.switch_testpulser(on=staged["on"])
+
+    def set_pulser(self, on: bool = True):
+        if self._staged is not None:
+            self._staged["on"] = on
+            return
         self.scpi.testpulser.switch_testpulser(on=on)
 
+    def set_period_us(self, period_us: int) -> float:
+        """
+        Returns the period in us the hardware actually achieved.
+        """
+        period_us = int(round(period_us))
+        if period_us < self.min_period_us or period_us > self.max_period_us:
+            raise ValueError(
+                f"Invalid period: {period_us} us. Allowed Range: {self.min_period_us} us ... {self.max_period_us} us."
+            )
+        if self._staged is not None:
+            self._staged["period"] = period_us
+            return float(period_us)
+        return self.scpi.testpulser.set_period(period_us) / 1000
+
+    def get_period_us(self) -> float:
+        return self.scpi.testpulser.get_period() / 1000
+
+    def set_rate_hz(self, rate_hz: float) -> float:
+        """
+        Returns the rate in Hz the hardware actually achieved.
+        """
+        if rate_hz <= 0:
+            raise ValueError(f"Invalid rate: {rate_hz} Hz")
+        return 1e6 / self.set_period_us(1e6 / rate_hz)
+
+    def set_duty_cycle(self, duty_cycle: float) -> float:
+        """
+        duty_cycle: 0 ... 1. Returns the duty cycle that was set.
+        """
+        if duty_cycle < 0 or duty_cycle > 1:
+            raise ValueError(
+                f"Invalid duty cycle: {duty_cycle}. Allowed Range: 0 ... 1."
+            )
+        duty = int(round(duty_cycle * self.max_duty))
+        if self._staged is not None:
+            self._staged["duty"] = duty
+            return duty / self.max_duty
+        return self.scpi.testpulser.set_duty(duty) / self.max_duty
+
+    def get_duty_cycle(self) -> float:
+        return self.scpi.testpulser.get_duty() / self.max_duty
+
+    def burst(self, pulses: int):
+        """
+        Emit a burst of pulses with the current period and duty cycle.
+        The pulser is off afterwards.
+        """
+        if pulses < 1:
+            raise ValueError(f"Invalid number of pulses: {pulses}")
+        if self._staged is not None:
+            raise RuntimeError("A burst cannot be part of a transaction")
+        self.scpi.testpulser.burst(pulses)
+
 
 class ELBArduDiscDacControl:
-    def __init__(self, scpi: ELBArduDiscSCPI):
+    def __init__(
+        self,
+        scpi: ELBArduDiscSCPI,
+        provenance: ProvenanceLog = None,
+        spi: SpiIO = None,
+    ):
+        """
+        spi: SPI link of the DACs, default scpi.spi
+        """
         self.scpi = scpi
-        self.channel_threshold_dac = DacMCP48FVB24(
-            self.scpi.spi, DacCs.CHANNEL_THR.value
+        self.spi = spi if spi is not None else scpi.spi
+        self.channel_threshold_dac = DacMCP48FVB24(self.spi, DacCs.CHANNEL_THR.value)
+        self.channel_hysteresis_dac = DacMCP48FVB14(self.spi, DacCs.CHANNEL_HYS.value)
+
+        self.channel_delay_i_dac = DacMCP48FVB14(self.spi, DacCs.DELAY_I.value)
+        self.channel_delay_th_dac = DacMCP48FVB14(self.spi, DacCs.DELAY_TH.value)
+
+        self.channel_pulse_i_dac = DacMCP48FVB14(self.spi, DacCs.PULSE_I.value)
+        self.channel_pulse_th_dac = DacMCP48FVB14(self.spi, DacCs.PULSE_TH.value)
+
+        self.logic_timing_i_dac = DacMCP48FVB14(self.spi, DacCs.LOGIC_TIMING_I.value)
+        self.logic_timing_th_dac = DacMCP48FVB14(self.spi, DacCs.LOGIC_TIMING_TH.value)
+
+        # ordered by chip select index
+        self.dacs = sorted(
+            [
+                self.channel_threshold_dac,
+                self.channel_hysteresis_dac,
+                self.channel_delay_i_dac,
+                self.channel_delay_th_dac,
+                self.channel_pulse_i_dac,
+                self.channel_pulse_th_dac,
+                self.logic_timing_i_dac,
+                self.logic_timing_th_dac,
+            ],
+            key=lambda dac: dac.cs_index,
         )
-
-        self.channel_threshold_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-
-        self.channel_hysteresis_dac = DacMCP48FVB14(
-            self.scpi.spi, DacCs.CHANNEL_HYS.value
+        self.registers = RegisterMap(self.dacs)
+        self.registers.provenance = provenance
+        # calibration.Calibration, None for the nominal values
+        self.calibration = None
+
+        self.broadcast_refs(DacVrefOptions.ExtBuffered)
+
+    def broadcast_channel(
+        self, dacs: Sequence[DacMCP48FXBX4], channel: int, setting: int
+    ):
+        """
+        Set channel of all dacs to setting,
+        e.g. broadcast_channel([dc.channel_delay_i_dac, dc.channel_pulse_i_dac], 0, 512).
+        One SPI transaction if the firmware supports multicast.
+        """
+        self.registers.write(
+            [(dac.cs_index, channel, setting) for dac in dacs], force=True
         )
-        self.channel_hysteresis_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-
-        self.channel_delay_i_dac = DacMCP48FVB14(self.scpi.spi, DacCs.DELAY_I.value)
-        self.channel_delay_i_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-        self.channel_delay_th_dac = DacMCP48FVB14(self.scpi.spi, DacCs.DELAY_TH.value)
-        self.channel_delay_th_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
 
-        self.channel_pulse_i_dac = DacMCP48FVB14(self.scpi.spi, DacCs.PULSE_I.value)
-        self.channel_pulse_i_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-        self.channel_pulse_th_dac = DacMCP48FVB14(self.scpi.spi, DacCs.PULSE_TH.value)
-        self.channel_pulse_th_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-
-        self.logic_timing_i_dac = DacMCP48FVB14(
-            self.scpi.spi, DacCs.LOGIC_TIMING_I.value
-        )
-        self.logic_timing_i_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
-        self.logic_timing_th_dac = DacMCP48FVB14(
-            self.scpi.spi, DacCs.LOGIC_TIMING_TH.value
-        )
-        self.logic_timing_th_dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
+    def broadcast_refs(
+        self, ref_setting: DacVrefOptions, dacs: Sequence[DacMCP48FXBX4] = None
+    ):
+        """
+        Same reference for all channels of dacs (default: all).
+        """
+        dacs = self.dacs if dacs is None else dacs
+        ref_settings = [ref_setting] * 4
+        start = time.perf_counter()
+        multicast_write(dacs, dacs[0].refs_transfer(ref_settings))
+        latency = time.perf_counter() - start
+        for dac in dacs:
+            self.registers.update_refs(
+                dac.cs_index, dac._refs_word(ref_settings), latency
+            )
 
 
 class ELBArduDiscChannelControl:
-    def __init__(self, dac_control: ELBArduDiscDacControl):
+    def __init__(self, dac_control: ELBArduDiscDacControl, counter: CounterScpi = None):
         self.dac_control = dac_control
+        self.counter = counter
         self.min_threshold_v = -2.5
         self.max_threshold_v = 2.5
         self.attenuation_factor = 0.72
 
     def set_threshold(self, channel: int, value: int):
-        self.dac_control.channel_threshold_dac.set_channel(channel, value)
+        self.dac_control.registers.thr.write(channel, value)
 
     def set_threshold_v(self, channel: int, value: float):
+        calibration = self.dac_control.calibration
+        if calibration is not None:
+            from .calibration import THRESHOLD
+
+            if calibration.calibrated(THRESHOLD, channel):
+                code = calibration[THRESHOLD].code(channel, value)
+                self.set_threshold(channel, code)
+                return
         # dac value 0 -> -2.5V
         # dac value 0xfff -> +2.5V
         range = (self.max_threshold_v - self.min_threshold_v) / self.attenuation_factor
@@ -97,51 +532,133 @@ class ELBArduDiscChannelControl:
         self.set_threshold(channel, dac_setting)
 
     def set_hysteresis(self, channel: int, value: int):
-        self.dac_control.channel_hysteresis_dac.set_channel(channel, value)
+        self.dac_control.registers.hys.write(channel, value)
 
     def set_hysteresis_v(self, channel: int, value: float):
         raise NotImplementedError("This method is not implemented yet")
 
+    def count(self, gate_ms: int = 100, channel: int = None) -> int:
+        # without a channel the aux input has to be connected to the
+        # discriminator output of interest
+        if self.counter is None:
+            raise RuntimeError("No counter available")
+        return self.counter.count(gate_ms, channel)
+
+    def scan_threshold(
+        self,
+        channel: int,
+        gate_ms: int = 100,
+        low: int = 0,
+        high: int = None,
+        fraction: float = 0.5,
+        with_width: bool = True,
+    ) -> SCurveEdge:
+        """
+        Locate the S-curve edge of a channel by bisection of the threshold code.
+        The counter counts the output of the channel. With firmware older
+        than 0.1.6 it counts the aux input, which then has to see this
+        channel's output.
+        The threshold is left at the last measured code.
+        """
+        if high is None:
+            high = (1 << self.dac_control.channel_threshold_dac.resolution) - 1
+
+        counted = None
+        if self.counter is not None and self.counter.channels:
+            counted = channel
+
+        def measure(code: int) -> int:
+            self.set_threshold(channel, code)
+            return self.count(gate_ms, counted)
+
+        return find_scurve_edge(
+            measure,
+            low,
+            high,
+            fraction=fraction,
+            width_fractions=(0.16, 0.84) if with_width else None,
+        )
+
 
 class ELBArduDiscTimingControl:
     def __init__(self, dac_control: ELBArduDiscDacControl):
         self.dac_control = dac_control
 
     def set_channel_delay_current(self, channel: int, value: int):
-        self.dac_control.channel_delay_i_dac.set_channel(channel, value)
+        self.dac_control.registers.delay_i.write(channel, value)
 
     def set_channel_delay_threshold(self, channel: int, value: int):
-        self.dac_control.channel_delay_th_dac.set_channel(channel, value)
+        self.dac_control.registers.delay_th.write(channel, value)
 
     def set_channel_pulse_width_current(self, channel: int, value: int):
-        self.dac_control.channel_pulse_i_dac.set_channel(channel, value)
+        self.dac_control.registers.pulse_i.write(channel, value)
 
     def set_channel_pulse_width_threshold(self, channel: int, value: int):
-        self.dac_control.channel_pulse_th_dac.set_channel(channel, value)
+        self.dac_control.registers.pulse_th.write(channel, value)
+
+    # The logic timing DACs are shared by the two logic channels:
+    # DAC channel 0 = Delay CH 01
+    # DAC channel 1 = PulseWidth CH 01
+    # DAC channel 2 = Delay CH 23
+    # DAC channel 3 = PulseWidth CH 23
+    # see REGISTER_LAYOUT in registers.py
 
     def set_logic_delay_current(self, channel: int, value: int):
-        # DAC channel 0 = Delay CH 01
-        # DAC channel 1 = PulseWidth CH 01
-        # DAC channel 2 = Delay CH 23
-        # DAC channel 3 = PulseWidth CH 23
-        if channel < 0 or channel > 1:
-            raise ValueError("Invalid Timing Channel {channel}")
-        self.dac_control.logic_timing_i_dac.set_channel(channel * 2, value)
+        self.dac_control.registers.logic_delay_i.write(channel, value)
 
     def set_logic_delay_threshold(self, channel: int, value: int):
-        if channel < 0 or channel > 1:
-            raise ValueError("Invalid Timing Channel {channel}")
-        self.dac_control.logic_timing_th_dac.set_channel(channel * 2, value)
+        self.dac_control.registers.logic_delay_th.write(channel, value)
 
     def set_logic_pulse_width_current(self, channel: int, value: int):
-        if channel < 0 or channel > 1:
-            raise ValueError("Invalid Timing Channel {channel}")
-        self.dac_control.logic_timing_i_dac.set_channel(channel * 2 + 1, value)
+        self.dac_control.registers.logic_pw_i.write(channel, value)
 
     def set_logic_pulse_width_threshold(self, channel: int, value: int):
-        if channel < 0 or channel > 1:
-            raise ValueError("Invalid Timing Channel {channel}")
-        self.dac_control.logic_timing_th_dac.set_channel(channel * 2 + 1, value)
+        self.dac_control.registers.logic_pw_th.write(channel, value)
+
+    # Calibrated timing: the threshold code for the time at the current
+    # (default: the current that is set), see calibration.py
+
+    def set_channel_delay_ns(self, channel: int, value: float, current: int = None):
+        from .calibration import DELAY
+
+        self._set_ns(DELAY, channel, value, current)
+
+    def set_channel_pulse_width_ns(
+        self, channel: int, value: float, current: int = None
+    ):
+        from .calibration import PULSE_WIDTH
+
+        self._set_ns(PULSE_WIDTH, channel, value, current)
+
+    def set_logic_delay_ns(self, channel: int, value: float, current: int = None):
+        from .calibration import LOGIC_DELAY
+
+        self._set_ns(LOGIC_DELAY, channel, value, current)
+
+    def set_logic_pulse_width_ns(self, channel: int, value: float, current: int = None):
+        from .calibration import LOGIC_PULSE_WIDTH
+
+        self._set_ns(LOGIC_PULSE_WIDTH, channel, value, current)
+
+    def _set_ns(self, quantity: str, channel: int, value: float, current: int):
+        calibration = self.dac_control.calibration
+        if calibration is None or not calibration.calibrated(quantity, channel):
+            raise RuntimeError(f"No {quantity} calibration for channel {channel}")
+        from .calibration import QUANTITIES
+
+        registers = self.dac_control.registers
+        threshold_name, current_name = QUANTITIES[quantity]
+        if current is None:
+            current = registers[current_name][channel]
+            if current is None:
+                raise RuntimeError(
+                    f"The {current_name} of channel {channel} is not set, "
+                    "pass the current"
+                )
+        code = calibration[quantity].code(channel, value, current)
+        # the current only if it changes
+        registers[current_name][channel] = current
+        registers[threshold_name].write(channel, code)
 
 
 if __name__ == "__main__":
@@ -153,7 +670,6 @@ if __name__ == "__main__":
 
 """
 todo:
-- add aux input
 - testpulsercontrol: make it like the dac control
 - update example
 """
@@ -0,0 +1,312 @@
+"""
+Wall time estimates for register writes on the current link.
+
+measure_link() times round trips and streamed transfers on the connected
+board with DAC reads, which change nothing. A workload is a sequence of
+steps, e.g. the points of a sweep, each with the register writes it sends.
+estimate_all() predicts the duration and the serial bytes of the workload
+for every strategy the link supports, recommend() picks the fastest one:
+
+    profile = measure_link(ead)
+    estimate = recommend(profile, sweep_steps(ead.registers, plan), dwell_s=0.01)
+    print(estimate.strategy, estimate.duration_s / 3600, "h")
+    runner = ead.sweep(plan)
+    for index, point in runner:
+        measure()
+    compare(estimate, runner.elapsed_s)
+
+Strategies:
+    sequential   every write waits for its answer
+                 (ELBArduDiscSCPI(flow_control=False))
+    pipelined    the writes of a step are streamed with credit based flow
+                 control (the default with firmware 0.0.2 or newer)
+    batched      like pipelined, but the same code for the same channel of
+                 several chips is one multicast (firmware 0.0.3 or newer,
+                 used automatically)
+    transaction  all steps are collected and sent in one burst at the end,
+                 only the last value of every register (ead.transaction()).
+                 Only if the states in between do not matter, e.g. when
+                 applying a configuration, and never with a dwell time.
+
+The firmware has no sequencer, so a workload cannot run on the board itself;
+the transaction is the closest to that.
+"""
+
+import statistics
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .dacs import (
+    _CHANNEL_READ_COMMANDS,
+    _CHANNEL_WRITE_COMMANDS,
+    DacCs,
+    WRITE_OK_ANSWER,
+)
+from .registers import RegisterMap
+from .spi import _send_command
+from .sweep import Plan
+
+SEQUENTIAL = "sequential"
+PIPELINED = "pipelined"
+BATCHED = "batched"
+TRANSACTION = "transaction"
+
+# bytes of a command that is not a register write (e.g. a pulser setting),
+# with its answer
+OTHER_COMMAND_BYTES = 24
+
+Write = Tuple[int, int, int]  # cs_index, dac_channel, code
+
+
+class LinkProfile(NamedTuple):
+    round_trip_s: float  # one write or read, waiting for the answer
+    stream_s: float  # each further transfer of a stream
+    baudrate: Optional[int]  # of the measurement, None for a direct SPI link
+    rx_credits: int  # 0 without flow control, nothing is streamed
+    multicast: bool
+
+
+class Step(NamedTuple):
+    writes: List[Write]
+    commands: int = 0  # other commands, one round trip each
+
+
+class Estimate(NamedTuple):
+    strategy: str
+    duration_s: float  # including the dwell time
+    link_s: float
+    steps: int
+    transfers: int
+    bytes_sent: int
+    bytes_received: int
+
+
+class Comparison(NamedTuple):
+    strategy: str
+    predicted_s: float
+    actual_s: float
+
+    @property
+    def error(self) -> float:
+        """
+        Relative error of the prediction, positive if the run took longer.
+        """
+        return self.actual_s / self.predicted_s - 1 if self.predicted_s else 0.0
+
+
+def measure_link(ead, samples: int = 32) -> LinkProfile:
+    """
+    Time single and streamed DAC reads on the link of ead.
+    """
+    if samples < 2:
+        raise ValueError(f"Invalid sample count {samples}")
+    spi = ead._spi
+    scpi = ead._scpi
+    cs_index = DacCs.CHANNEL_THR.value
+    command = _CHANNEL_READ_COMMANDS[0]
+
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        spi.transfer_24(command, 0, cs_index)
+        durations.append(time.perf_counter() - start)
+    round_trip_s = statistics.median(durations)
+
+    start = time.perf_counter()
+    spi.do_io_24_many([([command, 0, 0], cs_index)] * samples)
+    stream_s = (time.perf_counter() - start - round_trip_s) / (samples - 1)
+
+    return LinkProfile(
+        round_trip_s,
+        max(stream_s, 0.0),
+        scpi.ser.baudrate if scpi is not None else None,
+        scpi.rx_credits if scpi is not None else 0,
+        spi.multicast,
+    )
+
+
+def sweep_steps(registers: RegisterMap, plan: Plan) -> Iterable[Step]:
+    """
+    The writes of every point of plan, as SweepRunner sends them: only the
+    registers that change, starting from the current state of registers.
+    Axes that are not registers (setters) count as one command per change.
+    """
+    codes: Dict[Tuple[int, int], int] = {}
+    previous: Dict[str, int] = {}
+    for point in plan:
+        final: Dict[Tuple[int, int], int] = {}
+        commands = 0
+        for axis in plan.axes():
+            value = point[axis.label]
+            if axis.name not in registers.views:
+                commands += previous.get(axis.label) != value
+                continue
+            view = registers[axis.name]
+            if axis.channels is None:
+                keys = [slice(None)]
+            elif isinstance(axis.channels, int):
+                keys = [axis.channels]
+            else:
+                keys = axis.channels
+            for key in keys:
+                for cs_index, dac_channel, code in view._writes(key, value):
+                    final[(cs_index, dac_channel)] = code
+        writes = []
+        for (cs_index, dac_channel), code in sorted(final.items()):
+            known = codes.get((cs_index, dac_channel))
+            if known is None:
+                known = registers.code(cs_index, dac_channel)
+            if known != code:
+                writes.append((cs_index, dac_channel, code))
+                codes[(cs_index, dac_channel)] = code
+        previous = point
+        yield Step(writes, commands)
+
+
+def _write_bytes(cs_index: int, dac_channel: int, code: int) -> Tuple[int, int]:
+    command = _CHANNEL_WRITE_COMMANDS[dac_channel]
+    sent = len(_send_command(cs_index, command, code))
+    # SPIRESP,<index>,<command>,<payload>,<answer>\r\n
+    received = len(f"SPIRESP,{cs_index},{command},{code},{WRITE_OK_ANSWER}\r\n")
+    return sent, received
+
+
+def _multicast_bytes(cs_mask: int, dac_channel: int, code: int) -> Tuple[int, int]:
+    command = _CHANNEL_WRITE_COMMANDS[dac_channel]
+    sent = len(f"SYST:SPI:MUL {cs_mask}, {command}, {code}\n")
+    received = len(f"SPIMRESP,{cs_mask},{command},{code},{WRITE_OK_ANSWER}\r\n")
+    return sent, received
+
+
+class _Tally:
+    """
+    Duration and bytes of one strategy, summed up step by step.
+    """
+
+    def __init__(self, strategy: str, profile: LinkProfile):
+        self.strategy = strategy
+        self.profile = profile
+        self.link_s = 0.0
+        self.steps = 0
+        self.transfers = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, writes: List[Write], commands: int = 0, stream: bool = False):
+        """
+        writes: streamed if stream, else one round trip each.
+        A write with a list of chip selects is a multicast, one round trip.
+        """
+        profile = self.profile
+        seconds = commands * profile.round_trip_s
+        sent = received = commands * OTHER_COMMAND_BYTES // 2
+        streamed = 0
+        for cs_index, dac_channel, code in writes:
+            if isinstance(cs_index, list):
+                mask = sum(1 << index for index in cs_index)
+                write_sent, write_received = _multicast_bytes(mask, dac_channel, code)
+                seconds += profile.round_trip_s
+            else:
+                write_sent, write_received = _write_bytes(cs_index, dac_channel, code)
+                if stream:
+                    streamed += 1
+                else:
+                    seconds += profile.round_trip_s
+            sent += write_sent
+            received += write_received
+        if streamed:
+            seconds += profile.round_trip_s + (streamed - 1) * profile.stream_s
+        # the measured times include the bytes on the link
+        self.link_s += seconds
+        self.steps += 1
+        self.transfers += len(writes) + commands
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    def estimate(self, dwell_s: float) -> Estimate:
+        return Estimate(
+            self.strategy,
+            self.link_s + self.steps * dwell_s,
+            self.link_s,
+            self.steps,
+            self.transfers,
+            self.bytes_sent,
+            self.bytes_received,
+        )
+
+
+def _merge_multicast(writes: List[Write]) -> List[Write]:
+    """
+    Writes of one code to one channel of several chips as one write with a
+    list of chip selects, like RegisterMap._flush_multicast.
+    """
+    targets: Dict[Tuple[int, int], List[int]] = {}
+    for cs_index, dac_channel, code in writes:
+        targets.setdefault((dac_channel, code), []).append(cs_index)
+    merged = []
+    for (dac_channel, code), cs_indices in targets.items():
+        cs = cs_indices if len(cs_indices) > 1 else cs_indices[0]
+        merged.append((cs, dac_channel, code))
+    return merged
+
+
+def estimate_all(
+    profile: LinkProfile, steps: Iterable[Step], dwell_s: float = 0.0
+) -> Dict[str, Estimate]:
+    """
+    Estimates of the strategies the link supports, see the module docstring.
+    dwell_s: time spent after each step, e.g. measuring
+    """
+    tallies = [_Tally(SEQUENTIAL, profile)]
+    if profile.rx_credits:
+        tallies.append(_Tally(PIPELINED, profile))
+    batched = _Tally(BATCHED, profile) if profile.multicast else None
+    transaction = _Tally(TRANSACTION, profile) if dwell_s == 0 else None
+
+    final: Dict[Tuple[int, int], int] = {}
+    commands = 0
+    for step in steps:
+        for tally in tallies:
+            tally.add(step.writes, step.commands, stream=tally.strategy == PIPELINED)
+        if batched is not None:
+            batched.add(
+                _merge_multicast(step.writes),
+                step.commands,
+                stream=bool(profile.rx_credits),
+            )
+        if transaction is not None:
+            for cs_index, dac_channel, code in step.writes:
+                final[(cs_index, dac_channel)] = code
+            commands += step.commands
+
+    estimates = {tally.strategy: tally.estimate(dwell_s) for tally in tallies}
+    if batched is not None:
+        estimates[BATCHED] = batched.estimate(dwell_s)
+    if transaction is not None:
+        writes = [(cs, channel, code) for (cs, channel), code in sorted(final.items())]
+        if profile.multicast:
+            writes = _merge_multicast(writes)
+        transaction.add(writes, commands, stream=bool(profile.rx_credits))
+        estimates[TRANSACTION] = transaction.estimate(0.0)
+    return estimates
+
+
+def recommend(
+    profile: LinkProfile,
+    steps: Iterable[Step],
+    dwell_s: float = 0.0,
+    strategies: Sequence[str] = None,
+) -> Estimate:
+    """
+    The fastest strategy for the workload, out of strategies (default: all).
+    """
+    estimates = estimate_all(profile, steps, dwell_s)
+    if strategies is not None:
+        estimates = {s: e for s, e in estimates.items() if s in strategies}
+    if not estimates:
+        raise ValueError(f"None of the strategies {strategies} is supported")
+    return min(estimates.values(), key=lambda estimate: estimate.duration_s)
+
+
+def compare(estimate: Estimate, actual_s: float) -> Comparison:
+    return Comparison(estimate.strategy, estimate.duration_s, actual_s)
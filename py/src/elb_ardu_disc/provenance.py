@@ -0,0 +1,252 @@
+"""
+Append-only provenance log of the applied DAC settings.
+
+Every acknowledged register write is appended as a fixed size record
+(little endian, 16 bytes):
+    timestamp of the acknowledge (f64, seconds since the epoch),
+    chip select index (u8), dac channel (u8, REFS_CHANNEL for the references),
+    code (u16), acknowledge latency (f32, seconds)
+
+The header is 8 bytes, so the records are aligned and the file maps directly
+onto a structured array:
+
+    log = read_provenance("run.prov")
+    log[-1]                     # ProvenanceRecord
+    columns = log.columns()     # dict of numpy arrays, needs numpy
+    log.active_codes(t)         # settings at time t
+
+Records are collected in a preallocated buffer and written in blocks, so
+appending costs about a microsecond and no system call. The buffer is also
+written at interpreter exit if the log was not closed.
+"""
+
+import atexit
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterator, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROVENANCE_MAGIC = b"ELBPRV1\n"
+REFS_CHANNEL = 0xFF
+
+_RECORD = struct.Struct("<dBBHf")
+NUMPY_DTYPE = [
+    ("timestamp", "<f8"),
+    ("cs_index", "u1"),
+    ("dac_channel", "u1"),
+    ("code", "<u2"),
+    ("latency", "<f4"),
+]
+
+
+class ProvenanceRecord(NamedTuple):
+    timestamp: float
+    cs_index: int
+    dac_channel: int  # REFS_CHANNEL for the reference setting
+    code: int
+    latency: float
+
+
+class ProvenanceLog:
+    """
+    Appends records to path, an existing log is continued. An incomplete
+    last record of an existing log (e.g. after a crash) is cut off first.
+    buffer_records: records kept in memory before they are written
+    """
+
+    def __init__(self, path: str, buffer_records: int = 4096):
+        if buffer_records < 1:
+            raise ValueError(f"Invalid buffer size {buffer_records}")
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r+b") as f:
+                if f.read(len(PROVENANCE_MAGIC)) != PROVENANCE_MAGIC:
+                    raise ValueError(f"{path} is not a provenance log")
+                size = os.fstat(f.fileno()).st_size
+                records = (size - len(PROVENANCE_MAGIC)) // _RECORD.size
+                complete = len(PROVENANCE_MAGIC) + records * _RECORD.size
+                if size != complete:
+                    logger.warning(
+                        f"{path}: cutting off {size - complete} bytes of an "
+                        "incomplete record"
+                    )
+                    f.truncate(complete)
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "wb")
+            self._file.write(PROVENANCE_MAGIC)
+        self._lock = threading.Lock()
+        self._buffer = bytearray(_RECORD.size * buffer_records)
+        self._offset = 0
+        self.records_written = 0
+        atexit.register(self.flush)
+
+    def append(self, cs_index: int, dac_channel: int, code: int, latency: float = 0.0):
+        """
+        dac_channel: REFS_CHANNEL (or a negative channel) for the references
+        """
+        if dac_channel < 0:
+            dac_channel = REFS_CHANNEL
+        with self._lock:
+            if self._file.closed:
+                raise ValueError(f"Provenance log {self.path} is closed")
+            _RECORD.pack_into(
+                self._buffer,
+                self._offset,
+                time.time(),
+                cs_index,
+                dac_channel,
+                code,
+                latency,
+            )
+            self._offset += _RECORD.size
+            self.records_written += 1
+            if self._offset == len(self._buffer):
+                self._write_buffer()
+
+    def _write_buffer(self):
+        self._file.write(memoryview(self._buffer)[: self._offset])
+        self._offset = 0
+
+    def flush(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_buffer()
+            self._file.flush()
+
+    def close(self):
+        atexit.unregister(self.flush)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_buffer()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ProvenanceFile:
+    """
+    Memory mapped, read only view of a provenance log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(PROVENANCE_MAGIC)) != PROVENANCE_MAGIC:
+                raise ValueError(f"{path} is not a provenance log")
+            size = os.fstat(f.fileno()).st_size
+            # an incomplete last record (e.g. after a crash) is ignored
+            self._length = (size - len(PROVENANCE_MAGIC)) // _RECORD.size
+            if self._length:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> ProvenanceRecord:
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError(f"Record {index} out of range")
+        offset = len(PROVENANCE_MAGIC) + index * _RECORD.size
+        return ProvenanceRecord(*_RECORD.unpack_from(self._map, offset))
+
+    def __iter__(self) -> Iterator[ProvenanceRecord]:
+        if not self._length:
+            return iter(())
+        end = len(PROVENANCE_MAGIC) + self._length * _RECORD.size
+        view = memoryview(self._map)[len(PROVENANCE_MAGIC) : end]
+        return (ProvenanceRecord(*values) for values in _RECORD.iter_unpack(view))
+
+    def columns(self) -> Dict[str, "numpy.ndarray"]:  # noqa: F821
+        """
+        One array per field, views on the mapped file (no copy). Needs numpy.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("ProvenanceFile.columns needs numpy") from None
+        if not self._length:
+            records = numpy.zeros(0, dtype=NUMPY_DTYPE)
+        else:
+            records = numpy.frombuffer(
+                self._map,
+                dtype=NUMPY_DTYPE,
+                count=self._length,
+                offset=len(PROVENANCE_MAGIC),
+            )
+        return {name: records[name] for name, _ in NUMPY_DTYPE}
+
+    def _first_after(self, timestamp: float) -> int:
+        """
+        Index of the first record after timestamp (binary search, the log is
+        in time order).
+        """
+        lo, hi = 0, self._length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = len(PROVENANCE_MAGIC) + mid * _RECORD.size
+            if _RECORD.unpack_from(self._map, offset)[0] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def active_codes(self, timestamp: float) -> Dict[Tuple[int, int], int]:
+        """
+        (cs_index, dac_channel) -> code of all registers written until timestamp.
+        Vectorized with numpy, a loop over the records without.
+        """
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            columns = self.columns()
+            end = int(numpy.searchsorted(columns["timestamp"], timestamp, "right"))
+            keys = columns["cs_index"][:end].astype(numpy.uint16) << 8
+            keys |= columns["dac_channel"][:end]
+            # first occurrence in the reversed keys = last write of the register
+            unique, first = numpy.unique(keys[::-1], return_index=True)
+            codes = columns["code"][end - 1 - first]
+            return {
+                (int(key) >> 8, int(key) & 0xFF): int(code)
+                for key, code in zip(unique, codes)
+            }
+        codes = {}
+        for index in range(self._first_after(timestamp)):
+            record = self[index]
+            codes[(record.cs_index, record.dac_channel)] = record.code
+        return codes
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # arrays from columns() still use the map, it is closed with them
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_provenance(path: str) -> ProvenanceFile:
+    return ProvenanceFile(path)
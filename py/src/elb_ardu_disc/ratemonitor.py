@@ -0,0 +1,248 @@
+"""
+Continuous rates of the discriminator outputs.
+
+The firmware (0.1.2 or newer) counts the rising edges on its rate inputs
+A0 ... A3 and sends the counts every interval without being asked:
+
+    RATE,<sequence>,<elapsed_us>,<counts_0>,...,<counts_3>    (hex)
+
+The samples are picked up by the ReplyReader of the link, also while other
+commands wait for their answers, so the host never has to poll the firmware.
+While the link is idle, a thread checks for samples twice per interval.
+The last samples are kept in a fixed size ring buffer (needs numpy):
+
+    monitor = ead.start_rate_monitor(interval_ms=50)
+    monitor.subscribe(lambda sample: print(sample.rates))
+    times, rates = monitor.history.snapshot()   # rates: samples x channels, Hz
+    monitor.history.mean(1.0)                   # mean rates of the last second
+    ead.stop_rate_monitor()
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from .spi import ELBArduDiscSCPI
+
+logger = logging.getLogger(__name__)
+
+RATE_CHANNELS = 4
+RATE_LINE_START = b"RATE,"
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The rate history needs numpy (pip install elb_ardu_disc[numpy])"
+        ) from None
+    return numpy
+
+
+class RateSample(NamedTuple):
+    sequence: int
+    timestamp: float  # time.time() of the reception
+    elapsed_s: float  # time the counts were collected in
+    counts: Tuple[int, ...]
+
+    @property
+    def rates(self) -> Tuple[float, ...]:
+        """
+        Rising edges per second of every channel.
+        """
+        return tuple(count / self.elapsed_s for count in self.counts)
+
+
+def parse_rate_sample(line: bytes, timestamp: float = None) -> RateSample:
+    # RATE,<sequence>,<elapsed_us>,<counts_0>,...
+    fields = line.split(b",")
+    if len(fields) != 3 + RATE_CHANNELS or fields[0] != b"RATE":
+        raise ValueError(f"Invalid rate sample {line!r}")
+    return RateSample(
+        int(fields[1], 16),
+        time.time() if timestamp is None else timestamp,
+        int(fields[2], 16) / 1e6,
+        tuple(int(field, 16) for field in fields[3:]),
+    )
+
+
+class RateHistory:
+    """
+    The last capacity samples in preallocated arrays, the oldest one is
+    overwritten by a new one. Thread safe.
+    """
+
+    def __init__(self, capacity: int = 10000, channels: int = RATE_CHANNELS):
+        if capacity < 1:
+            raise ValueError(f"Invalid history size {capacity}")
+        numpy = _numpy()
+        self.capacity = capacity
+        self._times = numpy.zeros(capacity)
+        self._rates = numpy.zeros((capacity, channels))
+        self._next = 0
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, timestamp: float, rates: Tuple[float, ...]):
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._rates[self._next] = rates
+            self._next = (self._next + 1) % self.capacity
+            self._length = min(self._length + 1, self.capacity)
+
+    def snapshot(self) -> Tuple["numpy.ndarray", "numpy.ndarray"]:  # noqa: F821
+        """
+        (timestamps, rates) of all samples, oldest first. Copies.
+        """
+        numpy = _numpy()
+        with self._lock:
+            if self._length < self.capacity:
+                return (
+                    self._times[: self._length].copy(),
+                    self._rates[: self._length].copy(),
+                )
+            return (
+                numpy.concatenate(
+                    (self._times[self._next :], self._times[: self._next])
+                ),
+                numpy.concatenate(
+                    (self._rates[self._next :], self._rates[: self._next])
+                ),
+            )
+
+    def latest(self) -> Optional[Tuple[float, ...]]:
+        """
+        Rates of the last sample, None if there is none.
+        """
+        with self._lock:
+            if not self._length:
+                return None
+            return tuple(self._rates[self._next - 1])
+
+    def mean(self, seconds: float) -> Optional["numpy.ndarray"]:  # noqa: F821
+        """
+        Mean rates of the samples of the last seconds before the last sample.
+        """
+        times, rates = self.snapshot()
+        if not len(times):
+            return None
+        return rates[times > times[-1] - seconds].mean(axis=0)
+
+
+class RateMonitor:
+    """
+    Streams the rates of the firmware into history and to the subscribers.
+    poll_s: check an idle link that often for samples, default half the interval
+    """
+
+    def __init__(
+        self,
+        scpi: ELBArduDiscSCPI,
+        interval_ms: int = 100,
+        capacity: int = 10000,
+        poll_s: float = None,
+    ):
+        self.scpi = scpi
+        self.interval_ms = interval_ms
+        self.poll_s = poll_s if poll_s is not None else interval_ms / 2000
+        self.history = RateHistory(capacity)
+
+        self.samples = 0
+        # samples lost on the link, seen as gaps in the sequence
+        self.missed = 0
+        self._last_sequence = None
+        self._subscribers: List[Callable[[RateSample], None]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(
+        self, callback: Callable[[RateSample], None]
+    ) -> Callable[[RateSample], None]:
+        """
+        callback(sample) for every new sample. It runs in the thread that
+        reads the link, possibly during a command of another thread, so it
+        should return quickly.
+        """
+        self._subscribers = self._subscribers + [callback]
+        return callback
+
+    def unsubscribe(self, callback: Callable[[RateSample], None]):
+        self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def _on_line(self, line: bytes):
+        sample = parse_rate_sample(line)
+        if self._last_sequence is not None:
+            self.missed += (sample.sequence - self._last_sequence - 1) & 0xFFFFFFFF
+        self._last_sequence = sample.sequence
+        self.samples += 1
+        self.history.append(sample.timestamp, sample.rates)
+        for callback in self._subscribers:
+            try:
+                callback(sample)
+            except Exception:
+                logger.exception("Rate subscriber failed")
+
+    def poll(self) -> bool:
+        """
+        Pick up the samples if the link is idle. Returns True if it was.
+        """
+        lock = self.scpi.lock
+        if not lock.acquire_if_idle(0.0):
+            # the owner of the link passes the samples on
+            return False
+        try:
+            self.scpi.reader.poll()
+        finally:
+            lock.release_background()
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_s):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Reading the rates failed: {e}")
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._last_sequence = None
+        self.scpi.reader.add_listener(RATE_LINE_START, self._on_line)
+        try:
+            self.interval_ms = self.scpi.start_rate_stream(self.interval_ms)
+        except Exception:
+            self.scpi.reader.remove_listener(RATE_LINE_START)
+            raise
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="ELBArduDiscRates", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            # samples sent before the answer still reach the listener
+            self.scpi.stop_rate_stream()
+        finally:
+            self.scpi.reader.remove_listener(RATE_LINE_START)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,239 @@
+"""
+Record and replay the serial traffic of a session.
+
+Log format (little endian):
+    header: b"ELBREC1\\n"
+    record: direction (u8, 0 = tx, 1 = rx), time since previous record in us (u32),
+            length (u16), data
+"""
+
+import struct
+import threading
+import time
+from typing import Iterator, List, NamedTuple
+
+RECORDING_MAGIC = b"ELBREC1\n"
+DIRECTION_TX = 0
+DIRECTION_RX = 1
+
+_RECORD_HEADER = struct.Struct("<BIH")
+
+
+class TrafficRecord(NamedTuple):
+    direction: int
+    timestamp: float  # seconds since the start of the recording
+    data: bytes
+
+
+class RecordingSerial:
+    """
+    Wraps a serial.Serial and logs every tx/rx chunk with a monotonic timestamp.
+    """
+
+    def __init__(self, serial_connection, log_path: str):
+        self.__dict__["ser"] = serial_connection
+        self.__dict__["_log"] = open(log_path, "wb", buffering=1 << 16)
+        self.__dict__["_log_lock"] = threading.Lock()
+        self.__dict__["_last_ns"] = time.monotonic_ns()
+        self._log.write(RECORDING_MAGIC)
+
+    def _record(self, direction: int, data: bytes):
+        now = time.monotonic_ns()
+        with self._log_lock:
+            if self._log.closed:
+                return
+            delta_us = min((now - self._last_ns) // 1000, 0xFFFFFFFF)
+            self.__dict__["_last_ns"] += delta_us * 1000
+            # chunks longer than the length field are split
+            for offset in range(0, max(len(data), 1), 0xFFFF):
+                chunk = data[offset : offset + 0xFFFF]
+                self._log.write(_RECORD_HEADER.pack(direction, delta_us, len(chunk)))
+                self._log.write(chunk)
+                delta_us = 0
+
+    def write(self, data: bytes) -> int:
+        self._record(DIRECTION_TX, bytes(data))
+        return self.ser.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.ser.read(size)
+        if data:
+            self._record(DIRECTION_RX, data)
+        return data
+
+    def read_until(self, *args, **kwargs) -> bytes:
+        data = self.ser.read_until(*args, **kwargs)
+        if data:
+            self._record(DIRECTION_RX, data)
+        return data
+
+    def readline(self, *args, **kwargs) -> bytes:
+        data = self.ser.readline(*args, **kwargs)
+        if data:
+            self._record(DIRECTION_RX, data)
+        return data
+
+    def flush_log(self):
+        with self._log_lock:
+            self._log.flush()
+
+    def close(self):
+        with self._log_lock:
+            self._log.close()
+        self.ser.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self.ser, name)
+
+    def __setattr__(self, name: str, value):
+        # e.g. baudrate or timeout changes go to the wrapped port
+        setattr(self.ser, name, value)
+
+
+def read_recording(log_path: str) -> Iterator[TrafficRecord]:
+    with open(log_path, "rb") as f:
+        data = f.read()
+    if not data.startswith(RECORDING_MAGIC):
+        raise ValueError(f"{log_path} is not a serial traffic recording")
+
+    offset = len(RECORDING_MAGIC)
+    timestamp_us = 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        direction, delta_us, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        timestamp_us += delta_us
+        yield TrafficRecord(
+            direction, timestamp_us / 1e6, data[offset : offset + length]
+        )
+        offset += length
+
+
+class Exchange(NamedTuple):
+    command: bytes
+    reply: bytes
+    start: float  # seconds since the start of the recording
+    latency: float  # seconds from sending the command to the last reply byte
+
+
+def split_exchanges(records: List[TrafficRecord]) -> List[Exchange]:
+    """
+    Group the records into commands and the replies received until the next command.
+    Traffic received before the first command (e.g. the welcome message) is dropped.
+    """
+    exchanges = []
+    command = None
+    for record in records:
+        if record.direction == DIRECTION_TX:
+            if command is not None:
+                exchanges.append(_finish_exchange(command))
+            command = [record, []]
+        elif command is not None:
+            command[1].append(record)
+    if command is not None:
+        exchanges.append(_finish_exchange(command))
+    return exchanges
+
+
+def _finish_exchange(command) -> Exchange:
+    tx, rx = command
+    reply = b"".join(r.data for r in rx)
+    end = rx[-1].timestamp if rx else tx.timestamp
+    return Exchange(tx.data, reply, tx.timestamp, end - tx.timestamp)
+
+
+class ReplayedExchange(NamedTuple):
+    command: bytes
+    recorded_latency: float
+    replayed_latency: float
+    reply_matches: bool
+
+
+class ReplayReport:
+    def __init__(self, exchanges: List[ReplayedExchange]):
+        self.exchanges = exchanges
+
+    @staticmethod
+    def _percentile(values: List[float], fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> dict:
+        recorded = [e.recorded_latency for e in self.exchanges]
+        replayed = [e.replayed_latency for e in self.exchanges]
+        return {
+            "exchanges": len(self.exchanges),
+            "reply_mismatches": sum(not e.reply_matches for e in self.exchanges),
+            "recorded_total_s": sum(recorded),
+            "replayed_total_s": sum(replayed),
+            "recorded_p50_s": self._percentile(recorded, 0.5),
+            "replayed_p50_s": self._percentile(replayed, 0.5),
+            "recorded_p95_s": self._percentile(recorded, 0.95),
+            "replayed_p95_s": self._percentile(replayed, 0.95),
+        }
+
+    def regressions(self, factor: float = 1.5, slack: float = 0.001):
+        """
+        Exchanges that got slower than factor * recorded latency + slack.
+        """
+        return [
+            e
+            for e in self.exchanges
+            if e.replayed_latency > e.recorded_latency * factor + slack
+        ]
+
+
+class Replayer:
+    """
+    Re-drives a recorded command stream against a board or emulator.
+
+    Each command is sent after the previous reply was complete, the reply is
+    considered complete when it has as many lines as the recorded one.
+    With pace=True, the recorded gaps between the commands are kept.
+    """
+
+    def __init__(self, serial_connection, timeout: float = 4.0, pace: bool = False):
+        self.ser = serial_connection
+        self.timeout = timeout
+        self.pace = pace
+
+    def replay(self, log_path: str) -> ReplayReport:
+        exchanges = split_exchanges(list(read_recording(log_path)))
+        results = []
+        # drop e.g. the welcome message, it is not part of any exchange
+        self.ser.reset_input_buffer()
+        replay_start = time.monotonic()
+        for exchange in exchanges:
+            if self.pace:
+                offset = exchange.start - exchanges[0].start
+                wait = offset - (time.monotonic() - replay_start)
+                if wait > 0:
+                    time.sleep(wait)
+
+            start = time.monotonic()
+            self.ser.write(exchange.command)
+            reply = self._read_lines(exchange.reply.count(b"\n"), start)
+            latency = time.monotonic() - start
+
+            results.append(
+                ReplayedExchange(
+                    exchange.command,
+                    exchange.latency,
+                    latency,
+                    reply == exchange.reply,
+                )
+            )
+        return ReplayReport(results)
+
+    def _read_lines(self, lines: int, start: float) -> bytes:
+        reply = bytearray()
+        while reply.count(b"\n") < lines:
+            waiting = self.ser.in_waiting
+            if waiting:
+                reply.extend(self.ser.read(waiting))
+                continue
+            if time.monotonic() - start > self.timeout:
+                break
+            time.sleep(0.0001)
+        return bytes(reply)
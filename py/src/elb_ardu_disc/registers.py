@@ -0,0 +1,320 @@
+"""
+Register map of the ELB_ARDU_DISC.
+
+All DAC codes of the 8 chips x 4 channels are kept in one array, indexed by
+cs_index * 4 + dac channel, the reference settings in a second one.
+Named views give access to the functional registers:
+
+    regs.thr[2] = 2048
+    regs.delay_th[:] = 600          # broadcast
+    regs.pulse_i[0:2] = [100, 200]  # slice assignment
+    regs.logic_pw_th[1]             # last written code, None if unknown
+    regs.thr.write(0, 2048, trigger=True)
+
+Bulk assignments only send the registers whose value changes. With
+trigger=True the trigger output of the firmware pulses when all writes of
+the call are done, e.g. to trigger an oscilloscope on the new setting.
+Inside a transaction the writes are collected and sent together at its end:
+
+    with regs.transaction():
+        regs.thr[:] = 2000
+        regs.thr[0] = 2100      # only the last value is sent
+"""
+
+import time
+from array import array
+from contextlib import contextmanager
+from itertools import groupby
+from numbers import Integral
+from typing import Dict, List, Sequence, Tuple, Union
+
+from .dacs import DacCs, DacMCP48FXBX4, multicast_write
+
+CHIP_COUNT = 8
+CHANNELS_PER_CHIP = 4
+
+# code of a register that was not written since the start
+UNKNOWN = -1
+
+# view name -> (chip select, dac channels)
+REGISTER_LAYOUT: Dict[str, Tuple[DacCs, Tuple[int, ...]]] = {
+    "thr": (DacCs.CHANNEL_THR, (0, 1, 2, 3)),
+    "hys": (DacCs.CHANNEL_HYS, (0, 1, 2, 3)),
+    "delay_i": (DacCs.DELAY_I, (0, 1, 2, 3)),
+    "delay_th": (DacCs.DELAY_TH, (0, 1, 2, 3)),
+    "pulse_i": (DacCs.PULSE_I, (0, 1, 2, 3)),
+    "pulse_th": (DacCs.PULSE_TH, (0, 1, 2, 3)),
+    "logic_delay_i": (DacCs.LOGIC_TIMING_I, (0, 2)),
+    "logic_pw_i": (DacCs.LOGIC_TIMING_I, (1, 3)),
+    "logic_delay_th": (DacCs.LOGIC_TIMING_TH, (0, 2)),
+    "logic_pw_th": (DacCs.LOGIC_TIMING_TH, (1, 3)),
+}
+
+
+def register_index(cs_index: int, dac_channel: int) -> int:
+    return cs_index * CHANNELS_PER_CHIP + dac_channel
+
+
+class RegisterView:
+    """
+    Functional register of all channels, e.g. the thresholds.
+    """
+
+    def __init__(self, register_map: "RegisterMap", name: str):
+        self.register_map = register_map
+        self.name = name
+        cs, self.dac_channels = REGISTER_LAYOUT[name]
+        self.cs_index = cs.value
+
+    def __len__(self) -> int:
+        return len(self.dac_channels)
+
+    def _channels(self, key: Union[int, slice]) -> List[int]:
+        if isinstance(key, slice):
+            return list(range(len(self)))[key]
+        if key < 0 or key >= len(self):
+            raise ValueError(f"Invalid channel {key} for {self.name}")
+        return [key]
+
+    def address(self, channel: int) -> Tuple[int, int]:
+        """
+        (chip select index, dac channel) of a channel.
+        """
+        return self.cs_index, self.dac_channels[self._channels(channel)[0]]
+
+    def __getitem__(self, key: Union[int, slice]):
+        codes = []
+        for channel in self._channels(key):
+            code = self.register_map.code(self.cs_index, self.dac_channels[channel])
+            codes.append(None if code == UNKNOWN else code)
+        return codes if isinstance(key, slice) else codes[0]
+
+    def _writes(self, key: Union[int, slice], value: Union[int, Sequence[int]]):
+        channels = self._channels(key)
+        if isinstance(value, Integral):
+            values = [value] * len(channels)
+        else:
+            values = list(value)
+            if len(values) != len(channels):
+                raise ValueError(
+                    f"{self.name}: {len(values)} values for {len(channels)} channels"
+                )
+        return [
+            (self.cs_index, self.dac_channels[channel], value)
+            for channel, value in zip(channels, values)
+        ]
+
+    def __setitem__(self, key: Union[int, slice], value: Union[int, Sequence[int]]):
+        self.register_map.write(self._writes(key, value))
+
+    def write(
+        self,
+        key: Union[int, slice],
+        value: Union[int, Sequence[int]],
+        trigger: bool = False,
+    ):
+        """
+        Like item assignment, but always sends the value, even if unchanged.
+        """
+        self.register_map.write(self._writes(key, value), force=True, trigger=trigger)
+
+    def __repr__(self) -> str:
+        return f"{self.name}{self[:]}"
+
+
+class RegisterMap:
+    def __init__(self, dacs: Sequence[DacMCP48FXBX4]):
+        self.dacs: Dict[int, DacMCP48FXBX4] = {dac.cs_index: dac for dac in dacs}
+        self.codes = array("i", [UNKNOWN] * (CHIP_COUNT * CHANNELS_PER_CHIP))
+        self.refs = array("i", [UNKNOWN] * CHIP_COUNT)
+        for dac in dacs:
+            dac.register_map = self
+        # provenance.ProvenanceLog of all acknowledged writes, optional
+        self.provenance = None
+        # (cs_index, dac_channel) -> (code, force) during a transaction
+        self._staged = None
+
+        self.views: Dict[str, RegisterView] = {}
+        for name in REGISTER_LAYOUT:
+            self.views[name] = RegisterView(self, name)
+            setattr(self, name, self.views[name])
+
+    def __getitem__(self, name: str) -> RegisterView:
+        return self.views[name]
+
+    def code(self, cs_index: int, dac_channel: int) -> int:
+        """
+        Last written code, the staged one during a transaction.
+        """
+        if self._staged is not None and (cs_index, dac_channel) in self._staged:
+            return self._staged[(cs_index, dac_channel)][0]
+        return self.codes[register_index(cs_index, dac_channel)]
+
+    def update_channel(
+        self, cs_index: int, dac_channel: int, code: int, latency: float = 0.0
+    ):
+        """
+        Called by the DACs after a successful write.
+        latency: seconds from sending the write to its acknowledge
+        """
+        self.codes[register_index(cs_index, dac_channel)] = code
+        if self.provenance is not None:
+            self.provenance.append(cs_index, dac_channel, code, latency)
+
+    def update_refs(self, cs_index: int, refs_word: int, latency: float = 0.0):
+        self.refs[cs_index] = refs_word
+        if self.provenance is not None:
+            self.provenance.append(cs_index, -1, refs_word, latency)
+
+    def pending(self, writes, force: bool = False) -> List[Tuple[int, int, int]]:
+        """
+        The writes that change a register, last value wins.
+        Ordered by chip select and channel.
+        """
+        final = {}
+        for cs_index, dac_channel, code in writes:
+            final[(cs_index, dac_channel)] = code
+        return [
+            (cs_index, dac_channel, code)
+            for (cs_index, dac_channel), code in sorted(final.items())
+            if force or self.codes[register_index(cs_index, dac_channel)] != code
+        ]
+
+    def write(self, writes, force: bool = False, trigger: bool = False):
+        """
+        writes: iterable of (cs_index, dac_channel, code)
+        All values are checked before the first one is sent.
+        trigger: pulse the trigger output after the last write, also if
+        nothing had to be sent. Ignored inside a transaction, see commit.
+        """
+        if self._staged is not None:
+            writes = list(writes)
+            self._check(writes)
+            for cs_index, dac_channel, code in writes:
+                staged_force = self._staged.get((cs_index, dac_channel), (0, False))[1]
+                self._staged[(cs_index, dac_channel)] = (code, force or staged_force)
+            return
+        writes = self.pending(writes, force)
+        self._check(writes)
+        self._flush(writes, trigger)
+
+    def _check(self, writes: List[Tuple[int, int, int]]):
+        for cs_index, dac_channel, code in writes:
+            dac = self.dacs[cs_index]
+            if code < 0 or code >= 2**dac.resolution:
+                raise ValueError(f"Invalid dac value {code}")
+
+    @property
+    def staging(self) -> bool:
+        return self._staged is not None
+
+    def begin(self):
+        """
+        Collect the writes until commit() instead of sending them.
+        """
+        if self._staged is not None:
+            raise RuntimeError("Transaction already open")
+        self._staged = {}
+
+    def commit(self, trigger: bool = False):
+        """
+        Send the last staged value of every register that changes (or was
+        written with force) in one burst.
+        """
+        staged, self._staged = self._staged, None
+        if staged is None:
+            raise RuntimeError("No open transaction")
+        self._flush(
+            [
+                (cs_index, dac_channel, code)
+                for (cs_index, dac_channel), (code, force) in sorted(staged.items())
+                if force or self.codes[register_index(cs_index, dac_channel)] != code
+            ],
+            trigger,
+        )
+
+    def discard(self):
+        self._staged = None
+
+    @contextmanager
+    def transaction(self, trigger: bool = False):
+        """
+        Stage all writes of the block and commit them at its end.
+        Nothing is sent if the block raises. Nested blocks join the outer one.
+        """
+        if self.staging:
+            yield self
+            return
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.discard()
+            raise
+        self.commit(trigger)
+
+    def _flush(self, writes: List[Tuple[int, int, int]], trigger: bool = False):
+        """
+        Send the writes in one SpiIO.do_io_24_many call per SPI link,
+        so a streaming link does not wait for each answer.
+        If the link supports multicast, the same code on the same channel of
+        several chips is sent in one transaction.
+        trigger: set on the last transfer of the last link
+        """
+        if trigger and not writes:
+            next(iter(self.dacs.values())).spi.pulse_trigger()
+            return
+        groups = [
+            (spi, list(group))
+            for spi, group in groupby(writes, key=lambda write: self.dacs[write[0]].spi)
+        ]
+        for number, (spi, group) in enumerate(groups):
+            last_trigger = trigger and number == len(groups) - 1
+            if spi.multicast:
+                group = self._flush_multicast(group, last_trigger)
+            if not group:
+                continue
+            start = time.perf_counter()
+            answers = spi.do_io_24_many(
+                [
+                    (self.dacs[cs_index].channel_transfer(dac_channel, code), cs_index)
+                    for cs_index, dac_channel, code in group
+                ],
+                last_trigger,
+            )
+            # the answers of a stream arrive together, use the mean latency
+            latency = (time.perf_counter() - start) / len(group)
+            for (cs_index, dac_channel, code), answer in zip(group, answers):
+                self.dacs[cs_index].check_write_answer(answer)
+                self.update_channel(cs_index, dac_channel, code, latency)
+
+    def _flush_multicast(
+        self, writes: List[Tuple[int, int, int]], trigger: bool = False
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Multicast the writes shared by several chips, returns the others.
+        trigger: set on the last multicast if there are no others
+        """
+        targets: Dict[Tuple[int, int], List[int]] = {}
+        for cs_index, dac_channel, code in writes:
+            targets.setdefault((dac_channel, code), []).append(cs_index)
+
+        remaining = []
+        shared = []
+        for (dac_channel, code), cs_indices in targets.items():
+            if len(cs_indices) == 1:
+                remaining.append((cs_indices[0], dac_channel, code))
+            else:
+                shared.append((dac_channel, code, cs_indices))
+
+        for number, (dac_channel, code, cs_indices) in enumerate(shared):
+            last_trigger = trigger and not remaining and number == len(shared) - 1
+            dacs = [self.dacs[cs_index] for cs_index in cs_indices]
+            start = time.perf_counter()
+            multicast_write(
+                dacs, dacs[0].channel_transfer(dac_channel, code), last_trigger
+            )
+            latency = time.perf_counter() - start
+            for cs_index in cs_indices:
+                self.update_channel(cs_index, dac_channel, code, latency)
+        return sorted(remaining)
@@ -0,0 +1,118 @@
+"""
+Adaptive S-curve scans.
+
+The count rate of a discriminator as a function of its threshold is an S-curve.
+Instead of stepping through all DAC codes, the edge is located by bisection,
+which needs about log2(range) measurements. The edge width is found the same
+way, reusing the points measured for the edge to narrow the search.
+"""
+
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+
+class SCurvePoint(NamedTuple):
+    code: int
+    counts: int
+
+
+class SCurveEdge(NamedTuple):
+    code: float  # code where the counts cross the requested fraction
+    width: float  # codes between the lower and upper width fraction, nan if not scanned
+    points: List[SCurvePoint]  # all measurements in the order they were taken
+
+
+class SCurveScan:
+    """
+    measure(code) sets the threshold DAC to code and returns the counts.
+    """
+
+    def __init__(self, measure: Callable[[int], int], low: int, high: int):
+        if high <= low:
+            raise ValueError(f"Invalid scan range {low} ... {high}")
+        self.measure_function = measure
+        self.low = low
+        self.high = high
+        self._cache: Dict[int, int] = {}
+        self.points: List[SCurvePoint] = []
+
+    def measure(self, code: int) -> int:
+        if code not in self._cache:
+            counts = self.measure_function(code)
+            self._cache[code] = counts
+            self.points.append(SCurvePoint(code, counts))
+        return self._cache[code]
+
+    def level(self, fraction: float) -> float:
+        """
+        Counts at fraction of the way from the plateau at high to the one at low.
+        """
+        low_counts = self.measure(self.low)
+        high_counts = self.measure(self.high)
+        if low_counts == high_counts:
+            raise RuntimeError(
+                f"No S-curve edge between {self.low} and {self.high} ({low_counts} counts)"
+            )
+        return high_counts + fraction * (low_counts - high_counts)
+
+    def _bracket(self, target: float) -> Tuple[int, int]:
+        """
+        Tightest bracket around target from the measurements taken so far.
+        """
+        low_side = self._cache[self.low] > target
+        lo, hi = self.low, self.high
+        for code, counts in self._cache.items():
+            if (counts > target) == low_side:
+                lo = max(lo, code)
+            else:
+                hi = min(hi, code)
+        if hi <= lo:
+            # non monotonic noise, fall back to the full range
+            lo, hi = self.low, self.high
+        return lo, hi
+
+    def find(self, fraction: float = 0.5, resolution: int = 1) -> float:
+        """
+        Code where the counts cross fraction of the S-curve step.
+        """
+        target = self.level(fraction)
+        low_side = self._cache[self.low] > target
+
+        lo, hi = self._bracket(target)
+        while hi - lo > resolution:
+            mid = (lo + hi) // 2
+            if (self.measure(mid) > target) == low_side:
+                lo = mid
+            else:
+                hi = mid
+
+        # linear interpolation inside the final bracket
+        lo_counts, hi_counts = self._cache[lo], self._cache[hi]
+        if lo_counts == hi_counts:
+            return (lo + hi) / 2
+        return lo + (lo_counts - target) / (lo_counts - hi_counts) * (hi - lo)
+
+
+def find_scurve_edge(
+    measure: Callable[[int], int],
+    low: int,
+    high: int,
+    fraction: float = 0.5,
+    width_fractions: Tuple[float, float] = (0.16, 0.84),
+    resolution: int = 1,
+) -> SCurveEdge:
+    """
+    Locate the S-curve edge between the codes low and high.
+    width_fractions: the width is the distance between these two crossings
+    (0.16 and 0.84 correspond to +-1 sigma of a gaussian noise).
+    Pass None to skip the width measurement.
+    """
+    scan = SCurveScan(measure, low, high)
+    edge = scan.find(fraction, resolution)
+
+    width = float("nan")
+    if width_fractions is not None:
+        first = scan.find(width_fractions[0], resolution)
+        second = scan.find(width_fractions[1], resolution)
+        width = abs(second - first)
+
+    return SCurveEdge(edge, width, scan.points)
@@ -0,0 +1,111 @@
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CommandPriority(IntEnum):
+    INTERACTIVE: int = 0
+    BULK: int = 1
+
+
+class CommandScheduler:
+    """
+    Serializes all access to the board through a single worker thread.
+
+    Every submitted call is queued and executed one after another, the result
+    (or exception) is delivered through a concurrent.futures.Future.
+    With prioritize=True, interactive commands overtake queued bulk commands.
+    """
+
+    def __init__(self, prioritize: bool = True):
+        self.prioritize = prioritize
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._run, name="ELBArduDiscScheduler", daemon=True
+        )
+        self._worker.start()
+
+    def submit(
+        self,
+        function: Callable,
+        *args,
+        priority: CommandPriority = CommandPriority.INTERACTIVE,
+        **kwargs,
+    ) -> Future:
+        if self._closed:
+            raise RuntimeError("Scheduler is closed")
+
+        future = Future()
+        if not self.prioritize:
+            priority = CommandPriority.INTERACTIVE
+        # the sequence number keeps the order within one priority level
+        self._queue.put(
+            (int(priority), next(self._sequence), function, args, kwargs, future)
+        )
+        return future
+
+    def close(self, wait: bool = True):
+        if self._closed:
+            return
+        self._closed = True
+        # the sentinel sorts behind every pending command
+        self._queue.put(
+            (len(CommandPriority), next(self._sequence), None, (), {}, None)
+        )
+        if wait:
+            self._worker.join()
+
+    def _run(self):
+        while True:
+            _, _, function, args, kwargs, future = self._queue.get()
+            if function is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                logger.debug(f"Scheduled command {function} failed: {e}")
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class ScheduledControl:
+    """
+    Wraps a control object (e.g. ELBArduDiscChannelControl).
+    Every public method call is submitted to the scheduler and returns a Future.
+    """
+
+    def __init__(
+        self,
+        control: Any,
+        scheduler: CommandScheduler,
+        priority: CommandPriority = CommandPriority.INTERACTIVE,
+    ):
+        self.control = control
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def with_priority(self, priority: CommandPriority) -> "ScheduledControl":
+        return ScheduledControl(self.control, self.scheduler, priority)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.control, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def submit(*args, **kwargs) -> Future:
+            return self.scheduler.submit(
+                attribute, *args, priority=self.priority, **kwargs
+            )
+
+        return submit
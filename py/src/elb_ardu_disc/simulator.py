@@ -0,0 +1,333 @@
+"""
+Simulated board: the firmware model with a behavioural model of the
+discriminators, for developing scans and tuning without hardware.
+
+SimulatedBoard is a FirmwareModel, so the regular ELBArduDisc API runs on it
+through open_loopback(). The DAC codes written by the host set the threshold,
+hysteresis, delay and pulse width of every channel; a synthetic input pulse
+stream then determines what the counter and the rate inputs see:
+
+    board = SimulatedBoard([PulseStream(rate_hz=20000, amplitude_v=0.4)])
+    ead = open_loopback(board)
+    ead.timing_control.set_channel_delay_current(0, 512)  # 0 switches it off
+    ead.timing_control.set_channel_pulse_width_current(0, 512)
+    edge = ead.channel_control.scan_threshold(0)
+    board.now                           # simulated seconds, e.g. of the gates
+
+The time of the board is simulated: a count gate or a rate interval takes no
+real time, every command adds seconds_per_command. Campaigns therefore run
+much faster than real time.
+
+Model, for a threshold V, hysteresis h and noise sigma (all at the input):
+    efficiency of a stream   P(amplitude + noise > V)
+    noise triggers           B / sqrt(3) * exp(-V^2 / 2 sigma^2) * exp(-h^2 / 2 sigma^2)
+                             (Rice rate of band limited gaussian noise, the
+                             hysteresis suppresses re-crossings)
+    threshold V              nominal formula of ELBArduDiscChannelControl
+    hysteresis h             code / max code * hysteresis_full_scale_v
+    delay, pulse width       calibration curves if given, else
+                             TIMING_OFFSET_NS + TIMING_NS * threshold / current
+    dead time                the output pulse (non-paralyzable)
+A current code of 0 switches the output off. The logic outputs are the
+coincidence (AND) of the outputs of channels 0 and 1 (CH 01) and of
+channels 2 and 3 (CH 23), with their own delay and pulse width.
+
+The counts of the counter and the rate inputs come from the expected rates,
+without numpy. output_pulses() generates the single pulses of the channels
+and of the logic outputs for timing studies (needs numpy).
+"""
+
+import math
+import random
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from .calibration import (
+    DELAY,
+    LOGIC_DELAY,
+    LOGIC_PULSE_WIDTH,
+    PULSE_WIDTH,
+    QUANTITIES,
+    Calibration,
+)
+from .loopback import FIRMWARE_VERSION, PULSER_MAX_DUTY, RATE_CHANNELS, FirmwareModel
+from .registers import REGISTER_LAYOUT
+
+# same nominal values as ELBArduDiscChannelControl
+MIN_THRESHOLD_V = -2.5
+MAX_THRESHOLD_V = 2.5
+ATTENUATION_FACTOR = 0.72
+THRESHOLD_MAX_CODE = 0xFFF
+HYSTERESIS_MAX_CODE = 0x3FF
+
+# nominal timing of the current/threshold pairs
+TIMING_OFFSET_NS = 5.0
+TIMING_NS = 20.0
+
+LOGIC_CHANNELS = 2
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The pulse simulation needs numpy (pip install elb_ardu_disc[numpy])"
+        ) from None
+    return numpy
+
+
+def threshold_v(code: int) -> float:
+    """
+    Threshold of a code, the inverse of ELBArduDiscChannelControl.set_threshold_v.
+    """
+    range = (MAX_THRESHOLD_V - MIN_THRESHOLD_V) / ATTENUATION_FACTOR
+    return code / THRESHOLD_MAX_CODE * range - range / 2
+
+
+class PulseStream(NamedTuple):
+    """
+    Pulses at random times on the inputs of channels, e.g. the particles
+    seen by two detectors. The amplitude varies from pulse to pulse.
+    """
+
+    rate_hz: float
+    amplitude_v: float
+    amplitude_sigma_v: float = 0.0
+    channels: Tuple[int, ...] = (0, 1, 2, 3)
+
+
+class ChannelState(NamedTuple):
+    """
+    Behaviour of a channel for the DAC codes that are set.
+    """
+
+    threshold_v: float
+    hysteresis_v: float
+    delay_ns: float  # inf if the output is off
+    pulse_width_ns: float
+
+
+class OutputPulses(NamedTuple):
+    start_ns: "numpy.ndarray"
+    width_ns: float
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    # Knuth
+    limit = math.exp(-mean)
+    count = 0
+    product = rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class SimulatedBoard(FirmwareModel):
+    """
+    streams: synthetic input pulses
+    noise_sigma_v, noise_bandwidth_hz: gaussian noise on every input
+    hysteresis_full_scale_v: hysteresis of the highest code
+    seconds_per_command: simulated time of a command and its answer
+    calibration: curves of the timing, see calibration.py
+    seed: of the random counts and pulses
+    """
+
+    def __init__(
+        self,
+        streams: Sequence[PulseStream] = (),
+        noise_sigma_v: float = 0.005,
+        noise_bandwidth_hz: float = 50e6,
+        hysteresis_full_scale_v: float = 0.05,
+        seconds_per_command: float = 0.001,
+        calibration: Calibration = None,
+        seed: int = 0,
+        version: str = FIRMWARE_VERSION,
+    ):
+        super().__init__(version=version)
+        self.streams = list(streams)
+        self.noise_sigma_v = noise_sigma_v
+        self.noise_bandwidth_hz = noise_bandwidth_hz
+        self.hysteresis_full_scale_v = hysteresis_full_scale_v
+        self.seconds_per_command = seconds_per_command
+        self.calibration = calibration
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # simulated time in seconds
+        self.now = 0.0
+        self.clock = lambda: self.now
+        self.count_source = self._count_gate
+
+    def advance(self, seconds: float):
+        """
+        Let simulated time pass, e.g. to collect rate samples.
+        """
+        self.now += seconds
+
+    def process_line(self, line: str) -> str:
+        reply = super().process_line(line)
+        self.now += self.seconds_per_command
+        return reply
+
+    def _code(self, name: str, channel: int) -> int:
+        cs, dac_channels = REGISTER_LAYOUT[name]
+        return self.dacs[cs.value].registers[dac_channels[channel]]
+
+    def _timing_ns(self, quantity: str, channel: int) -> float:
+        threshold_name, current_name = QUANTITIES[quantity]
+        current = self._code(current_name, channel)
+        if current == 0:
+            return math.inf
+        threshold = self._code(threshold_name, channel)
+        calibration = self.calibration
+        if calibration is not None and calibration.calibrated(quantity, channel):
+            return max(calibration[quantity].value(channel, threshold, current), 0.0)
+        return TIMING_OFFSET_NS + TIMING_NS * threshold / current
+
+    def channel_state(self, channel: int) -> ChannelState:
+        hysteresis = self._code("hys", channel)
+        return ChannelState(
+            threshold_v(self._code("thr", channel)),
+            hysteresis / HYSTERESIS_MAX_CODE * self.hysteresis_full_scale_v,
+            self._timing_ns(DELAY, channel),
+            self._timing_ns(PULSE_WIDTH, channel),
+        )
+
+    def _input_streams(self) -> List[PulseStream]:
+        streams = list(self.streams)
+        if self.pulser_running:
+            # the testpulser on all inputs, 1 V at full duty cycle
+            streams.append(
+                PulseStream(
+                    1e9 / self.pulser_period_ns(),
+                    self.pulser_duty / PULSER_MAX_DUTY,
+                    channels=tuple(range(RATE_CHANNELS)),
+                )
+            )
+        return streams
+
+    def _efficiency(self, stream: PulseStream, state: ChannelState) -> float:
+        sigma = math.hypot(stream.amplitude_sigma_v, self.noise_sigma_v)
+        if sigma == 0:
+            return float(stream.amplitude_v > state.threshold_v)
+        return 0.5 * math.erfc(
+            (state.threshold_v - stream.amplitude_v) / (math.sqrt(2) * sigma)
+        )
+
+    def noise_rate(self, state: ChannelState) -> float:
+        sigma = self.noise_sigma_v
+        if sigma == 0:
+            return 0.0
+        return (
+            self.noise_bandwidth_hz
+            / math.sqrt(3)
+            * math.exp(-(state.threshold_v**2) / (2 * sigma**2))
+            * math.exp(-(state.hysteresis_v**2) / (2 * sigma**2))
+        )
+
+    def output_rate(self, channel: int) -> float:
+        """
+        Expected rate of the output of channel in Hz, after the dead time.
+        """
+        state = self.channel_state(channel)
+        if math.isinf(state.delay_ns) or math.isinf(state.pulse_width_ns):
+            return 0.0
+        rate = self.noise_rate(state)
+        for stream in self._input_streams():
+            if channel in stream.channels:
+                rate += stream.rate_hz * self._efficiency(stream, state)
+        return rate / (1 + rate * state.pulse_width_ns * 1e-9)
+
+    def _count_gate(self, gate_ms: int, channel: int) -> int:
+        self.now += gate_ms / 1000
+        return _poisson(self.rng, self.output_rate(channel) * gate_ms / 1000)
+
+    def rate_output(self) -> str:
+        self.input_rates = [self.output_rate(c) for c in range(RATE_CHANNELS)]
+        return super().rate_output()
+
+    def _trigger_times(self, numpy, rng, state: ChannelState, duration_s, pulses):
+        """
+        Sorted times (ns) at which the input of a channel crosses its
+        threshold. pulses: (times, amplitudes) of the streams on the input
+        """
+        noise_count = rng.poisson(self.noise_rate(state) * duration_s)
+        times = [rng.uniform(0, duration_s * 1e9, noise_count)]
+        for stream_times, amplitudes in pulses:
+            noise = rng.normal(0, self.noise_sigma_v, len(amplitudes))
+            times.append(stream_times[amplitudes + noise > state.threshold_v])
+        return numpy.sort(numpy.concatenate(times))
+
+    @staticmethod
+    def _dead_time(numpy, times, dead_ns: float):
+        """
+        The times that start an output pulse: no pulse starts during another one.
+        """
+        kept = []
+        index = 0
+        while index < len(times):
+            kept.append(index)
+            index = numpy.searchsorted(times, times[index] + dead_ns, side="left")
+        return times[kept]
+
+    def output_pulses(self, duration_s: float) -> Dict[str, OutputPulses]:
+        """
+        One realization of duration_s of the inputs: the output pulses of
+        the channels ("channel0" ...) and of the logic outputs ("logic0" and
+        "logic1"). Does not advance the simulated time.
+        """
+        numpy = _numpy()
+        rng = numpy.random.default_rng(self.rng.getrandbits(32))
+        pulses = []
+        for stream in self._input_streams():
+            count = rng.poisson(stream.rate_hz * duration_s)
+            times = numpy.sort(rng.uniform(0, duration_s * 1e9, count))
+            amplitudes = rng.normal(stream.amplitude_v, stream.amplitude_sigma_v, count)
+            pulses.append((stream, (times, amplitudes)))
+
+        outputs: Dict[str, OutputPulses] = {}
+        for channel in range(RATE_CHANNELS):
+            state = self.channel_state(channel)
+            if math.isinf(state.delay_ns) or math.isinf(state.pulse_width_ns):
+                starts = numpy.zeros(0)
+            else:
+                seen = [
+                    times_amplitudes
+                    for stream, times_amplitudes in pulses
+                    if channel in stream.channels
+                ]
+                times = self._trigger_times(numpy, rng, state, duration_s, seen)
+                starts = self._dead_time(numpy, times, state.pulse_width_ns)
+                starts = starts + state.delay_ns
+            outputs[f"channel{channel}"] = OutputPulses(starts, state.pulse_width_ns)
+
+        for logic in range(LOGIC_CHANNELS):
+            first = outputs[f"channel{2 * logic}"]
+            second = outputs[f"channel{2 * logic + 1}"]
+            delay_ns = self._timing_ns(LOGIC_DELAY, logic)
+            width_ns = self._timing_ns(LOGIC_PULSE_WIDTH, logic)
+            starts = numpy.zeros(0)
+            if (
+                len(first.start_ns)
+                and len(second.start_ns)
+                and not (math.isinf(delay_ns) or math.isinf(width_ns))
+            ):
+                # the last pulse of second starting before the end of each
+                # pulse of first overlaps it if it ends after its start
+                index = (
+                    numpy.searchsorted(
+                        second.start_ns, first.start_ns + first.width_ns, side="left"
+                    )
+                    - 1
+                )
+                valid = index >= 0
+                other = second.start_ns[numpy.maximum(index, 0)]
+                overlap = valid & (other + second.width_ns > first.start_ns)
+                starts = numpy.maximum(first.start_ns, other)[overlap]
+                starts = self._dead_time(numpy, starts, width_ns) + delay_ns
+            outputs[f"logic{logic}"] = OutputPulses(starts, width_ns)
+        return outputs
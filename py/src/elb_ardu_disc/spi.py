@@ -1,17 +1,138 @@
 import serial
+import threading
 import time
-from typing import List
+from collections import deque
+from enum import IntFlag
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
 import re
 
 import logging
 
-logging.basicConfig(level=logging.INFO)
+from .recorder import RecordingSerial
+
+logger = logging.getLogger(__name__)
 
 
 MINIMUM_FW_VERSION = "0.0.1"
+# first firmware that answers SYSTem:FLOW?
+FLOW_CONTROL_FW_VERSION = "0.0.2"
+# first firmware with SYSTem:SPI:MULticast
+MULTICAST_FW_VERSION = "0.0.3"
+# first firmware with SYSTem:STATistics? and SYSTem:SPI:CLOCk
+STATISTICS_FW_VERSION = "0.0.4"
+# first firmware with SYSTem:CAPabilities?
+CAPABILITIES_FW_VERSION = "0.1.0"
+# first firmware known to have SYSTem:COUNt?, it was added without a version
+# change, so a 0.0.1 board may not have it
+COUNTER_FW_VERSION = "0.0.2"
+# same for SYSTem:PULser:PERiod, DUTY and BURSt
+PULSER_FW_VERSION = "0.0.2"
+# channels of the counter with Capability.COUNTER_CHANNELS
+COUNTER_CHANNELS = 4
+
+# baud rates of SYSTem:BAUD, fastest first
+BAUD_RATES = (1000000, 500000, 250000, 115200)
+# the firmware restores the old baud rate if it is not confirmed in time
+BAUD_CONFIRM_S = 1.0
+# interval of the rate samples of SYSTem:RATE
+RATE_MIN_INTERVAL_MS = 10
+RATE_MAX_INTERVAL_MS = 10000
+
+
+class Capability(IntFlag):
+    """
+    Feature bitmap of SYSTem:CAPabilities?
+    """
+
+    FLOW_CONTROL = 0x01
+    MULTICAST = 0x02
+    STATISTICS = 0x04
+    SPI_CLOCK = 0x08
+    BAUD = 0x10
+    BINARY = 0x20  # reserved, no firmware implements binary framing yet
+    TRIGGER = 0x40
+    RATE = 0x80
+    CONFIG = 0x100
+    COUNTER = 0x200
+    PULSER = 0x400  # testpulser period, duty cycle and bursts
+    COUNTER_CHANNELS = 0x800  # counts every channel, not only the aux input
+
+
+# "SYST:SPI:SEN <cs_index>, <command>, " by (cs_index, command), filled on use
+_SEND_PREFIXES: Dict[Tuple[int, int], bytes] = {}
+# "<payload>\n" for all 12 bit DAC codes
+_PAYLOADS = [b"%d\n" % payload for payload in range(4096)]
+
+
+def _send_command(
+    cs_index: int, command: int, payload: int, trigger: bool = False
+) -> bytes:
+    """
+    SYSTem:SPI:SENd line from the precomputed tables, without formatting.
+    """
+    prefix = _SEND_PREFIXES.get((cs_index, command))
+    if prefix is None:
+        prefix = b"SYST:SPI:SEN %d, %d, " % (cs_index, command)
+        _SEND_PREFIXES[(cs_index, command)] = prefix
+    if trigger:
+        return prefix + b"%d, 1\n" % payload
+    if payload < 4096:
+        return prefix + _PAYLOADS[payload]
+    return prefix + b"%d\n" % payload
+
+
+# capabilities of firmware without SYSTem:CAPabilities?, and of features that
+# are older than their bit in the bitmap
+_VERSION_CAPABILITIES = [
+    (COUNTER_FW_VERSION, Capability.COUNTER),
+    (PULSER_FW_VERSION, Capability.PULSER),
+    (FLOW_CONTROL_FW_VERSION, Capability.FLOW_CONTROL),
+    (MULTICAST_FW_VERSION, Capability.MULTICAST),
+    (STATISTICS_FW_VERSION, Capability.STATISTICS | Capability.SPI_CLOCK),
+]
+
+
+class FirmwareStatistics(NamedTuple):
+    """
+    Performance counters of the firmware, times are cumulative microseconds
+    (they wrap after about 71 minutes).
+    """
+
+    commands: int
+    spi_transfers: int
+    parse_us: int  # from receiving a command line until its handler runs
+    spi_us: int
+    tx_us: int  # writing answers to the serial output, includes waiting for space
+    rx_overflows: int  # receive buffer found full, bytes may have been lost
+
+    @classmethod
+    def from_reply(cls, reply: str) -> "FirmwareStatistics":
+        # STAT,<commands>,<spi_transfers>,<parse_us>,<spi_us>,<tx_us>,<rx_overflows>
+        return cls(*(int(value) for value in reply.split(",")[1:7]))
+
+
+class StoredConfig(NamedTuple):
+    """
+    Register image in the EEPROM of the firmware, see configstore.py.
+    """
+
+    valid: bool  # False if there is none or its checksum is wrong
+    auto_restore: bool  # restored at every start of the firmware
+    checksum: int
+
+    @classmethod
+    def from_reply(cls, reply: str) -> "StoredConfig":
+        # CONF,<valid>,<auto_restore>,<checksum hex>
+        fields = reply.split(",")
+        return cls(fields[1] == "1", fields[2] == "1", int(fields[3], 16))
 
 
 class SpiIO:
+    # True if do_io_24_multicast selects all chips in one transaction
+    multicast = False
+    # True if the link has a trigger output, see pulse_trigger
+    trigger = False
+
     def __init__(self):
         pass
 
@@ -21,10 +142,122 @@ class SpiIO:
     def do_io_24(self, data_out: List[int], cs_index: int) -> List[int]:
         pass
 
+    def transfer_24(self, command: int, data_word: int, cs_index: int) -> int:
+        """
+        do_io_24 of the command byte and the 16 bit data_word, returns the
+        24 bit answer as one int. Transports override it to avoid the lists.
+        """
+        answer = self.do_io_24([command, data_word >> 8, data_word & 0xFF], cs_index)
+        return (answer[0] << 16) | (answer[1] << 8) | answer[2]
+
+    def do_io_24_many(
+        self, transfers: Sequence[Tuple[List[int], int]], trigger: bool = False
+    ) -> List[List[int]]:
+        """
+        transfers: (data_out, cs_index) pairs, returns the answers in the same order.
+        Implementations may send them without waiting for each answer.
+        trigger: pulse the trigger output after the last transfer
+        """
+        answers = [
+            self.do_io_24(data_out, cs_index) for data_out, cs_index in transfers
+        ]
+        if trigger:
+            self.pulse_trigger()
+        return answers
+
+    def do_io_24_multicast(
+        self, data_out: List[int], cs_indices: Sequence[int], trigger: bool = False
+    ) -> List[List[int]]:
+        """
+        Send the same write to several chips, returns the answers in the
+        order of cs_indices. A real multicast reads one shared answer.
+        """
+        answers = [self.do_io_24(data_out, cs_index) for cs_index in cs_indices]
+        if trigger:
+            self.pulse_trigger()
+        return answers
+
+    def pulse_trigger(self):
+        """
+        Pulse the trigger output, marks that the DAC updates so far are active.
+        """
+        raise RuntimeError(f"{type(self).__name__} has no trigger output")
+
+
+class LinkLock:
+    """
+    Re-entrant lock for one serial link, remembers when the link was last used.
+
+    Background tasks (e.g. the integrity verifier) only get the link with
+    acquire_if_idle: when nobody waits for it and it was idle for a while.
+    Their own use of the link does not count as activity.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._waiting_lock = threading.Lock()
+        self._background_owner = None
+        self.last_used = 0.0
+        self.waiting = 0
+
+    def _is_background(self) -> bool:
+        return self._background_owner == threading.get_ident()
+
+    def __enter__(self):
+        if self._background_owner is None and self._lock.acquire(blocking=False):
+            # uncontended, the common case. last_used is set on exit, a
+            # background task cannot take the link before that anyway
+            return self
+        if self._is_background():
+            self._lock.acquire()
+            return self
+        with self._waiting_lock:
+            self.waiting += 1
+        try:
+            self._lock.acquire()
+        finally:
+            with self._waiting_lock:
+                self.waiting -= 1
+        self.last_used = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._background_owner is None or not self._is_background():
+            self.last_used = time.monotonic()
+        self._lock.release()
+
+    def acquire_if_idle(self, idle_s: float) -> bool:
+        if self.waiting or time.monotonic() - self.last_used < idle_s:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        if self.waiting:
+            self._lock.release()
+            return False
+        self._background_owner = threading.get_ident()
+        return True
+
+    def release_background(self):
+        self._background_owner = None
+        self._lock.release()
+
 
 class TestpulserScpi:
-    def __init__(self, serial_connection: serial):
+    """
+    require(capability) raises if the firmware can only switch the pulser.
+    """
+
+    def __init__(
+        self,
+        serial_connection: serial,
+        lock: LinkLock = None,
+        reader: "ReplyReader" = None,
+        require: Callable[[Capability], None] = None,
+    ):
         self.ser = serial_connection
+        self.lock = lock if lock is not None else LinkLock()
+        self.reader = reader if reader is not None else ReplyReader(serial_connection)
+        self._require = require
 
     def switch_testpulser(self, on: bool):
         if on:
@@ -33,37 +266,244 @@ class TestpulserScpi:
             scpi_command = "SYST:PUL:DIS\n"
 
         to_send = scpi_command.encode("ascii")
-        self.ser.write(to_send)
+        with self.lock:
+            self.ser.write(to_send)
+            return self.reader.wait_for_reply("Pulser")
+
+    def _query(self, scpi_command: str, line_start: str) -> int:
+        if self._require is not None:
+            self._require(Capability.PULSER)
+        to_send = scpi_command.encode("ascii")
+        with self.lock:
+            self.ser.write(to_send)
+            reply = self.reader.wait_for_reply(line_start)
+        return int(reply.split(",")[1])
+
+    def set_period(self, period_us: int) -> int:
+        """
+        Returns the period in ns the timer actually achieved.
+        """
+        return self._query(f"SYST:PUL:PER {period_us}\n", "PULPER")
+
+    def get_period(self) -> int:
+        return self._query("SYST:PUL:PER?\n", "PULPER")
+
+    def set_duty(self, duty: int) -> int:
+        return self._query(f"SYST:PUL:DUTY {duty}\n", "PULDUTY")
+
+    def get_duty(self) -> int:
+        return self._query("SYST:PUL:DUTY?\n", "PULDUTY")
+
+    def burst(self, pulses: int) -> int:
+        return self._query(f"SYST:PUL:BURS {pulses}\n", "PULBURST")
+
+
+class CounterScpi:
+    """
+    Gated counter of the firmware, on the aux input or on a channel output.
+    require(capability) raises if the firmware does not have the counter.
+    channels: the firmware counts every channel (Capability.COUNTER_CHANNELS)
+    """
+
+    def __init__(
+        self,
+        serial_connection: serial,
+        lock: LinkLock = None,
+        reader: "ReplyReader" = None,
+        require: Callable[[Capability], None] = None,
+        channels: bool = True,
+    ):
+        self.ser = serial_connection
+        self.lock = lock if lock is not None else LinkLock()
+        self.reader = reader if reader is not None else ReplyReader(serial_connection)
+        self._require = require
+        self.channels = channels
+
+    def count(self, gate_ms: int = 100, channel: int = None) -> int:
+        """
+        channel: None for the aux input (A0, the output of channel 0 unless
+        it is wired differently)
+        """
+        if gate_ms < 1 or gate_ms > 10000:
+            raise ValueError(f"Invalid gate time {gate_ms} ms. Allowed: 1 ... 10000 ms")
+        if self._require is not None:
+            self._require(Capability.COUNTER)
+
+        if channel is None:
+            to_send = f"SYST:COUN? {gate_ms}\n".encode("ascii")
+        else:
+            if channel < 0 or channel >= COUNTER_CHANNELS:
+                raise ValueError(f"Invalid counter channel {channel}")
+            if self._require is not None:
+                self._require(Capability.COUNTER_CHANNELS)
+            to_send = f"SYST:COUN? {gate_ms}, {channel}\n".encode("ascii")
+        with self.lock:
+            self.ser.write(to_send)
+            reply = self.reader.wait_for_reply("COUNT", timeout=gate_ms / 1000 + 4.0)
+
+        # COUNT,<gate_ms>,<counts>
+        return int(reply.split(",")[2])
 
-        return wait_for_reply(self.ser, "Pulser")
+
+class ReplyReader:
+    """
+    Splits the input of a serial link into lines.
+    Bytes received after the requested reply are kept for the next call,
+    so pipelined replies are not lost.
+    Lines the firmware sends without a request (e.g. rate samples) are passed
+    to their listener, whenever they arrive.
+    """
+
+    def __init__(self, serial_connection: serial):
+        self.ser = serial_connection
+        self._buffer = bytearray()
+        self._listeners: Dict[bytes, Callable[[bytes], None]] = {}
+
+    def clear(self):
+        self._buffer.clear()
+
+    def add_listener(self, line_start: bytes, callback: Callable[[bytes], None]):
+        """
+        callback(line) for every line starting with line_start, without the
+        line end. It is called by the thread that reads the link.
+        """
+        self._listeners[line_start] = callback
+
+    def remove_listener(self, line_start: bytes):
+        self._listeners.pop(line_start, None)
+
+    def _dispatch(self, line: bytes) -> bool:
+        for line_start, callback in list(self._listeners.items()):
+            if line.startswith(line_start):
+                try:
+                    callback(line.rstrip(b"\r"))
+                except Exception:
+                    logger.exception(f"Listener for {line_start} failed")
+                return True
+        return False
+
+    def poll(self):
+        """
+        Pass the lines that arrived to their listeners, other lines are dropped.
+        Only while holding the link lock, with no reply outstanding.
+        """
+        while self.ser.in_waiting:
+            self._buffer += self.ser.read(min(self.ser.in_waiting, 512))
+        end = self._buffer.find(b"\n")
+        while end >= 0:
+            self._dispatch(bytes(self._buffer[:end]))
+            del self._buffer[: end + 1]
+            end = self._buffer.find(b"\n")
+
+    def wait_for_reply(self, line_start: str = "", timeout: float = 4.0) -> str:
+        """
+        Next line starting with line_start, other lines are dropped.
+        """
+        start_time = time.time()
+
+        while True:
+            end = self._buffer.find(b"\n")
+            while end >= 0:
+                raw_line = bytes(self._buffer[:end])
+                del self._buffer[: end + 1]
+                if self._listeners and self._dispatch(raw_line):
+                    end = self._buffer.find(b"\n")
+                    continue
+                line = raw_line.decode("ascii", errors="ignore").strip()
+                if line.startswith(line_start):
+                    logger.debug("Answer %s, took %s", line, time.time() - start_time)
+                    return line
+                end = self._buffer.find(b"\n")
+
+            bytes_waiting = self.ser.in_waiting
+            if bytes_waiting:
+                self._buffer += self.ser.read(min(bytes_waiting, 512))
+                continue
+
+            if time.time() - start_time > timeout:
+                raise TimeoutError(f"Timeout waiting for {line_start} response")
+
+            # Small sleep to reduce CPU use but longer than 10us
+            time.sleep(0.001)
+
+    def wait_for_value(self, line_start: bytes, timeout: float = 4.0) -> int:
+        """
+        Last comma separated field of the next line starting with line_start,
+        as int. Like wait_for_reply, but the line is neither decoded nor split.
+        """
+        buffer = self._buffer
+        start_time = None
+        while True:
+            end = buffer.find(b"\n")
+            while end >= 0:
+                if buffer.startswith(line_start):
+                    # int() ignores the \r
+                    value = int(buffer[buffer.rfind(b",", 0, end) + 1 : end])
+                    del buffer[: end + 1]
+                    return value
+                if self._listeners:
+                    self._dispatch(bytes(buffer[:end]))
+                del buffer[: end + 1]
+                end = buffer.find(b"\n")
+
+            bytes_waiting = self.ser.in_waiting
+            if bytes_waiting:
+                buffer += self.ser.read(min(bytes_waiting, 512))
+                continue
+
+            if start_time is None:
+                start_time = time.time()
+            elif time.time() - start_time > timeout:
+                raise TimeoutError(f"Timeout waiting for {line_start} response")
+            time.sleep(0.001)
 
 
 def wait_for_reply(
     serial_connection: serial, line_start: str, timeout: float = 4.0
 ) -> str:
-    start_time = time.time()
-    buffer = bytearray()
-
-    while True:
-        bytes_waiting = serial_connection.in_waiting
-        if bytes_waiting:
-            read_size = min(bytes_waiting, 512)
-            data = serial_connection.read(read_size)
+    return ReplyReader(serial_connection).wait_for_reply(line_start, timeout)
 
-            if data:
-                buffer.extend(data)
-                while b"\n" in buffer:
-                    line, _, buffer = buffer.partition(b"\n")
-                    line = line.decode("ascii", errors="ignore").strip()
-                    if line.startswith(line_start):
-                        logging.info(f"Answer {line}, took {time.time() - start_time}")
-                        return line
 
-        if time.time() - start_time > timeout:
-            raise TimeoutError(f"Timeout waiting for {line_start} response")
+def stream_commands(
+    serial_connection: serial,
+    reader: ReplyReader,
+    commands: Sequence[bytes],
+    line_start: str,
+    rx_credits: int,
+    timeout: float = 4.0,
+) -> List[str]:
+    """
+    Send commands without waiting for each reply. Every command must be
+    answered by one line starting with line_start.
 
-        # Small sleep to reduce CPU use but longer than 10us
-        time.sleep(0.001)
+    Credit based flow control: the firmware reads a command line completely
+    from its receive buffer before it answers, so each reply gives back the
+    bytes of its command. Never more than rx_credits unanswered bytes are sent,
+    thus the receive buffer of the firmware cannot overflow.
+    """
+    replies = []
+    in_flight = deque()
+    outstanding = 0
+    next_command = 0
+
+    while len(replies) < len(commands):
+        chunk = bytearray()
+        while next_command < len(commands):
+            size = len(commands[next_command])
+            # a command larger than the window is sent alone
+            if outstanding + size > rx_credits and (in_flight or chunk):
+                break
+            chunk += commands[next_command]
+            in_flight.append(size)
+            outstanding += size
+            next_command += 1
+        if chunk:
+            serial_connection.write(chunk)
+
+        replies.append(reader.wait_for_reply(line_start, timeout))
+        outstanding -= in_flight.popleft()
+
+    return replies
 
 
 class SpiIoAScpi(SpiIO):
@@ -71,23 +511,116 @@ class SpiIoAScpi(SpiIO):
     SCPI Communication - SPI Module
     """
 
-    def __init__(self, serial_connection: serial):
+    def __init__(
+        self,
+        serial_connection: serial,
+        lock: LinkLock = None,
+        reader: ReplyReader = None,
+        rx_credits: int = 0,
+        multicast: bool = False,
+        trigger: bool = False,
+    ):
+        """
+        rx_credits: receive buffer of the firmware in bytes for do_io_24_many,
+        0 to wait for each answer
+        multicast: the firmware supports SYSTem:SPI:MULticast
+        trigger: the firmware has a trigger output (SYSTem:TRIGger)
+        """
         self.ser = serial_connection
+        self.lock = lock if lock is not None else LinkLock()
+        self.reader = reader if reader is not None else ReplyReader(serial_connection)
+        self.rx_credits = rx_credits
+        self.multicast = multicast
+        self.trigger = trigger
+
+    @staticmethod
+    def _encode(data_out: List[int], cs_index: int, trigger: bool = False) -> bytes:
+        if len(data_out) != 3:
+            raise RuntimeError(
+                f"Invalid SPI Data. Expecting list of 3 ints. Provided {data_out}"
+            )
+        payload: int = data_out[2] + (data_out[1] << 8)
+        return _send_command(cs_index, data_out[0], payload, trigger)
 
-    def do_io_24(self, data_out: List[int], cs_index: int):
+    @staticmethod
+    def _decode(reply: str) -> List[int]:
+        # SPIRESP,<index>,<command>,<payload>,<data_read_from_spi>
+        answer = int(reply.split(",")[4])
+        return [(answer >> 16) & 0xFF, (answer >> 8) & 0xFF, answer & 0xFF]
+
+    def _transfer(self, to_send: bytes) -> List[int]:
+        answer = self._transfer_word(to_send)
+        return [(answer >> 16) & 0xFF, (answer >> 8) & 0xFF, answer & 0xFF]
+
+    def _transfer_word(self, to_send: bytes) -> int:
+        with self.lock:
+            self.ser.write(to_send)
+            # SPIRESP,<index>,<command>,<payload>,<data_read_from_spi>
+            return self.reader.wait_for_value(b"SPIRESP")
+
+    def do_io_24(self, data_out: List[int], cs_index: int) -> List[int]:
+        return self._transfer(self._encode(data_out, cs_index))
+
+    def transfer_24(self, command: int, data_word: int, cs_index: int) -> int:
+        return self._transfer_word(_send_command(cs_index, command, data_word))
+
+    def do_io_24_many(
+        self, transfers: Sequence[Tuple[List[int], int]], trigger: bool = False
+    ) -> List[List[int]]:
+        if trigger and not transfers:
+            self.pulse_trigger()
+            return []
+        if trigger and not self.trigger:
+            SpiIO.pulse_trigger(self)
+        commands = [
+            self._encode(data_out, cs_index) for data_out, cs_index in transfers
+        ]
+        if trigger:
+            # the firmware pulses the trigger after the last transfer
+            commands[-1] = self._encode(*transfers[-1], trigger=True)
+        if not self.rx_credits:
+            return [self._transfer(command) for command in commands]
+        with self.lock:
+            replies = stream_commands(
+                self.ser, self.reader, commands, "SPIRESP", self.rx_credits
+            )
+        return [self._decode(reply) for reply in replies]
+
+    def do_io_24_multicast(
+        self, data_out: List[int], cs_indices: Sequence[int], trigger: bool = False
+    ) -> List[List[int]]:
+        if not self.multicast:
+            return super().do_io_24_multicast(data_out, cs_indices, trigger)
+        if trigger and not self.trigger:
+            SpiIO.pulse_trigger(self)
         if len(data_out) != 3:
             raise RuntimeError(
                 f"Invalid SPI Data. Expecting list of 3 ints. Provided {data_out}"
             )
 
+        cs_mask = 0
+        for cs_index in cs_indices:
+            cs_mask |= 1 << cs_index
         command: int = data_out[0]
         payload: int = data_out[2] + (data_out[1] << 8)
 
-        scpi_string = f"SYST:SPI:SEN {cs_index}, {command}, {payload}\n"
+        scpi_string = f"SYST:SPI:MUL {cs_mask}, {command}, {payload}"
+        scpi_string += ", 1\n" if trigger else "\n"
         to_send = scpi_string.encode("ascii")
-        self.ser.write(to_send)
+        with self.lock:
+            self.ser.write(to_send)
+            reply = self.reader.wait_for_reply("SPIMRESP")
 
-        return wait_for_reply(self.ser, "SPIRESP")
+        # SPIMRESP,<mask>,<command>,<payload>,<data_read_from_spi>
+        return [self._decode(reply)] * len(cs_indices)
+
+    def pulse_trigger(self):
+        if not self.trigger:
+            SpiIO.pulse_trigger(self)
+        with self.lock:
+            self.ser.write(b"SYST:TRIG\n")
+            # TRIG,<count>
+            self.reader.wait_for_reply("TRIG")
 
 
 class ArduinoScpi:
@@ -95,16 +628,39 @@ class ArduinoScpi:
     Generic SCPI Communication Class
     """
 
-    def __init__(self, port, baudrate=115200, timeout=2, reset=False):
-        self.ser = serial.Serial()
-        self.ser.port = port
-        self.ser.baudrate = baudrate
-        self.ser.timeout = timeout
-        if not reset:
-            self.ser.dtr = False
-            self.ser.rts = False
-        self.ser.open()
-        print("Opening...")
+    def __init__(
+        self,
+        port,
+        baudrate=115200,
+        timeout=2,
+        reset=False,
+        record_path=None,
+        serial_connection=None,
+    ):
+        """
+        record_path: log all serial traffic to this file (see recorder.py)
+        serial_connection: use this already open serial-like object instead of
+        opening port (e.g. loopback.LoopbackSerial)
+        """
+        if serial_connection is not None:
+            self.ser = serial_connection
+        else:
+            self.ser = serial.Serial()
+            self.ser.port = port
+            self.ser.baudrate = baudrate
+            self.ser.timeout = timeout
+            if not reset:
+                self.ser.dtr = False
+                self.ser.rts = False
+            self.ser.open()
+        if record_path is not None:
+            self.ser = RecordingSerial(self.ser, record_path)
+        self.timeout = timeout
+        self.reader = ReplyReader(self.ser)
+        # serializes request/response pairs so that concurrent callers cannot
+        # interleave commands or steal each other's replies
+        self.lock = LinkLock()
+        logger.info(f"Opened {self.ser.port}")
 
     def send_command(self, command):
         if not command.endswith("\n"):
@@ -113,11 +669,15 @@ class ArduinoScpi:
         self.ser.write(to_send)
 
     def read_response(self):
-        return self.ser.readline().decode("ascii").strip()
+        try:
+            return self.reader.wait_for_reply("", self.timeout)
+        except TimeoutError:
+            return ""
 
     def query(self, command):
-        self.send_command(command)
-        return self.read_response()
+        with self.lock:
+            self.send_command(command)
+            return self.read_response()
 
 
 class ELBArduDiscSCPI(ArduinoScpi):
@@ -125,18 +685,245 @@ class ELBArduDiscSCPI(ArduinoScpi):
     SCPI Communication Class specifically for ELB_ARDU_DISC
     """
 
-    def __init__(self, port, baudrate=115200, timeout=2, reset=False):
-        super().__init__(port, baudrate, timeout, reset)
-        welcome_message = self.ser.read_until(b"\n").decode("utf-8").strip()
+    def __init__(
+        self,
+        port,
+        baudrate=115200,
+        timeout=2,
+        reset=False,
+        record_path=None,
+        serial_connection=None,
+        flow_control=True,
+        max_baudrate=None,
+    ):
+        """
+        The fastest transport the firmware supports is selected (see capabilities):
+        flow_control: stream bulk SPI transfers with credit based flow control
+        max_baudrate: switch to the fastest baud rate up to this one,
+        None to keep baudrate
+        reset: reset the board when opening port, else it keeps running and
+        is identified by *IDN? instead of its welcome message
+        """
+        super().__init__(port, baudrate, timeout, reset, record_path, serial_connection)
+        identify = not reset and serial_connection is None
+        welcome_message = ""
+        if not identify:
+            welcome_message = self.ser.read_until(b"\n").decode("utf-8").strip()
+        if not welcome_message:
+            identify = True
+            with self.lock:
+                self.ser.write(b"*IDN?\n")
+                try:
+                    welcome_message = self.reader.wait_for_reply("ELB", timeout)
+                except TimeoutError:
+                    pass
+        # the firmware has just started (and restored its stored registers)
+        self.started = not identify
         if ELBArduDiscSCPI.check_message_compatibility(welcome_message):
-            print("ELB_ARDU_DISC found:")
-            print(welcome_message)
+            logger.info(f"ELB_ARDU_DISC found: {welcome_message}")
         else:
             raise RuntimeError(
                 f"Incompatible Hardware. Welcome Message was: {welcome_message}"
             )
-        self.spi = SpiIoAScpi(self.ser)
-        self.testpulser = TestpulserScpi(self.ser)
+        self.firmware_version = welcome_message.split(",")[3]
+        self.capabilities = self.get_capabilities()
+        logger.info(f"Firmware capabilities: {self.capabilities!r}")
+
+        if max_baudrate is not None and Capability.BAUD in self.capabilities:
+            self.select_baudrate(max_baudrate)
+
+        self.rx_credits = 0
+        if flow_control and Capability.FLOW_CONTROL in self.capabilities:
+            self.rx_credits = self.get_rx_credits()
+
+        self.spi = SpiIoAScpi(
+            self.ser,
+            self.lock,
+            self.reader,
+            self.rx_credits,
+            multicast=Capability.MULTICAST in self.capabilities,
+            trigger=Capability.TRIGGER in self.capabilities,
+        )
+        self.testpulser = TestpulserScpi(
+            self.ser, self.lock, self.reader, self._require
+        )
+        self.counter = CounterScpi(
+            self.ser,
+            self.lock,
+            self.reader,
+            self._require,
+            channels=Capability.COUNTER_CHANNELS in self.capabilities,
+        )
+
+    def _query(self, scpi_command: str, line_start: str, timeout: float = 4.0) -> str:
+        to_send = scpi_command.encode("ascii")
+        with self.lock:
+            self.ser.write(to_send)
+            return self.reader.wait_for_reply(line_start, timeout)
+
+    def _require(self, capability: Capability):
+        if capability not in self.capabilities:
+            raise RuntimeError(
+                f"Firmware {self.firmware_version} does not support {capability.name}"
+            )
+
+    def get_capabilities(self) -> Capability:
+        """
+        Older firmware has no capability query, its features follow from the version.
+        """
+        capabilities = Capability(0)
+        for version, capability in _VERSION_CAPABILITIES:
+            if ELBArduDiscSCPI.check_version(self.firmware_version, version):
+                capabilities |= capability
+        if ELBArduDiscSCPI.check_version(
+            self.firmware_version, CAPABILITIES_FW_VERSION
+        ):
+            # CAP,<hex bitmap>
+            bitmap = int(self._query("SYST:CAP?\n", "CAP").split(",")[1], 16)
+            # bits of future firmware are ignored
+            capabilities |= Capability(bitmap & sum(Capability))
+        return capabilities
+
+    def set_baudrate(self, baudrate: int) -> bool:
+        """
+        Switch host and firmware to baudrate, returns False if that failed.
+        The firmware goes back to the old rate if it does not hear from the host.
+        If only the answer of the confirmation got lost, the firmware stays at
+        baudrate, so after a failure the host takes the rate the firmware
+        answers at.
+        """
+        self._require(Capability.BAUD)
+        old_baudrate = self.ser.baudrate
+        with self.lock:
+            # BAUD,<baud>
+            reply = self._query(f"SYST:BAUD {baudrate}\n", "BAUD")
+            if int(reply.split(",")[1]) != baudrate:
+                return False
+            self.ser.baudrate = baudrate
+            self.ser.reset_input_buffer()
+            self.reader.clear()
+            try:
+                # confirms the new rate to the firmware
+                self._query("SYST:CAP?\n", "CAP", timeout=BAUD_CONFIRM_S / 4)
+            except TimeoutError:
+                logger.warning(f"Baud rate {baudrate} failed, back to {old_baudrate}")
+                time.sleep(BAUD_CONFIRM_S)
+                for rate in (old_baudrate, baudrate):
+                    if self._answers_at(rate):
+                        break
+                else:
+                    logger.error(f"No answer at {old_baudrate} or {baudrate} baud")
+                    self.ser.baudrate = old_baudrate
+                return False
+        logger.info(f"Baud rate {baudrate}")
+        return True
+
+    def _answers_at(self, baudrate: int) -> bool:
+        self.ser.baudrate = baudrate
+        self.ser.reset_input_buffer()
+        self.reader.clear()
+        try:
+            self._query("*IDN?\n", "ELB", timeout=BAUD_CONFIRM_S / 4)
+        except TimeoutError:
+            return False
+        return True
+
+    def select_baudrate(self, max_baudrate: int) -> int:
+        """
+        Switch to the fastest working baud rate up to max_baudrate.
+        """
+        for baudrate in BAUD_RATES:
+            if baudrate > max_baudrate or baudrate <= self.ser.baudrate:
+                continue
+            if self.set_baudrate(baudrate):
+                break
+        return self.ser.baudrate
+
+    def get_rx_credits(self) -> int:
+        """
+        Bytes the host may send to the firmware without waiting for an answer.
+        """
+        # FLOW,<credits>
+        return int(self._query("SYST:FLOW?\n", "FLOW").split(",")[1])
+
+    def get_statistics(self) -> FirmwareStatistics:
+        self._require(Capability.STATISTICS)
+        return FirmwareStatistics.from_reply(self._query("SYST:STAT?\n", "STAT"))
+
+    def reset_statistics(self):
+        self._require(Capability.STATISTICS)
+        self._query("SYST:STAT:RES\n", "STAT")
+
+    def set_spi_clock(self, clock_hz: int) -> int:
+        """
+        Returns the SPI clock in use, the fastest one not above clock_hz.
+        """
+        if clock_hz <= 0:
+            raise ValueError(f"Invalid SPI clock {clock_hz} Hz")
+        self._require(Capability.SPI_CLOCK)
+        # SPICLK,<hz>
+        return int(
+            self._query(f"SYST:SPI:CLOC {int(clock_hz)}\n", "SPICLK").split(",")[1]
+        )
+
+    def get_spi_clock(self) -> int:
+        self._require(Capability.SPI_CLOCK)
+        return int(self._query("SYST:SPI:CLOC?\n", "SPICLK").split(",")[1])
+
+    def save_config(self) -> int:
+        """
+        Store the register image of the firmware in its EEPROM (*SAV),
+        returns the checksum.
+        """
+        self._require(Capability.CONFIG)
+        # SAV,<checksum hex>
+        return int(self._query("*SAV\n", "SAV").split(",")[1], 16)
+
+    def recall_config(self) -> int:
+        """
+        Write the stored registers to the DACs (*RCL), returns their number.
+        """
+        self._require(Capability.CONFIG)
+        # RCL,<registers>
+        return int(self._query("*RCL\n", "RCL").split(",")[1])
+
+    def get_config(self) -> StoredConfig:
+        self._require(Capability.CONFIG)
+        return StoredConfig.from_reply(self._query("SYST:CONF?\n", "CONF,"))
+
+    def set_config_auto_restore(self, on: bool) -> StoredConfig:
+        self._require(Capability.CONFIG)
+        return StoredConfig.from_reply(
+            self._query(f"SYST:CONF:AUTO {int(on)}\n", "CONF,")
+        )
+
+    def get_config_image(self) -> bytes:
+        """
+        The stored register image, empty if there is none.
+        """
+        self._require(Capability.CONFIG)
+        # CONFDATA,<hex>
+        return bytes.fromhex(self._query("SYST:CONF:DATA?\n", "CONFDATA").split(",")[1])
+
+    def start_rate_stream(self, interval_ms: int) -> int:
+        """
+        Let the firmware send the counts of the rate inputs every interval_ms,
+        see ratemonitor.py. Returns the interval in use.
+        """
+        if not RATE_MIN_INTERVAL_MS <= interval_ms <= RATE_MAX_INTERVAL_MS:
+            raise ValueError(
+                f"Invalid rate interval {interval_ms} ms. "
+                f"Allowed: {RATE_MIN_INTERVAL_MS} ... {RATE_MAX_INTERVAL_MS} ms"
+            )
+        self._require(Capability.RATE)
+        # RATEMON,<interval_ms>
+        return int(
+            self._query(f"SYST:RATE {int(interval_ms)}\n", "RATEMON").split(",")[1]
+        )
+
+    def stop_rate_stream(self):
+        self._require(Capability.RATE)
+        self._query("SYST:RATE 0\n", "RATEMON")
 
     def check_version(version: str, minimum_version: str):
         v_nums = [int(x) for x in version.split(".")]
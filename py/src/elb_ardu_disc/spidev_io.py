@@ -0,0 +1,185 @@
+"""
+SpiIO directly on a Linux spidev device, without the Arduino.
+
+For installations where the SPI bus of the DACs is wired to an embedded Linux
+host (e.g. a Raspberry Pi). The chip selects are GPIO lines, one per DacCs,
+so several chips can be selected for a multicast like the firmware does:
+
+    spi = open_spidev(
+        bus=0,
+        device=0,
+        cs_lines={DacCs.LOGIC_TIMING_I: 5, DacCs.PULSE_I: 6, ...},  # all DacCs
+    )
+    ead = ELBArduDisc(spi=spi)
+
+A DAC write then takes some microseconds instead of a serial round trip.
+The testpulser and the counter are part of the firmware and not available.
+Needs the spidev and gpiod (libgpiod 2) packages.
+"""
+
+from typing import Dict, List, Mapping, Sequence, Union
+
+from .dacs import DacCs
+from .spi import LinkLock, SpiIO
+
+SPI_DEFAULT_CLOCK_HZ = 1000000
+
+# answer of a rejected multicast, like SYSTem:SPI:MULticast
+_REJECTED = [0, 0, 0]
+
+
+def _cs_index(cs: Union[DacCs, int]) -> int:
+    return cs.value if isinstance(cs, DacCs) else cs
+
+
+def check_cs_lines(cs_lines: Mapping[Union[DacCs, int], int]) -> Dict[int, int]:
+    """
+    cs_index -> GPIO line, every DacCs needs exactly one line.
+    """
+    lines = {_cs_index(cs): line for cs, line in cs_lines.items()}
+    missing = sorted(cs.name for cs in DacCs if cs.value not in lines)
+    if missing:
+        raise ValueError(f"No chip select line for {', '.join(missing)}")
+    unknown = sorted(set(lines) - {cs.value for cs in DacCs})
+    if unknown:
+        raise ValueError(f"Invalid chip select index {unknown}")
+    if len(set(lines.values())) != len(lines):
+        raise ValueError(f"Chip selects share GPIO lines: {cs_lines}")
+    return lines
+
+
+class ChipSelects:
+    """
+    Active low chip select lines, indexed by cs_index (see DacCs).
+    """
+
+    def select(self, cs_indices: Sequence[int]):
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GpiodChipSelects(ChipSelects):
+    """
+    Chip selects on the lines of a GPIO chip, with libgpiod 2.
+    """
+
+    def __init__(
+        self,
+        cs_lines: Mapping[Union[DacCs, int], int],
+        chip: str = "/dev/gpiochip0",
+        consumer: str = "elb_ardu_disc",
+    ):
+        try:
+            import gpiod
+            from gpiod.line import Direction, Value
+        except ImportError:
+            raise ImportError("GpiodChipSelects needs gpiod (libgpiod 2)") from None
+        self.lines = check_cs_lines(cs_lines)
+        self._active = Value.ACTIVE
+        self._inactive = Value.INACTIVE
+        settings = gpiod.LineSettings(
+            direction=Direction.OUTPUT, active_low=True, output_value=Value.INACTIVE
+        )
+        self._request = gpiod.request_lines(
+            chip, consumer=consumer, config={tuple(self.lines.values()): settings}
+        )
+
+    def select(self, cs_indices: Sequence[int]):
+        self._request.set_values(
+            {self.lines[cs_index]: self._active for cs_index in cs_indices}
+        )
+
+    def release(self):
+        self._request.set_values({line: self._inactive for line in self.lines.values()})
+
+    def close(self):
+        self._request.release()
+
+
+class SpiIoSpidev(SpiIO):
+    """
+    spi_device: spidev.SpiDev compatible object (xfer2), mode 0, no hardware
+    chip select
+    """
+
+    multicast = True
+
+    def __init__(self, spi_device, chip_selects: ChipSelects, lock: LinkLock = None):
+        self.spi_device = spi_device
+        self.chip_selects = chip_selects
+        # the verifier and other background tasks share the bus with the host
+        self.lock = lock if lock is not None else LinkLock()
+        self.transfers = 0
+
+    def _transfer(self, data_out: List[int], cs_indices: Sequence[int]) -> List[int]:
+        with self.lock:
+            self.chip_selects.select(cs_indices)
+            try:
+                answer = self.spi_device.xfer2(list(data_out))
+            finally:
+                self.chip_selects.release()
+            self.transfers += 1
+        return list(answer)
+
+    def do_io_8(self, data_out: int, cs_index: int) -> int:
+        return self._transfer([data_out], [cs_index])[0]
+
+    def do_io_24(self, data_out: List[int], cs_index: int) -> List[int]:
+        if len(data_out) != 3:
+            raise RuntimeError(
+                f"Invalid SPI Data. Expecting list of 3 ints. Provided {data_out}"
+            )
+        return self._transfer(data_out, [cs_index])
+
+    def do_io_24_multicast(
+        self, data_out: List[int], cs_indices: Sequence[int], trigger: bool = False
+    ) -> List[List[int]]:
+        if len(data_out) != 3:
+            raise RuntimeError(
+                f"Invalid SPI Data. Expecting list of 3 ints. Provided {data_out}"
+            )
+        if trigger:
+            self.pulse_trigger()
+        # bits 2:1 of the command are the operation, only writes (00) answer
+        # identically on the shared SDO line
+        if data_out[0] & 0x06:
+            return [_REJECTED] * len(cs_indices)
+        return [self._transfer(data_out, cs_indices)] * len(cs_indices)
+
+    def close(self):
+        self.chip_selects.close()
+        self.spi_device.close()
+
+
+def open_spidev(
+    bus: int,
+    device: int,
+    cs_lines: Mapping[Union[DacCs, int], int],
+    gpio_chip: str = "/dev/gpiochip0",
+    max_speed_hz: int = SPI_DEFAULT_CLOCK_HZ,
+) -> SpiIoSpidev:
+    """
+    SpiIoSpidev on /dev/spidev<bus>.<device> with the chip selects on the
+    lines cs_lines of gpio_chip.
+    """
+    try:
+        import spidev
+    except ImportError:
+        raise ImportError("open_spidev needs spidev") from None
+    chip_selects = GpiodChipSelects(cs_lines, gpio_chip)
+    spi_device = spidev.SpiDev()
+    try:
+        spi_device.open(bus, device)
+        spi_device.mode = 0
+        spi_device.bits_per_word = 8
+        spi_device.max_speed_hz = max_speed_hz
+        spi_device.no_cs = True
+    except Exception:
+        chip_selects.close()
+        raise
+    return SpiIoSpidev(spi_device, chip_selects)
@@ -0,0 +1,419 @@
+"""
+Multi-dimensional sweep plans with checkpoint/resume.
+
+A plan is a lazily evaluated sequence of points. Each point maps axis labels
+to values, e.g. {"delay_th": 350, "pulse_th": 350}. Points are computed from
+their index, nothing is materialized:
+
+    plan = Product(
+        LinearAxis("delay_th", 350, 900),
+        Zip(ListAxis("pulse_th", [100, 200]), ListAxis("hys", [500, 600])),
+    )
+    for index, point in SweepRunner(ead.registers, plan, "sweep.json"):
+        measure()
+
+Axis names are register view names (see registers.REGISTER_LAYOUT) or keys of
+the setters given to SweepRunner. By default Product reorders its factors so
+that the registers change as rarely as possible. The runner only sends the
+registers that change from one point to the next, saves the index of the last
+completed point and continues there when it is started again.
+"""
+
+import json
+import math
+import operator
+import os
+import time
+from functools import reduce
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from .registers import REGISTER_LAYOUT, RegisterMap
+
+Channels = Union[None, int, Sequence[int]]
+
+
+class Plan:
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def point(self, index: int) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def axes(self) -> List["Axis"]:
+        raise NotImplementedError
+
+    def describe(self):
+        """
+        JSON serializable description, identifies the plan in checkpoints.
+        """
+        raise NotImplementedError
+
+    @property
+    def weight(self) -> int:
+        """
+        Register writes when the point of this plan changes.
+        """
+        return sum(axis.weight for axis in self.axes())
+
+    def __getitem__(self, index: int) -> Dict[str, int]:
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(f"Sweep point {index} out of range")
+        return self.point(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.point(index)
+
+    def write_count(self) -> int:
+        """
+        Register writes of the whole sweep, including the first point.
+        """
+        writes = 0
+        previous = {}
+        for point in self:
+            for axis in self.axes():
+                if previous.get(axis.label) != point[axis.label]:
+                    writes += axis.weight
+            previous = point
+        return writes
+
+
+class Axis(Plan):
+    """
+    One setting and its values.
+    channels: channels of the register view, None for all of them
+    """
+
+    def __init__(self, name: str, values: Sequence[int], channels: Channels = None):
+        if len(values) == 0:
+            raise ValueError(f"Axis {name} has no values")
+        self.name = name
+        self.values = values
+        self.channels = channels
+        if channels is None:
+            self.label = name
+        elif isinstance(channels, int):
+            self.label = f"{name}[{channels}]"
+        else:
+            self.channels = list(channels)
+            self.label = f"{name}{self.channels}"
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def point(self, index: int) -> Dict[str, int]:
+        return {self.label: self.values[index]}
+
+    def axes(self) -> List["Axis"]:
+        return [self]
+
+    @property
+    def weight(self) -> int:
+        if self.channels is None:
+            if self.name in REGISTER_LAYOUT:
+                return len(REGISTER_LAYOUT[self.name][1])
+            return 1
+        if isinstance(self.channels, int):
+            return 1
+        return len(self.channels)
+
+    def describe(self):
+        return {"axis": self.label, "values": list(self.values)}
+
+
+class LinearAxis(Axis):
+    """
+    start ... stop (inclusive) in steps of step.
+    """
+
+    def __init__(
+        self, name: str, start: int, stop: int, step: int = 1, channels: Channels = None
+    ):
+        if step == 0:
+            raise ValueError("Step must not be 0")
+        step = abs(step) if stop >= start else -abs(step)
+        values = range(start, stop + (1 if step > 0 else -1), step)
+        super().__init__(name, values, channels)
+
+
+class LogAxis(Axis):
+    """
+    num logarithmically spaced codes from start to stop (inclusive).
+    """
+
+    def __init__(
+        self, name: str, start: int, stop: int, num: int, channels: Channels = None
+    ):
+        if start <= 0 or stop <= 0:
+            raise ValueError(f"Invalid log axis range {start} ... {stop}")
+        if num < 1:
+            raise ValueError(f"Invalid number of points {num}")
+        self.start = start
+        self.stop = stop
+        self.num = num
+        super().__init__(name, _LogValues(start, stop, num), channels)
+
+
+class _LogValues:
+    def __init__(self, start: int, stop: int, num: int):
+        self.start = start
+        self.num = num
+        self.ratio = math.log(stop / start) / max(num - 1, 1)
+
+    def __len__(self) -> int:
+        return self.num
+
+    def __getitem__(self, index: int) -> int:
+        if index < 0 or index >= self.num:
+            raise IndexError(index)
+        return round(self.start * math.exp(self.ratio * index))
+
+    def __iter__(self):
+        return (self[index] for index in range(self.num))
+
+
+class ListAxis(Axis):
+    def __init__(self, name: str, values: Sequence[int], channels: Channels = None):
+        super().__init__(name, list(values), channels)
+
+
+def _written(axis: Axis) -> Set[Tuple]:
+    """
+    (cs_index, dac_channel) of the registers an axis writes, (setter name,
+    channel) for a setter, channel None for all channels of a setter.
+    """
+    if axis.channels is None:
+        channels = None
+    elif isinstance(axis.channels, int):
+        channels = [axis.channels]
+    else:
+        channels = axis.channels
+    if axis.name in REGISTER_LAYOUT:
+        cs, dac_channels = REGISTER_LAYOUT[axis.name]
+        if channels is None:
+            channels = range(len(dac_channels))
+        return {
+            (cs.value, dac_channels[channel])
+            for channel in channels
+            if 0 <= channel < len(dac_channels)
+        }
+    if channels is None:
+        return {(axis.name, None)}
+    return {(axis.name, channel) for channel in channels}
+
+
+def _overlap(first: Set[Tuple], second: Set[Tuple]) -> bool:
+    if first & second:
+        return True
+    all_first = {name for name, channel in first if channel is None}
+    all_second = {name for name, channel in second if channel is None}
+    return any(name in all_first for name, _ in second) or any(
+        name in all_second for name, _ in first
+    )
+
+
+def _check_labels(plans: Sequence[Plan]):
+    """
+    Every register may only be set by one axis, e.g. not by thr and thr[0],
+    else the later axis silently overwrites the earlier one.
+    """
+    axes = [axis for plan in plans for axis in plan.axes()]
+    written = [_written(axis) for axis in axes]
+    for index, axis in enumerate(axes):
+        for other in range(index + 1, len(axes)):
+            if _overlap(written[index], written[other]):
+                raise ValueError(
+                    f"Axes {axis.label} and {axes[other].label} set the same registers"
+                )
+
+
+class Zip(Plan):
+    """
+    The plans step together, all must have the same length.
+    """
+
+    def __init__(self, *plans: Plan):
+        if not plans:
+            raise ValueError("Zip needs at least one plan")
+        lengths = {len(plan) for plan in plans}
+        if len(lengths) != 1:
+            raise ValueError(f"Zip of plans with different lengths {sorted(lengths)}")
+        _check_labels(plans)
+        self.plans = list(plans)
+
+    def __len__(self) -> int:
+        return len(self.plans[0])
+
+    def point(self, index: int) -> Dict[str, int]:
+        point = {}
+        for plan in self.plans:
+            point.update(plan.point(index))
+        return point
+
+    def axes(self) -> List[Axis]:
+        return [axis for plan in self.plans for axis in plan.axes()]
+
+    def describe(self):
+        return {"zip": [plan.describe() for plan in self.plans]}
+
+
+def _change_cost(plan: Plan) -> float:
+    """
+    Sort key of a factor, see Product.
+    """
+    n = len(plan)
+    if n == 1:
+        return math.inf
+    return plan.weight * n / (n - 1)
+
+
+class Product(Plan):
+    """
+    All combinations of the plans, the first one is the outermost loop.
+
+    optimize: reorder the plans to minimize the register writes. A factor
+    with n points and w register writes per change changes about w * n
+    times per point of the outer factors. Exchanging two neighbours shows
+    that sorting by w * n / (n - 1), largest outermost, is optimal.
+    Nested products are flattened for this.
+    """
+
+    def __init__(self, *plans: Plan, optimize: bool = True):
+        if not plans:
+            raise ValueError("Product needs at least one plan")
+        _check_labels(plans)
+        if optimize:
+            flat = []
+            for plan in plans:
+                if isinstance(plan, Product):
+                    flat.extend(plan.plans)
+                else:
+                    flat.append(plan)
+            # stable sort: the given order decides between equal costs
+            plans = sorted(flat, key=_change_cost, reverse=True)
+        self.plans = list(plans)
+        self._length = reduce(operator.mul, (len(plan) for plan in self.plans), 1)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def point(self, index: int) -> Dict[str, int]:
+        point = {}
+        for plan in reversed(self.plans):
+            index, plan_index = divmod(index, len(plan))
+            point.update(plan.point(plan_index))
+        return point
+
+    def axes(self) -> List[Axis]:
+        return [axis for plan in self.plans for axis in plan.axes()]
+
+    def describe(self):
+        return {"product": [plan.describe() for plan in self.plans]}
+
+
+class SweepRunner:
+    """
+    Applies the points of a plan, yields (index, point) after each one is set.
+
+    A point counts as completed when the next one is requested. With
+    checkpoint_path the index of the last completed point is saved at most
+    every checkpoint_interval_s and when the loop ends for any reason.
+    A new runner with the same plan and path continues after that point and
+    writes all registers of the first point, since the board may have been
+    reset in between.
+
+    setters: functions for axes that are not registers, e.g.
+    {"pulser_period_us": ead.testpulser_control.set_period_us}
+    trigger: pulse the trigger output of the board when a point is set,
+    instruments triggered by it need no dwell time
+    elapsed_s: wall time of the last loop, e.g. for planner.compare
+    """
+
+    def __init__(
+        self,
+        registers: RegisterMap,
+        plan: Plan,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval_s: float = 1.0,
+        setters: Optional[Dict[str, Callable[[int], object]]] = None,
+        trigger: bool = False,
+    ):
+        self.registers = registers
+        self.plan = plan
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.setters = setters or {}
+        self.trigger = trigger
+        self.completed = -1
+        self.elapsed_s = 0.0
+        self._setter_values = {}
+
+        for axis in plan.axes():
+            if axis.name not in self.setters and axis.name not in registers.views:
+                raise ValueError(f"Unknown sweep setting {axis.name}")
+
+    def load_checkpoint(self) -> int:
+        """
+        Index of the last completed point, -1 if there is none.
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return -1
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("plan") != self.plan.describe():
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} belongs to a different sweep plan"
+            )
+        return checkpoint["completed"]
+
+    def save_checkpoint(self):
+        if self.checkpoint_path is None:
+            return
+        checkpoint = {
+            "plan": self.plan.describe(),
+            "points": len(self.plan),
+            "completed": self.completed,
+        }
+        # atomic replace, a crash while writing keeps the previous checkpoint
+        temporary_path = self.checkpoint_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def apply(self, point: Dict[str, int], force: bool = False):
+        writes = []
+        for axis in self.plan.axes():
+            value = point[axis.label]
+            if axis.name in self.setters:
+                if force or self._setter_values.get(axis.label) != value:
+                    self.setters[axis.name](value)
+                    self._setter_values[axis.label] = value
+                continue
+            view = self.registers[axis.name]
+            key = slice(None) if axis.channels is None else axis.channels
+            if isinstance(key, list):
+                for channel in key:
+                    writes.extend(view._writes(channel, value))
+            else:
+                writes.extend(view._writes(key, value))
+        self.registers.write(writes, force=force, trigger=self.trigger)
+
+    def __iter__(self):
+        self.completed = self.load_checkpoint()
+        force = self.completed >= 0
+        last_saved = start = time.monotonic()
+        try:
+            for index in range(self.completed + 1, len(self.plan)):
+                point = self.plan.point(index)
+                self.apply(point, force=force)
+                force = False
+                yield index, point
+                self.completed = index
+                if time.monotonic() - last_saved >= self.checkpoint_interval_s:
+                    self.save_checkpoint()
+                    last_saved = time.monotonic()
+        finally:
+            self.elapsed_s = time.monotonic() - start
+            self.save_checkpoint()
@@ -0,0 +1,147 @@
+"""
+Background integrity verifier for the DAC state.
+
+A USB glitch or a brown-out can reset the DACs without the host noticing.
+The verifier reads back one register at a time, round robin, and compares it
+with the register map. It only uses the link when it was idle for idle_s and
+nobody waits for it, and never more often than max_reads_per_s. A foreground
+command has to wait for at most one register read.
+"""
+
+import logging
+import threading
+from typing import Callable, List, NamedTuple, Optional
+
+from .dacs import DacVrefOptions
+from .registers import CHANNELS_PER_CHIP, UNKNOWN, RegisterMap, register_index
+from .spi import LinkLock
+
+logger = logging.getLogger(__name__)
+
+# dac channel used for the reference register in the round robin
+REFS = -1
+
+
+class Mismatch(NamedTuple):
+    cs_index: int
+    dac_channel: int  # REFS for the reference setting
+    expected: int
+    actual: int
+    repaired: bool
+
+
+class IntegrityVerifier:
+    def __init__(
+        self,
+        register_map: RegisterMap,
+        lock: LinkLock,
+        max_reads_per_s: float = 5.0,
+        idle_s: float = 0.2,
+        repair: bool = True,
+        on_mismatch: Optional[Callable[[Mismatch], None]] = None,
+    ):
+        if max_reads_per_s <= 0:
+            raise ValueError(f"Invalid read budget {max_reads_per_s} reads/s")
+        self.register_map = register_map
+        self.lock = lock
+        self.max_reads_per_s = max_reads_per_s
+        self.idle_s = idle_s
+        self.repair = repair
+        self.on_mismatch = on_mismatch
+
+        self.checked = 0
+        self.mismatches: List[Mismatch] = []
+        self._position = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _registers(self):
+        """
+        All registers with a known expected value.
+        """
+        registers = []
+        for cs_index in sorted(self.register_map.dacs):
+            if self.register_map.refs[cs_index] != UNKNOWN:
+                registers.append((cs_index, REFS))
+            for dac_channel in range(CHANNELS_PER_CHIP):
+                index = register_index(cs_index, dac_channel)
+                if self.register_map.codes[index] != UNKNOWN:
+                    registers.append((cs_index, dac_channel))
+        return registers
+
+    def _expected(self, cs_index: int, dac_channel: int) -> int:
+        if dac_channel == REFS:
+            return self.register_map.refs[cs_index]
+        return self.register_map.codes[register_index(cs_index, dac_channel)]
+
+    def _check(self, cs_index: int, dac_channel: int):
+        dac = self.register_map.dacs[cs_index]
+        expected = self._expected(cs_index, dac_channel)
+        if dac_channel == REFS:
+            refs = dac.get_refs()
+            actual = sum(ref.value << (i * 2) for i, ref in enumerate(refs))
+        else:
+            actual = dac.get_channel(dac_channel)
+        self.checked += 1
+        if actual == expected:
+            return
+
+        repaired = False
+        if self.repair:
+            if dac_channel == REFS:
+                dac.set_refs(
+                    [
+                        DacVrefOptions((expected >> (i * 2)) & 0b11)
+                        for i in range(dac.channels)
+                    ]
+                )
+            else:
+                dac.set_channel(dac_channel, expected)
+            repaired = True
+
+        mismatch = Mismatch(cs_index, dac_channel, expected, actual, repaired)
+        self.mismatches.append(mismatch)
+        logger.warning(f"DAC register mismatch: {mismatch}")
+        if self.on_mismatch is not None:
+            self.on_mismatch(mismatch)
+
+    def verify_next(self) -> bool:
+        """
+        Check the next register if the link is idle. Returns True if one was checked.
+        """
+        registers = self._registers()
+        if not registers:
+            return False
+        if not self.lock.acquire_if_idle(self.idle_s):
+            return False
+        try:
+            self._position %= len(registers)
+            cs_index, dac_channel = registers[self._position]
+            self._position += 1
+            self._check(cs_index, dac_channel)
+        except Exception as e:
+            logger.warning(f"Integrity check failed: {e}")
+        finally:
+            self.lock.release_background()
+        return True
+
+    def _run(self):
+        interval = 1 / self.max_reads_per_s
+        while not self._stop.wait(interval):
+            self.verify_next()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="ELBArduDiscVerifier", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import unittest
+
+from elb_ardu_disc.calibration import (
+    DELAY,
+    LOGIC_PULSE_WIDTH,
+    THRESHOLD,
+    Calibration,
+    MeasurementTable,
+    fit_measurements,
+    read_measurements,
+)
+from elb_ardu_disc.loopback import open_loopback
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ns = a + b * th / i + c / i + d * th
+DELAY_MODEL = [(5.0, 40.0, 300.0, 0.002), (6.0, 42.0, 250.0, 0.001)]
+
+
+def delay_table(channels=DELAY_MODEL, noise=0.0):
+    rng = numpy.random.default_rng(1)
+    current, code = numpy.meshgrid(
+        numpy.arange(100, 1001, 100), numpy.arange(0, 1024, 32)
+    )
+    current, code = current.ravel(), code.ravel()
+    columns = [[], [], [], []]
+    for channel, (a, b, c, d) in enumerate(channels):
+        ns = a + b * code / current + c / current + d * code
+        ns = ns + rng.normal(0, noise, ns.shape) if noise else ns
+        for column, values in zip(
+            columns, (numpy.full_like(code, channel), current, code, ns)
+        ):
+            column.append(values)
+    return MeasurementTable(*(numpy.concatenate(column) for column in columns))
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestFit(unittest.TestCase):
+
+    def test_all_channels_at_once(self):
+        calibration = fit_measurements({DELAY: delay_table(noise=0.05)})
+        curves = calibration[DELAY]
+        self.assertEqual(curves.points.tolist(), [320, 320, 0, 0])
+        for channel, model in enumerate(DELAY_MODEL):
+            self.assertAlmostEqual(curves.rms[channel], 0.05, delta=0.01)
+            self.assertAlmostEqual(
+                curves.value(channel, 500, 250),
+                numpy.dot(model, [1, 2, 1 / 250, 500]),
+                delta=0.05,
+            )
+        self.assertFalse(calibration.calibrated(DELAY, 2))
+        self.assertFalse(calibration.calibrated(THRESHOLD, 0))
+
+    def test_processes_give_the_same_curves(self):
+        tables = {DELAY: delay_table()}
+        inline = fit_measurements(tables, processes=1)[DELAY]
+        parallel = fit_measurements(tables, processes=2)[DELAY]
+        numpy.testing.assert_allclose(
+            parallel.coefficients, inline.coefficients, rtol=1e-9
+        )
+        self.assertEqual(parallel.points.tolist(), inline.points.tolist())
+
+    def test_inverse_and_range(self):
+        curves = fit_measurements({DELAY: delay_table()})[DELAY]
+        ns = curves.value(1, 700, 400)
+        self.assertEqual(curves.code(1, ns, 400), 700)
+        with self.assertRaises(ValueError):
+            curves.code(1, 1e6, 400)
+        with self.assertRaises(ValueError):
+            curves.code(1, ns, 0)
+
+    def test_too_few_points(self):
+        table = MeasurementTable(
+            numpy.zeros(3, dtype=int),
+            numpy.full(3, 100.0),
+            numpy.arange(3),
+            numpy.arange(3.0),
+        )
+        with self.assertRaises(ValueError):
+            fit_measurements({DELAY: table})
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_read_fit_save_load(self):
+        with open(self.path("scope.csv"), "w") as f:
+            f.write("quantity,channel,current,code,value\n")
+            for code in range(0, 4096, 512):
+                f.write(f"threshold,3,,{code},{-3.0 + code * 0.0015}\n")
+            for current in (200, 400):
+                for code in (100, 500, 900):
+                    f.write(
+                        f"logic_pulse_width,1,{current},{code},{10 + 30 * code / current}\n"
+                    )
+        tables = read_measurements(self.path("scope.csv"))
+        self.assertEqual(sorted(tables), [LOGIC_PULSE_WIDTH, THRESHOLD])
+
+        fit_measurements(tables).save(self.path("board.npz"))
+        calibration = Calibration.load(self.path("board.npz"))
+        self.assertAlmostEqual(calibration[THRESHOLD].value(3, 2000), 0.0, places=9)
+        self.assertEqual(calibration[LOGIC_PULSE_WIDTH].code(1, 40.0, 300), 300)
+        self.assertEqual(len(list(calibration.summary())), 2)
+
+    def test_invalid_row(self):
+        with open(self.path("scope.csv"), "w") as f:
+            f.write("quantity,channel,current,code,value\nrise_time,0,,1,2\n")
+        with self.assertRaises(ValueError):
+            read_measurements(self.path("scope.csv"))
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestCalibratedSetters(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+        threshold = MeasurementTable(
+            numpy.zeros(2, dtype=int),
+            numpy.full(2, numpy.nan),
+            numpy.array([0, 4000]),
+            numpy.array([-3.0, 3.0]),
+        )
+        self.ead.calibration = fit_measurements(
+            {THRESHOLD: threshold, DELAY: delay_table()}
+        )
+
+    def test_threshold_v(self):
+        self.ead.channel_control.set_threshold_v(0, 0.0)
+        self.assertEqual(self.ead.registers.thr[0], 2000)
+        # nominal values without curves for the channel
+        self.ead.channel_control.set_threshold_v(1, 0.0)
+        self.assertEqual(self.ead.registers.thr[1], 2047)
+
+    def test_delay_ns(self):
+        timing = self.ead.timing_control
+        with self.assertRaises(RuntimeError):
+            timing.set_channel_delay_ns(0, 50.0)
+        timing.set_channel_delay_ns(0, 50.0, current=500)
+        self.assertEqual(self.ead.registers.delay_i[0], 500)
+        code = self.ead.registers.delay_th[0]
+        self.assertAlmostEqual(
+            self.ead.calibration[DELAY].value(0, code, 500), 50.0, delta=0.1
+        )
+        timing.set_channel_delay_ns(0, 60.0)
+        self.assertGreater(self.ead.registers.delay_th[0], code)
+        with self.assertRaises(RuntimeError):
+            timing.set_channel_pulse_width_ns(0, 20.0, current=500)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
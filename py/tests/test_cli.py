@@ -0,0 +1,148 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+from elb_ardu_disc.cli import apply_configuration, benchmark, build_parser, main
+from elb_ardu_disc.loopback import open_loopback, open_spidev_loopback
+
+
+class RecordingControl:
+    def __init__(self, calls: list):
+        self.calls = calls
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+class FakeArduDisc:
+    def __init__(self):
+        self.calls = []
+        self.channel_control = RecordingControl(self.calls)
+        self.timing_control = RecordingControl(self.calls)
+        self.testpulser_control = RecordingControl(self.calls)
+
+
+class TestCli(unittest.TestCase):
+
+    def test_apply_configuration(self):
+        ead = FakeArduDisc()
+        config = {
+            "channels": [{"threshold_v": 0.05}, None, {"hysteresis": 500}],
+            "logic": [{}, {"pulse_width_threshold": 512}],
+            "pulser": {"enabled": True, "period_us": 100},
+        }
+        apply_configuration(ead, config)
+
+        self.assertEqual(
+            ead.calls,
+            [
+                ("set_threshold_v", (0, 0.05), {}),
+                ("set_hysteresis", (2, 500), {}),
+                ("set_logic_pulse_width_threshold", (1, 512), {}),
+                ("set_period_us", (100,), {}),
+                ("set_pulser", (), {"on": True}),
+            ],
+        )
+
+    def test_unknown_setting(self):
+        with self.assertRaises(ValueError):
+            apply_configuration(FakeArduDisc(), {"channels": [{"treshold": 1}]})
+
+    def test_sweep_arguments(self):
+        args = build_parser().parse_args(
+            ["--port", "COM4", "sweep", "channel_delay_threshold", "350", "900"]
+        )
+        self.assertEqual((args.start, args.stop, args.channels), (350, 900, [0]))
+        self.assertIsNone(args.max_baudrate)
+        for step in ("0", "-5"):
+            with self.assertRaises(SystemExit), redirect_stderr(io.StringIO()):
+                build_parser().parse_args(
+                    ["sweep", "channel_delay_threshold", "0", "9", "--step", step]
+                )
+
+    def test_max_baudrate_is_opt_in(self):
+        args = build_parser().parse_args(["--max-baudrate", "1000000", "read"])
+        self.assertEqual(args.max_baudrate, 1000000)
+
+    def apply(self, ead, config: str):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "config.json")
+            with open(path, "w") as f:
+                f.write(config)
+            with patch("elb_ardu_disc.cli._connect", return_value=ead), patch.object(
+                ead, "close", wraps=ead.close
+            ) as close:
+                try:
+                    main(["--port", "COM4", "apply", path])
+                finally:
+                    close.assert_called_once_with()
+
+    def test_apply_command(self):
+        ead = open_loopback()
+        self.apply(ead, '{"channels": [{"threshold": 100}, {"threshold": 200}]}')
+        self.assertEqual(ead.registers.thr[0:2], [100, 200])
+
+    def test_apply_command_sends_nothing_for_a_bad_configuration(self):
+        ead = open_loopback()
+        commands = ead.loopback.commands_processed
+        with self.assertRaises(ValueError):
+            self.apply(ead, '{"channels": [{"threshold": 100}, {"treshold": 200}]}')
+        self.assertEqual(ead.loopback.commands_processed, commands)
+
+    def test_commands_close_the_connection_on_errors(self):
+        ead = open_loopback()
+        with patch("elb_ardu_disc.cli._connect", return_value=ead), patch.object(
+            ead, "close", wraps=ead.close
+        ) as close, patch(
+            "elb_ardu_disc.cli.read_state", side_effect=RuntimeError
+        ), redirect_stdout(
+            io.StringIO()
+        ):
+            with self.assertRaises(RuntimeError):
+                main(["--port", "COM4", "read"])
+        close.assert_called_once_with()
+
+    def test_module_imports_only_what_connecting_needs(self):
+        # keeps the simple commands fast
+        script = (
+            "import sys\n"
+            "import elb_ardu_disc.module\n"
+            "slow = ['elb_ardu_disc.calibration', 'elb_ardu_disc.planner',\n"
+            "        'elb_ardu_disc.verifier', 'concurrent.futures.process']\n"
+            "print([name for name in slow if name in sys.modules])\n"
+        )
+        environment = dict(os.environ)
+        source = os.path.join(os.path.dirname(__file__), "..", "src")
+        environment["PYTHONPATH"] = os.pathsep.join(
+            [source, environment.get("PYTHONPATH", "")]
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            env=environment,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_benchmark_needs_the_firmware_for_the_spi_clock(self):
+        ead = open_spidev_loopback()
+        with self.assertRaises(ValueError):
+            benchmark(ead, iterations=1, spi_clock_hz=5000000)
+
+    def test_benchmark_reports_firmware_time(self):
+        ead = open_loopback()
+        result = benchmark(ead, iterations=10, spi_clock_hz=5000000)
+        self.assertEqual(result["spi_clock_hz"], 4000000)
+        # 24 bits at 4 MHz per read in the model
+        self.assertEqual(result["per_read"]["spi_ms"], 0.006)
+        self.assertEqual(result["rx_overflows"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
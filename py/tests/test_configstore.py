@@ -0,0 +1,92 @@
+import unittest
+
+from elb_ardu_disc import DacCs
+from elb_ardu_disc.configstore import IMAGE, crc_ccitt, decode_image, encode_image
+from elb_ardu_disc.loopback import FirmwareModel, LoopbackSerial, open_loopback
+from elb_ardu_disc.module import ELBArduDisc
+from elb_ardu_disc.spi import ELBArduDiscSCPI
+
+THR = DacCs.CHANNEL_THR.value
+
+
+class TestImage(unittest.TestCase):
+
+    def test_checksum_of_the_firmware(self):
+        # CRC-16/MCRF4XX, i.e. _crc_ccitt_update starting at 0xFFFF
+        self.assertEqual(crc_ccitt(b"123456789"), 0x6F91)
+
+    def test_host_and_firmware_image_agree(self):
+        ead = open_loopback()
+        ead.channel_control.set_threshold(1, 1234)
+        ead.registers.delay_th[:] = 600
+        image = encode_image(ead.registers)
+        self.assertEqual(len(image), IMAGE.size)
+        self.assertEqual(image, ead.loopback.image())
+
+        channel_writes, refs_writes = decode_image(image)
+        self.assertIn((THR, 1, 1234), channel_writes)
+        self.assertEqual(len(channel_writes), 5)
+        self.assertEqual(len(refs_writes), len(DacCs))
+
+
+class TestStoredConfiguration(unittest.TestCase):
+
+    def test_power_cycle_restores_the_saved_setup(self):
+        ead = open_loopback()
+        firmware = ead.loopback
+        ead.channel_control.set_threshold(2, 3000)
+        self.assertFalse(ead.configuration_matches())
+        checksum = ead.save_configuration(auto_restore=True)
+        self.assertEqual(checksum, ead.configuration_checksum())
+        self.assertTrue(ead.configuration_matches())
+
+        ead.channel_control.set_threshold(2, 100)
+        self.assertFalse(ead.configuration_matches())
+
+        firmware.power_cycle()
+        self.assertEqual(firmware.dacs[THR].registers[2], 3000)
+
+        # connecting takes over the restored registers
+        ead = open_loopback(firmware)
+        self.assertEqual(ead.registers.thr[2], 3000)
+        self.assertTrue(ead.configuration_matches())
+
+        self.assertEqual(ead.recall_configuration(), len(DacCs) + 1)
+        self.assertEqual(ead.registers.thr[2], 3000)
+
+    def test_board_without_reset_is_not_taken_over(self):
+        ead = open_loopback()
+        ead.channel_control.set_threshold(2, 3000)
+        ead.save_configuration(auto_restore=True)
+        ead.channel_control.set_threshold(2, 100)
+        # the board keeps running, the stored image is not what it outputs
+        serial_connection = LoopbackSerial(ead.loopback)
+        serial_connection.read_until(b"\n")
+        scpi = ELBArduDiscSCPI(port=None, serial_connection=serial_connection)
+        self.assertIsNone(ELBArduDisc(scpi=scpi).registers.thr[2])
+
+    def test_without_auto_restore(self):
+        ead = open_loopback()
+        ead.channel_control.set_threshold(0, 500)
+        ead.save_configuration()
+        ead.loopback.power_cycle()
+        self.assertEqual(ead.loopback.dacs[THR].registers[0], 0)
+        self.assertFalse(ead._scpi.get_config().auto_restore)
+        self.assertIsNone(open_loopback(ead.loopback).registers.thr[0])
+
+    def test_nothing_stored(self):
+        ead = open_loopback()
+        self.assertEqual(ead.recall_configuration(), 0)
+        self.assertFalse(ead._scpi.set_config_auto_restore(True).valid)
+
+    def test_older_firmware(self):
+        ead = open_loopback(FirmwareModel(version="0.1.2"))
+        with self.assertRaises(RuntimeError):
+            ead.save_configuration()
+        with self.assertRaises(RuntimeError):
+            with ead.transaction():
+                ead.recall_configuration()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
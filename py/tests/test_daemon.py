@@ -0,0 +1,158 @@
+import os
+import socket
+import tempfile
+import unittest
+
+from elb_ardu_disc import ELBArduDiscServer, ELBArduDiscClient
+from elb_ardu_disc.daemon import _PendingRequest
+from elb_ardu_disc.loopback import open_loopback
+
+
+class FakeControl:
+    def __init__(self):
+        self.calls = []
+
+    def set_threshold(self, channel: int, value: int):
+        if value < 0:
+            raise ValueError(f"Invalid dac value {value}")
+        self.calls.append((channel, value))
+
+    def get_threshold(self, channel: int) -> int:
+        values = [value for number, value in self.calls if number == channel]
+        return values[-1] if values else None
+
+    def set_period_us(self, period_us: int) -> float:
+        self.calls.append(("period", period_us))
+        return period_us + 0.5
+
+    def get_state(self):
+        return self
+
+
+class FakeArduDisc:
+    def __init__(self):
+        self.channel_control = FakeControl()
+        self.timing_control = FakeControl()
+        self.testpulser_control = FakeControl()
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = FakeArduDisc()
+        self.server = ELBArduDiscServer(self.ead, "127.0.0.1:0")
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_client_mirrors_controls(self):
+        self.server.start()
+        host, port = self.server.server_address
+        client = ELBArduDiscClient(f"{host}:{port}")
+        client.channel_control.set_threshold(1, 100)
+        with self.assertRaises(ValueError):
+            client.timing_control.set_threshold(0, -1)
+        with self.assertRaises(AttributeError):
+            client.channel_control.not_a_method()
+        with self.assertRaises(TypeError):
+            client.channel_control.get_state()
+        self.assertEqual(client.channel_control.get_threshold(1), 100)
+        client.close()
+
+        self.assertEqual(self.ead.channel_control.calls, [(1, 100)])
+
+    def run_batch(self, calls, target="channel_control"):
+        replies = []
+        for request_id, (method, args) in enumerate(calls):
+            request = {"id": request_id, "target": target}
+            request.update({"method": method, "args": args})
+            self.server.enqueue(_PendingRequest(request, replies.append))
+        self.server.start()
+        self.server.shutdown()
+        self.server._dispatcher.join(timeout=1)
+        return sorted(replies, key=lambda reply: reply["id"])
+
+    def test_superseded_writes_are_collapsed(self):
+        replies = self.run_batch(
+            [("set_threshold", [0, 1]), ("set_threshold", [1, 2])]
+            + [("set_threshold", [0, 3])]
+        )
+        self.assertEqual(self.ead.channel_control.calls, [(1, 2), (0, 3)])
+        self.assertEqual([reply["id"] for reply in replies], [0, 1, 2])
+
+    def test_reads_separate_the_writes(self):
+        replies = self.run_batch(
+            [("set_threshold", [0, 1]), ("get_threshold", [0])]
+            + [("set_threshold", [0, 2]), ("set_threshold", [0, -1])]
+        )
+        self.assertEqual(self.ead.channel_control.calls, [(0, 1), (0, 2)])
+        self.assertEqual(replies[1]["result"], 1)
+        # the failed last write leaves the one before it
+        self.assertEqual(replies[2]["result"], None)
+        self.assertEqual(replies[3]["error"], "ValueError")
+
+    def test_pulser_setters_are_not_merged(self):
+        replies = self.run_batch(
+            [("set_period_us", [100]), ("set_period_us", [200])],
+            target="testpulser_control",
+        )
+        self.assertEqual([reply["result"] for reply in replies], [100.5, 200.5])
+
+
+class TestDaemonOnLoopback(unittest.TestCase):
+
+    def test_writes_are_sent_in_one_transaction(self):
+        ead = open_loopback()
+        server = ELBArduDiscServer(ead, "127.0.0.1:0")
+        replies = []
+        calls = [("set_channel_delay_current", channel) for channel in range(4)]
+        calls += [("set_channel_pulse_width_current", channel) for channel in range(4)]
+        for request_id, (method, channel) in enumerate(calls):
+            request = {"id": request_id, "target": "timing_control"}
+            request.update({"method": method, "args": [channel, 512]})
+            server.enqueue(_PendingRequest(request, replies.append))
+        commands = ead.loopback.commands_processed
+        server.start()
+        server.shutdown()
+        server._dispatcher.join(timeout=1)
+
+        self.assertEqual(len(replies), 8)
+        self.assertEqual(ead.registers.pulse_i[:], [512] * 4)
+        # the same code for the same channel of both chips is one multicast
+        self.assertEqual(ead.loopback.commands_processed - commands, 4)
+
+    def test_scheduled_ead(self):
+        ead = open_loopback(scheduled=True)
+        server = ELBArduDiscServer(ead, "127.0.0.1:0")
+        server.start()
+        host, port = server.server_address
+        client = ELBArduDiscClient(f"{host}:{port}", timeout=5)
+        try:
+            client.channel_control.set_threshold(0, 100)
+            client.timing_control.set_channel_delay_current(1, 512)
+            period_us = client.testpulser_control.set_period_us(200)
+            self.assertAlmostEqual(
+                period_us, ead.testpulser_control.get_period_us().result()
+            )
+            with self.assertRaises(ValueError):
+                client.channel_control.set_threshold(0, 1 << 12)
+            self.assertEqual(ead.registers.thr[0], 100)
+            self.assertEqual(ead.registers.delay_i[1], 512)
+        finally:
+            client.close()
+            server.shutdown()
+            ead.close()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix sockets")
+    def test_unix_socket_is_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ead.sock")
+            for _ in range(2):
+                server = ELBArduDiscServer(open_loopback(), path)
+                server.start()
+                server.shutdown()
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
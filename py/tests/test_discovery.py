@@ -0,0 +1,74 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import serial
+
+from elb_ardu_disc.discovery import discover_boards, find_board
+from elb_ardu_disc.loopback import FirmwareModel, LoopbackSerial
+
+TIMEOUT = 0.2
+
+
+class SilentSerial:
+    """
+    A port without an answering device, reads take the full timeout.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def readline(self) -> bytes:
+        time.sleep(self.timeout)
+        return b""
+
+    def close(self):
+        pass
+
+
+def open_port(port: str, timeout: float):
+    if port.startswith("/dev/ttyACM"):
+        return LoopbackSerial(FirmwareModel(), port=port)
+    if port == "/dev/ttyS0":
+        raise serial.SerialException("busy")
+    return SilentSerial(timeout)
+
+
+COMPORTS = [
+    SimpleNamespace(device="/dev/ttyACM0", serial_number="A1"),
+    SimpleNamespace(device="/dev/ttyACM1", serial_number=None),
+    SimpleNamespace(device="/dev/ttyS0", serial_number=None),
+] + [SimpleNamespace(device=f"/dev/ttyUSB{i}", serial_number=None) for i in range(5)]
+
+
+@patch("elb_ardu_disc.discovery.list_ports.comports", return_value=COMPORTS)
+class TestDiscovery(unittest.TestCase):
+
+    def test_boards_by_serial_number(self, comports):
+        boards = discover_boards(timeout=TIMEOUT, open_port=open_port)
+        self.assertEqual(sorted(boards), ["/dev/ttyACM1", "A1"])
+        self.assertEqual(boards["A1"].port, "/dev/ttyACM0")
+        self.assertEqual(boards["A1"].firmware_version, FirmwareModel().version)
+
+    def test_ports_are_probed_concurrently(self, comports):
+        start = time.perf_counter()
+        discover_boards(timeout=TIMEOUT, open_port=open_port)
+        # five silent ports, one after the other would take 5 timeouts
+        self.assertLess(time.perf_counter() - start, 3 * TIMEOUT)
+
+    def test_find_board(self, comports):
+        with patch("elb_ardu_disc.discovery._open_port", open_port):
+            with self.assertRaises(RuntimeError):
+                find_board(timeout=TIMEOUT)
+            self.assertEqual(find_board("A1", timeout=TIMEOUT), "/dev/ttyACM0")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,9 +1,27 @@
+import math
 import unittest
 from unittest.mock import patch
 
 from elb_ardu_disc import DacMCP48FVB14, DacMCP48FVB24
 from elb_ardu_disc import DacAddrV, DacVrefOptions
 from elb_ardu_disc import SpiIO
+from elb_ardu_disc import find_scurve_edge
+from elb_ardu_disc import DacCs
+from elb_ardu_disc.loopback import (
+    ConstantReplySerial,
+    FirmwareModel,
+    LoopbackSerial,
+    open_loopback,
+)
+from elb_ardu_disc.module import ELBArduDiscDacControl, ELBArduDiscPulserControl
+from elb_ardu_disc.spi import (
+    Capability,
+    ELBArduDiscSCPI,
+    ReplyReader,
+    SpiIoAScpi,
+    stream_commands,
+)
+from elb_ardu_disc.sweep import ListAxis, Product
 
 
 class GenericDacTest:
@@ -19,39 +37,54 @@ class GenericDacTest:
             with self.assertRaises(ValueError):
                 self.dac.set_channel(0, value)
 
-    @patch("elb_ardu_disc.DacMCP48FXBX4._execute_spi")
-    def test_set_all_refs_identical(self, mock_execute_spi):
-        mock_execute_spi.return_value = [1, 0xFF, 0xFF]
-        self.dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
+    def test_set_all_refs_identical(self):
+        with patch.object(self.spi, "do_io_24", create=True) as do_io_24:
+            do_io_24.return_value = [1, 0xFF, 0xFF]
+            self.dac.set_all_refs_same(DacVrefOptions.ExtBuffered)
 
-        expected_cmd_byte = 0b01000000
-        expected_data_word = 0xFF
+            expected_cmd_byte = 0b01000000
+            expected_data_word = 0xFF
 
-        mock_execute_spi.assert_called_with(
-            command_byte=expected_cmd_byte, data_word=expected_data_word
-        )
-
-    @patch("elb_ardu_disc.DacMCP48FXBX4._execute_spi")
-    def test_set_channel_calls_execute_spi_correctly(self, mock_execute_spi):
-
-        for channel in range(self.dac.channels):
-            for setting in range(2**self.dac.resolution):
+            do_io_24.assert_called_with(
+                [expected_cmd_byte, 0, expected_data_word], self.dac.cs_index
+            )
 
-                mock_execute_spi.return_value = [1, 0xFF, 0xFF]
+    def test_set_channel_full_range(self):
+        # real SCPI encoding and reply parsing against the firmware model
+        scpi = ELBArduDiscSCPI(port=None, serial_connection=LoopbackSerial())
+        dac = type(self.dac)(scpi.spi, cs_index=self.loopback_cs.value)
+        dac_model = scpi.ser.firmware.dacs[self.loopback_cs.value]
 
-                self.dac.set_channel(channel, setting)
+        for channel in range(dac.channels):
+            for setting in range(2**dac.resolution):
+                dac.set_channel(channel, setting)
+                self.assertEqual(dac_model.registers[channel], setting)
+            self.assertEqual(dac.get_channel(channel), 2**dac.resolution - 1)
 
-                expected_cmd_byte = DacAddrV.CmdWrite.value
-                expected_cmd_byte |= DacAddrV.Channel.value[channel]
+    def test_get_channel_reads_register(self):
+        with patch.object(self.spi, "do_io_24", create=True) as do_io_24:
+            do_io_24.return_value = [1, 0xF2, 0x34]
+            self.assertEqual(
+                self.dac.get_channel(3), 0xF234 & ((1 << self.dac.resolution) - 1)
+            )
+            do_io_24.assert_called_with([0x1E, 0, 0], self.dac.cs_index)
 
-                expected_data_word = setting
-
-                mock_execute_spi.assert_called_with(
-                    command_byte=expected_cmd_byte, data_word=expected_data_word
-                )
+    def test_get_refs(self):
+        with patch.object(self.spi, "do_io_24", create=True) as do_io_24:
+            do_io_24.return_value = [1, 0x00, 0b11100100]
+            self.assertEqual(
+                self.dac.get_refs(),
+                [
+                    DacVrefOptions.VDD,
+                    DacVrefOptions.Internal_1V22,
+                    DacVrefOptions.ExtUnbuffered,
+                    DacVrefOptions.ExtBuffered,
+                ],
+            )
 
 
 class TestDacMCP48FVB14(unittest.TestCase, GenericDacTest):
+    loopback_cs = DacCs.DELAY_I
 
     def setUp(self):
         self.spi = SpiIO()
@@ -63,6 +96,7 @@ class TestDacMCP48FVB14(unittest.TestCase, GenericDacTest):
 
 
 class TestDacMCP48FVB24(unittest.TestCase, GenericDacTest):
+    loopback_cs = DacCs.CHANNEL_THR
 
     def setUp(self):
         self.spi = SpiIO()
@@ -73,5 +107,374 @@ class TestDacMCP48FVB24(unittest.TestCase, GenericDacTest):
         self.assertEqual(self.dac.resolution, 12)
 
 
+class TestSCurveScan(unittest.TestCase):
+
+    @staticmethod
+    def s_curve(code: int, edge: float = 1234.5, sigma: float = 20.0) -> int:
+        return int(10000 * 0.5 * math.erfc((code - edge) / (sigma * math.sqrt(2))))
+
+    def test_finds_edge_and_width(self):
+        result = find_scurve_edge(self.s_curve, 0, 4095)
+
+        self.assertAlmostEqual(result.code, 1234.5, delta=1)
+        self.assertAlmostEqual(result.width, 40, delta=2)
+        # a linear scan needs 4096 steps
+        self.assertLess(len(result.points), 50)
+
+    def test_rising_curve(self):
+        result = find_scurve_edge(
+            lambda code: 10000 - self.s_curve(code), 0, 4095, width_fractions=None
+        )
+        self.assertAlmostEqual(result.code, 1234.5, delta=1)
+        self.assertTrue(math.isnan(result.width))
+
+    def test_no_edge(self):
+        with self.assertRaises(RuntimeError):
+            find_scurve_edge(lambda code: 0, 0, 4095)
+
+
+class FakeTestpulser:
+    def set_period(self, period_us: int) -> int:
+        # prescaler 8 for periods >= 8192 us: 1 us resolution
+        return period_us * 1000 if period_us >= 8192 else period_us * 1000 + 62
+
+    def set_duty(self, duty: int) -> int:
+        return duty
+
+
+class TestPulserControl(unittest.TestCase):
+
+    def setUp(self):
+        scpi = type("FakeScpi", (), {"testpulser": FakeTestpulser()})()
+        self.pulser = ELBArduDiscPulserControl(scpi)
+
+    def test_period_reports_achieved_value(self):
+        self.assertAlmostEqual(self.pulser.set_period_us(10), 10.062)
+        self.assertAlmostEqual(self.pulser.set_rate_hz(100), 100)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            self.pulser.set_period_us(0)
+        with self.assertRaises(ValueError):
+            self.pulser.set_rate_hz(0.5)
+        with self.assertRaises(ValueError):
+            self.pulser.set_duty_cycle(1.5)
+        with self.assertRaises(ValueError):
+            self.pulser.burst(0)
+
+    def test_duty_cycle(self):
+        self.assertAlmostEqual(self.pulser.set_duty_cycle(0.5), 512 / 1023)
+
+
+class TestFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        # the model only processes commands when the host polls for input
+        self.serial = LoopbackSerial(deferred=True)
+        self.scpi = ELBArduDiscSCPI(port=None, serial_connection=self.serial)
+        self.firmware = self.serial.firmware
+
+    def test_credits_from_firmware(self):
+        self.assertEqual(self.scpi.rx_credits, 62)
+
+    def test_stream_without_overrun(self):
+        cs_index = DacCs.CHANNEL_THR.value
+        transfers = [([0x08, code >> 8, code & 0xFF], cs_index) for code in range(500)]
+        answers = self.scpi.spi.do_io_24_many(transfers)
+        self.assertEqual(answers, [[1, 0xFF, 0xFF]] * 500)
+        self.assertEqual(self.serial.overruns, 0)
+        self.assertEqual(self.firmware.dacs[cs_index].registers[1], 499)
+        # the credits never fill the buffer
+        self.assertEqual(self.scpi.get_statistics().rx_overflows, 0)
+
+    def test_overrun_without_credits(self):
+        commands = [b"SYST:SPI:SEN 4, 8, 1\n"] * 10
+        with self.assertRaises(TimeoutError):
+            stream_commands(
+                self.serial, self.scpi.reader, commands, "SPIRESP", 1000, 0.01
+            )
+        self.assertGreater(self.serial.overruns, 0)
+        self.assertGreater(self.scpi.get_statistics().rx_overflows, 0)
+
+    def test_statistics(self):
+        self.scpi.reset_statistics()
+        self.scpi.spi.do_io_24_many([([0x08, 0, 1], 4)] * 100)
+        statistics = self.scpi.get_statistics()
+        self.assertEqual(statistics.spi_transfers, 100)
+        self.assertEqual(statistics.commands, 101)
+        self.assertEqual(statistics.rx_overflows, 0)
+
+    def test_spi_clock(self):
+        self.assertEqual(self.scpi.get_spi_clock(), 1000000)
+        self.assertEqual(self.scpi.set_spi_clock(20000000), 8000000)
+        self.assertEqual(self.scpi.set_spi_clock(1), 125000)
+        with self.assertRaises(ValueError):
+            self.scpi.set_spi_clock(0)
+
+    def test_register_map_streams(self):
+        registers = ELBArduDiscDacControl(self.scpi).registers
+        registers.delay_th[:] = [100, 200, 300, 400]
+        registers.thr[:] = 4000
+        self.assertEqual(
+            self.firmware.dacs[DacCs.DELAY_TH.value].registers, [100, 200, 300, 400]
+        )
+        self.assertEqual(
+            self.firmware.dacs[DacCs.CHANNEL_THR.value].registers, [4000] * 4
+        )
+        self.assertEqual(registers.thr[:], [4000] * 4)
+        self.assertEqual(self.serial.overruns, 0)
+
+
+class TestMulticast(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+        self.firmware = self.ead.loopback
+        self.dac_control = self.ead._dac_control
+
+    def test_refs_in_one_transaction(self):
+        commands = self.firmware.commands_processed
+        self.dac_control.broadcast_refs(DacVrefOptions.Internal_1V22)
+        self.assertEqual(self.firmware.commands_processed - commands, 1)
+        self.assertEqual({dac.vref for dac in self.firmware.dacs.values()}, {0x55})
+        self.assertEqual(list(self.ead.registers.refs), [0x55] * 8)
+
+    def test_broadcast_channel(self):
+        dacs = [
+            self.dac_control.channel_delay_i_dac,
+            self.dac_control.channel_pulse_i_dac,
+        ]
+        commands = self.firmware.commands_processed
+        self.dac_control.broadcast_channel(dacs, 2, 512)
+        self.assertEqual(self.firmware.commands_processed - commands, 1)
+        for cs in (DacCs.DELAY_I, DacCs.PULSE_I):
+            self.assertEqual(self.firmware.dacs[cs.value].registers[2], 512)
+        self.assertEqual(self.ead.registers.delay_i[2], 512)
+        self.assertEqual(self.ead.registers.pulse_i[2], 512)
+
+    def test_register_map_groups_identical_writes(self):
+        registers = self.ead.registers
+        writes = [
+            (DacCs.DELAY_TH.value, 0, 300),
+            (DacCs.PULSE_TH.value, 0, 300),
+            (DacCs.LOGIC_TIMING_TH.value, 0, 300),
+            (DacCs.PULSE_TH.value, 1, 7),
+        ]
+        commands = self.firmware.commands_processed
+        registers.write(writes)
+        self.assertEqual(self.firmware.commands_processed - commands, 2)
+        self.assertEqual(registers.delay_th[0], 300)
+        self.assertEqual(registers.logic_delay_th[0], 300)
+        self.assertEqual(registers.pulse_th[0:2], [300, 7])
+
+    def test_read_is_rejected(self):
+        answers = self.ead._scpi.spi.do_io_24_multicast([0x06, 0, 0], [1, 2])
+        self.assertEqual(answers, [[0, 0, 0]] * 2)
+
+
+class TestFastPath(unittest.TestCase):
+
+    def test_encoding_matches_scpi(self):
+        spi = SpiIoAScpi(ConstantReplySerial())
+        for cs_index, command, payload in [
+            (4, 8, 0),
+            (0, 0x18, 4095),
+            (7, 0x40, 65535),
+        ]:
+            self.assertEqual(
+                spi._encode([command, payload >> 8, payload & 0xFF], cs_index),
+                f"SYST:SPI:SEN {cs_index}, {command}, {payload}\n".encode("ascii"),
+            )
+        self.assertEqual(
+            spi._encode([8, 0, 1], 2, trigger=True), b"SYST:SPI:SEN 2, 8, 1, 1\n"
+        )
+
+    def test_reply_values(self):
+        serial = ConstantReplySerial()
+        reader = ReplyReader(serial)
+        serial._rx += b"Pulser,1\nSPIRESP,4,8,5,131071\r\nSPIRESP,1,6,0,65"
+        self.assertEqual(reader.wait_for_value(b"SPIRESP"), 0x01FFFF)
+        serial._rx += b"535\r\n"
+        self.assertEqual(reader.wait_for_value(b"SPIRESP"), 65535)
+        with self.assertRaises(TimeoutError):
+            reader.wait_for_value(b"SPIRESP", timeout=0.01)
+
+    def test_dac_write_and_read(self):
+        spi = SpiIoAScpi(ConstantReplySerial())
+        dac = DacMCP48FVB24(spi, DacCs.CHANNEL_THR.value)
+        dac.set_channel(1, 4095)
+        self.assertEqual(dac.get_channel(0), 0xFFF)
+        self.assertEqual(
+            spi.ser.bytes_written,
+            len(b"SYST:SPI:SEN 4, 8, 4095\n" + b"SYST:SPI:SEN 4, 6, 0\n"),
+        )
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+        self.firmware = self.ead.loopback
+
+    def test_one_burst(self):
+        commands = self.firmware.commands_processed
+        with self.ead.transaction():
+            for channel in range(4):
+                self.ead.timing_control.set_channel_delay_current(channel, 300)
+                self.ead.timing_control.set_channel_pulse_width_current(channel, 300)
+            self.ead.channel_control.set_threshold(0, 1000)
+            self.ead.channel_control.set_threshold(0, 2000)
+            self.ead.testpulser_control.set_period_us(50)
+            self.ead.testpulser_control.set_pulser(True)
+            self.assertEqual(self.firmware.commands_processed, commands)
+        # 4 multicasts, 1 threshold, period and pulser on
+        self.assertEqual(self.firmware.commands_processed - commands, 7)
+        self.assertEqual(self.firmware.dacs[DacCs.CHANNEL_THR.value].registers[0], 2000)
+        self.assertEqual(self.firmware.pulser_period_us, 50)
+        self.assertTrue(self.firmware.pulser_running)
+
+    def test_error_sends_nothing(self):
+        commands = self.firmware.commands_processed
+        with self.assertRaises(RuntimeError):
+            with self.ead.transaction():
+                self.ead.testpulser_control.set_pulser(True)
+                self.ead.testpulser_control.burst(10)
+        self.assertEqual(self.firmware.commands_processed, commands)
+        self.assertFalse(self.firmware.pulser_running)
+
+
+class TestTrigger(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+        self.firmware = self.ead.loopback
+        self.registers = self.ead.registers
+
+    def test_trigger_after_last_write(self):
+        self.registers.delay_th.write(slice(None), [100, 200, 300, 400], trigger=True)
+        self.assertEqual(self.firmware.triggers, [self.firmware.commands_processed])
+        # identical codes on several chips are multicast
+        writes = [(DacCs.DELAY_I.value, 1, 50), (DacCs.PULSE_I.value, 1, 50)]
+        self.registers.write(writes, trigger=True)
+        self.assertEqual(len(self.firmware.triggers), 2)
+        self.assertEqual(self.firmware.triggers[-1], self.firmware.commands_processed)
+
+    def test_trigger_without_changes(self):
+        self.registers.thr[:] = 1000
+        commands = self.firmware.commands_processed
+        self.registers.write([(DacCs.CHANNEL_THR.value, 0, 1000)], trigger=True)
+        self.assertEqual(self.firmware.triggers, [commands + 1])
+
+    def test_sweep_and_transaction(self):
+        plan = Product(ListAxis("thr", [1, 2, 3]))
+        for index, point in self.ead.sweep(plan, trigger=True):
+            self.assertEqual(len(self.firmware.triggers), index + 1)
+        with self.ead.transaction(trigger=True):
+            self.ead.channel_control.set_threshold(0, 5)
+            self.ead.testpulser_control.set_pulser(True)
+        self.assertEqual(len(self.firmware.triggers), 4)
+        self.assertEqual(self.firmware.triggers[-1], self.firmware.commands_processed)
+
+    def test_old_firmware(self):
+        ead = open_loopback(FirmwareModel(version="0.1.0"))
+        commands = ead.loopback.commands_processed
+        with self.assertRaises(RuntimeError):
+            ead.registers.thr.write(0, 100, trigger=True)
+        with self.assertRaises(RuntimeError):
+            ead.trigger()
+        self.assertEqual(ead.loopback.commands_processed, commands)
+
+
+class TestCapabilities(unittest.TestCase):
+
+    def connect(self, firmware: FirmwareModel, **kwargs) -> ELBArduDiscSCPI:
+        self.serial = LoopbackSerial(firmware)
+        return ELBArduDiscSCPI(port=None, serial_connection=self.serial, **kwargs)
+
+    def test_current_firmware(self):
+        scpi = self.connect(FirmwareModel())
+        self.assertIn(Capability.MULTICAST, scpi.capabilities)
+        self.assertIn(Capability.BAUD, scpi.capabilities)
+        self.assertNotIn(Capability.BINARY, scpi.capabilities)
+        self.assertEqual(scpi.rx_credits, 62)
+        self.assertTrue(scpi.spi.multicast)
+        self.assertTrue(scpi.started)
+
+    def test_board_without_reset(self):
+        # the welcome message was sent before the host opened the port
+        self.serial = LoopbackSerial(FirmwareModel())
+        self.serial.read_until(b"\n")
+        scpi = ELBArduDiscSCPI(port=None, serial_connection=self.serial)
+        self.assertEqual(scpi.firmware_version, self.serial.firmware.version)
+        self.assertFalse(scpi.started)
+
+    def test_old_firmware(self):
+        scpi = self.connect(FirmwareModel(version="0.0.1"))
+        self.assertEqual(scpi.capabilities, Capability(0))
+        self.assertEqual(scpi.rx_credits, 0)
+        self.assertFalse(scpi.spi.multicast)
+        with self.assertRaises(RuntimeError):
+            scpi.get_statistics()
+        with self.assertRaises(RuntimeError):
+            scpi.counter.count(10)
+        with self.assertRaises(RuntimeError):
+            scpi.testpulser.set_period(100)
+        self.assertEqual(scpi.testpulser.switch_testpulser(True).strip(), "Pulser,1")
+        # still works, one transfer at a time
+        answers = scpi.spi.do_io_24_many([([0x08, 0, 1], 4)] * 3)
+        self.assertEqual(answers, [[1, 0xFF, 0xFF]] * 3)
+
+    def test_version_fallback(self):
+        scpi = self.connect(FirmwareModel(version="0.0.3"))
+        self.assertEqual(
+            scpi.capabilities,
+            Capability.FLOW_CONTROL
+            | Capability.MULTICAST
+            | Capability.COUNTER
+            | Capability.PULSER,
+        )
+
+    def test_counter_before_its_capability_bit(self):
+        scpi = self.connect(FirmwareModel(version="0.1.3"))
+        self.assertIn(Capability.COUNTER, scpi.capabilities)
+        self.assertEqual(scpi.counter.count(10), 0)
+
+    def test_fastest_baudrate(self):
+        scpi = self.connect(FirmwareModel(), max_baudrate=1000000)
+        self.assertEqual(self.serial.baudrate, 1000000)
+        self.assertEqual(self.serial.firmware.baudrate, 1000000)
+        self.assertEqual(scpi.get_spi_clock(), 1000000)
+
+    @patch("elb_ardu_disc.loopback.BAUD_CONFIRM_S", 0.02)
+    @patch("elb_ardu_disc.spi.BAUD_CONFIRM_S", 0.02)
+    def test_baudrate_fallback(self):
+        # the adapter only carries 250000 baud
+        firmware = FirmwareModel(max_link_baudrate=250000)
+        scpi = self.connect(firmware, max_baudrate=1000000)
+        self.assertEqual(self.serial.baudrate, 250000)
+        self.assertEqual(firmware.baudrate, 250000)
+        self.assertEqual(scpi.get_spi_clock(), 1000000)
+
+    @patch("elb_ardu_disc.loopback.BAUD_CONFIRM_S", 0.02)
+    @patch("elb_ardu_disc.spi.BAUD_CONFIRM_S", 0.02)
+    def test_lost_baudrate_confirmation(self):
+        scpi = self.connect(FirmwareModel())
+        # the firmware takes the confirmation, its answer gets lost
+        process = self.serial._process
+
+        def lose_answer():
+            before = len(self.serial._rx)
+            process()
+            if self.serial._rx[before:].startswith(b"CAP"):
+                del self.serial._rx[before:]
+                self.serial._process = process
+
+        self.serial._process = lose_answer
+        self.assertFalse(scpi.set_baudrate(1000000))
+        self.assertEqual(self.serial.firmware.baudrate, 1000000)
+        self.assertEqual(self.serial.baudrate, 1000000)
+        self.assertEqual(scpi.get_spi_clock(), 1000000)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
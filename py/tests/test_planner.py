@@ -0,0 +1,89 @@
+import unittest
+
+from elb_ardu_disc.loopback import open_loopback
+from elb_ardu_disc.planner import (
+    BATCHED,
+    PIPELINED,
+    SEQUENTIAL,
+    TRANSACTION,
+    LinkProfile,
+    Step,
+    compare,
+    estimate_all,
+    measure_link,
+    recommend,
+    sweep_steps,
+)
+from elb_ardu_disc.registers import REGISTER_LAYOUT
+from elb_ardu_disc.sweep import LinearAxis, ListAxis, Product
+
+SERIAL = LinkProfile(
+    round_trip_s=0.004, stream_s=0.001, baudrate=115200, rx_credits=63, multicast=True
+)
+
+
+class TestEstimate(unittest.TestCase):
+
+    def test_strategies(self):
+        # the same code on channel 0 of two chips, then one more write
+        steps = [Step([(4, 0, 100), (7, 0, 100)]), Step([(4, 0, 200)], commands=1)]
+        estimates = estimate_all(SERIAL, steps, dwell_s=0.0)
+
+        self.assertAlmostEqual(estimates[SEQUENTIAL].link_s, 4 * 0.004)
+        self.assertAlmostEqual(estimates[PIPELINED].link_s, 0.005 + 0.008)
+        self.assertAlmostEqual(estimates[BATCHED].link_s, 0.004 + 0.008)
+        # only the last value of chip 4 and the one of chip 7
+        self.assertAlmostEqual(estimates[TRANSACTION].link_s, 0.005 + 0.004)
+        self.assertEqual(recommend(SERIAL, steps).strategy, TRANSACTION)
+        self.assertEqual(estimates[SEQUENTIAL].transfers, 4)
+        self.assertEqual(
+            estimates[SEQUENTIAL].bytes_sent,
+            len(b"SYST:SPI:SEN 4, 0, 100\n") * 2
+            + len(b"SYST:SPI:SEN 4, 0, 200\n")
+            + 12,
+        )
+
+    def test_dwell_and_supported_strategies(self):
+        steps = [Step([(4, 0, code)]) for code in range(10)]
+        no_flow_control = SERIAL._replace(rx_credits=0, multicast=False)
+        estimates = estimate_all(no_flow_control, steps, dwell_s=0.1)
+        self.assertEqual(list(estimates), [SEQUENTIAL])
+        self.assertAlmostEqual(estimates[SEQUENTIAL].duration_s, 10 * 0.104)
+        with self.assertRaises(ValueError):
+            recommend(no_flow_control, steps, strategies=(BATCHED,))
+
+
+class TestSweepEstimate(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+
+    def test_steps_only_contain_changes(self):
+        plan = Product(
+            LinearAxis("delay_th", 350, 359), ListAxis("pulse_i", [10, 20], channels=1)
+        )
+        steps = list(sweep_steps(self.ead.registers, plan))
+        self.assertEqual(len(steps), len(plan))
+        writes = sum(len(step.writes) for step in steps)
+        self.assertEqual(writes, plan.write_count())
+        self.assertEqual(len(steps[0].writes), len(REGISTER_LAYOUT["delay_th"][1]) + 1)
+
+    def test_predicted_and_actual(self):
+        plan = LinearAxis("thr", 0, 99)
+        profile = measure_link(self.ead, samples=8)
+        self.assertGreater(profile.round_trip_s, 0)
+        self.assertTrue(profile.multicast)
+
+        estimate = self.ead.estimate_sweep(plan, profile=profile)
+        self.assertNotEqual(estimate.strategy, TRANSACTION)
+        self.assertEqual(estimate.steps, 100)
+        runner = self.ead.sweep(plan)
+        for _ in runner:
+            pass
+        comparison = compare(estimate, runner.elapsed_s)
+        self.assertEqual(comparison.actual_s, runner.elapsed_s)
+        self.assertGreater(comparison.actual_s, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
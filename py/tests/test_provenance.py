@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from elb_ardu_disc import DacCs, ProvenanceLog, read_provenance
+from elb_ardu_disc.loopback import open_loopback
+from elb_ardu_disc.provenance import REFS_CHANNEL
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestProvenance(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "run.prov")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_append_and_read(self):
+        with ProvenanceLog(self.path, buffer_records=3) as log:
+            for code in range(10):
+                log.append(4, 1, code, 0.001)
+        with ProvenanceLog(self.path) as log:
+            log.append(2, -1, 0xFF)
+
+        with read_provenance(self.path) as records:
+            self.assertEqual(len(records), 11)
+            self.assertEqual([r.code for r in records][:10], list(range(10)))
+            self.assertEqual(records[-1].dac_channel, REFS_CHANNEL)
+            self.assertAlmostEqual(records[0].latency, 0.001)
+            self.assertLessEqual(records[0].timestamp, time.time())
+
+    def test_incomplete_record_is_ignored(self):
+        with ProvenanceLog(self.path) as log:
+            log.append(0, 0, 1)
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * 5)
+        with read_provenance(self.path) as records:
+            self.assertEqual(len(records), 1)
+
+    def test_incomplete_record_is_cut_off_before_appending(self):
+        with ProvenanceLog(self.path) as log:
+            log.append(0, 0, 1)
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * 5)
+        with self.assertLogs("elb_ardu_disc.provenance", "WARNING"):
+            with ProvenanceLog(self.path) as log:
+                log.append(3, 2, 7)
+        with read_provenance(self.path) as records:
+            self.assertEqual([(r.cs_index, r.code) for r in records], [(0, 1), (3, 7)])
+
+    def test_buffer_is_written_at_exit(self):
+        script = (
+            "from elb_ardu_disc.provenance import ProvenanceLog\n"
+            f"log = ProvenanceLog({self.path!r})\n"
+            "log.append(1, 2, 3)\n"
+        )
+        environment = dict(os.environ)
+        source = os.path.join(os.path.dirname(__file__), "..", "src")
+        environment["PYTHONPATH"] = os.pathsep.join(
+            [source, environment.get("PYTHONPATH", "")]
+        )
+        subprocess.run([sys.executable, "-c", script], env=environment, check=True)
+        with read_provenance(self.path) as records:
+            self.assertEqual(records[0].code, 3)
+
+    def test_writes_of_the_board_are_logged(self):
+        ead = open_loopback(provenance_path=self.path)
+        ead.registers.thr[:] = 100
+        middle = time.time()
+        ead.channel_control.set_threshold(2, 200)
+        ead.close()
+
+        with read_provenance(self.path) as records:
+            # references of the 8 chips at init and the 5 writes
+            self.assertEqual(len(records), 8 + 5)
+            thr = DacCs.CHANNEL_THR.value
+            self.assertEqual(records.active_codes(middle)[(thr, 2)], 100)
+            self.assertEqual(records.active_codes(time.time())[(thr, 2)], 200)
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_columns(self):
+        with ProvenanceLog(self.path) as log:
+            for code in range(100):
+                log.append(code % 8, code % 4, code)
+        records = read_provenance(self.path)
+        columns = records.columns()
+        self.assertEqual(columns["code"].sum(), sum(range(100)))
+        self.assertTrue((numpy.diff(columns["timestamp"]) >= 0).all())
+        codes = records.active_codes(columns["timestamp"][-1])
+        self.assertEqual(len(codes), 8)
+        self.assertEqual(codes[(1, 1)], 97)
+        self.assertEqual(codes[(7, 3)], 95)
+        self.assertEqual(records.active_codes(columns["timestamp"][0] - 1), {})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
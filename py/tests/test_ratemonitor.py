@@ -0,0 +1,96 @@
+import unittest
+
+from elb_ardu_disc.loopback import FirmwareModel, open_loopback
+from elb_ardu_disc.ratemonitor import RateHistory, parse_rate_sample
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRateSample(unittest.TestCase):
+
+    def test_parse(self):
+        sample = parse_rate_sample(b"RATE,1f,2710,64,0,a,3e8", timestamp=5.0)
+        self.assertEqual(sample.sequence, 31)
+        self.assertAlmostEqual(sample.elapsed_s, 0.01)
+        self.assertEqual(sample.counts, (100, 0, 10, 1000))
+        self.assertEqual(sample.rates, (10000.0, 0.0, 1000.0, 100000.0))
+        with self.assertRaises(ValueError):
+            parse_rate_sample(b"RATEMON,10")
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestRateHistory(unittest.TestCase):
+
+    def test_ring_buffer_keeps_the_last_samples(self):
+        history = RateHistory(capacity=3, channels=2)
+        self.assertIsNone(history.latest())
+        for number in range(5):
+            history.append(float(number), (number, 2 * number))
+        times, rates = history.snapshot()
+        self.assertEqual(len(history), 3)
+        self.assertEqual(list(times), [2.0, 3.0, 4.0])
+        self.assertEqual(rates[:, 1].tolist(), [4.0, 6.0, 8.0])
+        self.assertEqual(history.latest(), (4.0, 8.0))
+        self.assertEqual(history.mean(1.5).tolist(), [3.5, 7.0])
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestRateMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        firmware = FirmwareModel()
+        firmware.clock = self.clock
+        firmware.input_rates = [1000.0, 0.0, 50.0, 0.0]
+        self.ead = open_loopback(firmware)
+
+    def tearDown(self):
+        self.ead.close()
+
+    def test_samples_arrive_between_commands(self):
+        monitor = self.ead.start_rate_monitor(interval_ms=20)
+        received = []
+        monitor.subscribe(received.append)
+
+        self.clock.now += 0.02
+        # the sample is passed on while the command waits for its answer
+        self.ead.channel_control.set_threshold(0, 100)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].counts, (20, 0, 1, 0))
+
+        self.clock.now += 0.04
+        monitor.poll()
+        self.assertEqual(monitor.samples, 2)
+        self.assertEqual(monitor.missed, 0)
+        self.assertEqual(monitor.history.latest(), (1000.0, 0.0, 50.0, 0.0))
+
+        self.ead.stop_rate_monitor()
+        self.assertEqual(self.ead.loopback.rate_interval_ms, 0)
+
+    def test_sequence_gaps_are_counted(self):
+        monitor = self.ead.start_rate_monitor()
+        monitor._on_line(b"RATE,5,186a0,1,0,0,0")
+        monitor._on_line(b"RATE,8,186a0,1,0,0,0")
+        self.assertEqual(monitor.missed, 2)
+
+    def test_older_firmware(self):
+        ead = open_loopback(FirmwareModel(version="0.1.1"))
+        with self.assertRaises(RuntimeError):
+            ead.start_rate_monitor()
+        with self.assertRaises(ValueError):
+            self.ead.start_rate_monitor(interval_ms=1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
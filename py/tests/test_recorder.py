@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+from elb_ardu_disc.recorder import (
+    DIRECTION_RX,
+    DIRECTION_TX,
+    RecordingSerial,
+    Replayer,
+    read_recording,
+)
+
+
+class EchoSerial:
+    """
+    Answers every line with "ACK,<line>".
+    """
+
+    def __init__(self):
+        self.rx = bytearray(b"WELCOME\n")
+        self.timeout = 1
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def write(self, data: bytes):
+        self.rx.extend(b"ACK," + data)
+        return len(data)
+
+    def read(self, size: int = 1):
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    def read_until(self, expected=b"\n"):
+        index = self.rx.find(expected)
+        return self.read(index + len(expected) if index >= 0 else len(self.rx))
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+
+    def close(self):
+        pass
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def test_record_and_replay(self):
+        recording = RecordingSerial(EchoSerial(), self.log_path)
+        recording.timeout = 3
+        self.assertEqual(recording.ser.timeout, 3)
+        self.assertEqual(recording.read_until(b"\n"), b"WELCOME\n")
+        for i in range(3):
+            recording.write(f"SYST:SPI:SEN 0, 0, {i}\n".encode("ascii"))
+            recording.read(recording.in_waiting)
+        recording.close()
+
+        records = list(read_recording(self.log_path))
+        self.assertEqual(
+            [r.direction for r in records[:3]],
+            [DIRECTION_RX, DIRECTION_TX, DIRECTION_RX],
+        )
+        self.assertEqual(records[0].data, b"WELCOME\n")
+        self.assertEqual(records[-1].data, b"ACK,SYST:SPI:SEN 0, 0, 2\n")
+        timestamps = [r.timestamp for r in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+        report = Replayer(EchoSerial()).replay(self.log_path)
+        summary = report.summary()
+        self.assertEqual(summary["exchanges"], 3)
+        self.assertEqual(summary["reply_mismatches"], 0)
+
+    def test_rejects_other_files(self):
+        with open(self.log_path, "wb") as f:
+            f.write(b"not a recording")
+        with self.assertRaises(ValueError):
+            list(read_recording(self.log_path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,148 @@
+import unittest
+
+from elb_ardu_disc import SpiIO
+from elb_ardu_disc.module import ELBArduDiscDacControl, ELBArduDiscTimingControl
+from elb_ardu_disc.spi import LinkLock
+from elb_ardu_disc.verifier import REFS, IntegrityVerifier
+
+
+class RecordingSpiIO(SpiIO):
+    """
+    Records the writes and answers reads from a register memory.
+    """
+
+    def __init__(self):
+        self.writes = []
+        self.memory = {}
+
+    def do_io_24(self, data_out, cs_index):
+        address = data_out[0] & 0xF8
+        data_word = (data_out[1] << 8) | data_out[2]
+        if data_out[0] & 0x06:
+            data_word = self.memory.get((cs_index, address), 0)
+            return [1, data_word >> 8, data_word & 0xFF]
+        self.writes.append((cs_index, data_out[0], data_word))
+        self.memory[(cs_index, address)] = data_word
+        return [1, 0xFF, 0xFF]
+
+
+class TestRegisterMap(unittest.TestCase):
+
+    def setUp(self):
+        self.spi = RecordingSpiIO()
+        scpi = type("FakeScpi", (), {"spi": self.spi})()
+        self.dac_control = ELBArduDiscDacControl(scpi)
+        self.regs = self.dac_control.registers
+        self.spi.writes.clear()
+
+    def test_refs_are_recorded(self):
+        self.assertEqual(list(self.regs.refs), [0xFF] * 8)
+
+    def test_broadcast_sends_only_changes(self):
+        self.regs.delay_th[1] = 600
+        self.spi.writes.clear()
+
+        self.regs.delay_th[:] = 600
+        self.assertEqual(
+            self.spi.writes, [(7, 0x00, 600), (7, 0x10, 600), (7, 0x18, 600)]
+        )
+        self.assertEqual(self.regs.delay_th[:], [600] * 4)
+
+        self.spi.writes.clear()
+        self.regs.delay_th[:] = 600
+        self.assertEqual(self.spi.writes, [])
+
+    def test_slice_and_unknown(self):
+        self.regs.thr[1:3] = [100, 4000]
+        self.assertEqual(self.regs.thr[:], [None, 100, 4000, None])
+        with self.assertRaises(ValueError):
+            self.regs.thr[0:2] = [1, 2, 3]
+
+    def test_invalid_value_sends_nothing(self):
+        with self.assertRaises(ValueError):
+            self.regs.hys[:] = [1, 2, 3, 1024]
+        self.assertEqual(self.spi.writes, [])
+
+    def test_logic_timing_channels(self):
+        timing = ELBArduDiscTimingControl(self.dac_control)
+        timing.set_logic_pulse_width_threshold(1, 5)
+        timing.set_logic_delay_current(1, 6)
+        self.assertEqual(self.spi.writes, [(5, 0x18, 5), (0, 0x10, 6)])
+        self.assertEqual(self.regs.logic_pw_th[1], 5)
+        with self.assertRaises(ValueError):
+            timing.set_logic_delay_threshold(2, 0)
+
+    def test_set_methods_always_write(self):
+        timing = ELBArduDiscTimingControl(self.dac_control)
+        timing.set_channel_delay_current(0, 10)
+        timing.set_channel_delay_current(0, 10)
+        self.assertEqual(len(self.spi.writes), 2)
+
+    def test_transaction_sends_last_values(self):
+        timing = ELBArduDiscTimingControl(self.dac_control)
+        with self.regs.transaction():
+            self.regs.thr[:] = 100
+            timing.set_channel_delay_current(0, 10)
+            timing.set_channel_delay_current(0, 20)
+            self.regs.thr[1] = 200
+            self.assertEqual(self.regs.thr[:], [100, 200, 100, 100])
+            self.assertEqual(self.spi.writes, [])
+        self.assertEqual(
+            self.spi.writes,
+            [(2, 0x00, 20), (4, 0x00, 100), (4, 0x08, 200)]
+            + [(4, 0x10, 100), (4, 0x18, 100)],
+        )
+
+    def test_transaction_error_sends_nothing(self):
+        with self.assertRaises(ValueError):
+            with self.regs.transaction():
+                self.regs.thr[:] = 100
+                self.regs.hys[0] = 1024
+        with self.assertRaises(KeyError):
+            with self.regs.transaction():
+                self.regs.thr[:] = 100
+                raise KeyError("aborted")
+        self.assertEqual(self.spi.writes, [])
+        self.assertEqual(self.regs.thr[:], [None] * 4)
+
+
+class TestIntegrityVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.spi = RecordingSpiIO()
+        scpi = type("FakeScpi", (), {"spi": self.spi})()
+        self.regs = ELBArduDiscDacControl(scpi).registers
+        self.regs.thr[:] = [10, 20, 30, 40]
+        self.lock = LinkLock()
+        self.mismatches = []
+        self.verifier = IntegrityVerifier(
+            self.regs, self.lock, idle_s=0, on_mismatch=self.mismatches.append
+        )
+
+    def test_repairs_reset_registers(self):
+        # brown-out of the threshold dac
+        for address in (0x00, 0x08, 0x10, 0x18, 0x40):
+            self.spi.memory[(4, address)] = 0
+
+        # 8 reference registers + 4 thresholds
+        for _ in range(12):
+            self.assertTrue(self.verifier.verify_next())
+
+        self.assertEqual(self.verifier.checked, 12)
+        self.assertEqual(
+            [(m.dac_channel, m.expected, m.actual) for m in self.mismatches],
+            [(REFS, 0xFF, 0), (0, 10, 0), (1, 20, 0), (2, 30, 0), (3, 40, 0)],
+        )
+        self.assertEqual(self.spi.memory[(4, 0x18)], 40)
+        self.assertEqual(self.spi.memory[(4, 0x40)], 0xFF)
+
+    def test_yields_to_foreground(self):
+        self.verifier.idle_s = 60
+        with self.lock:
+            pass
+        self.assertFalse(self.verifier.verify_next())
+        self.assertEqual(self.verifier.checked, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from elb_ardu_disc import CommandScheduler, CommandPriority, ScheduledControl
+
+
+class RecordingControl:
+    def __init__(self):
+        self.calls = []
+
+    def set_value(self, channel: int, value: int):
+        self.calls.append((channel, value))
+        return value
+
+    def fail(self):
+        raise ValueError("Invalid")
+
+
+class TestCommandScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = CommandScheduler()
+        self.control = RecordingControl()
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def test_returns_future_with_result(self):
+        scheduled = ScheduledControl(self.control, self.scheduler)
+        future = scheduled.set_value(1, 42)
+        self.assertEqual(future.result(timeout=1), 42)
+
+    def test_exception_is_delivered_through_future(self):
+        scheduled = ScheduledControl(self.control, self.scheduler)
+        with self.assertRaises(ValueError):
+            scheduled.fail().result(timeout=1)
+
+    def test_interactive_overtakes_bulk(self):
+        blocker = threading.Event()
+        self.scheduler.submit(blocker.wait)
+
+        bulk = ScheduledControl(self.control, self.scheduler, CommandPriority.BULK)
+        interactive = ScheduledControl(self.control, self.scheduler)
+        futures = [bulk.set_value(0, i) for i in range(3)]
+        futures.append(interactive.set_value(1, 99))
+        blocker.set()
+        for future in futures:
+            future.result(timeout=1)
+
+        self.assertEqual(self.control.calls, [(1, 99), (0, 0), (0, 1), (0, 2)])
+
+    def test_fifo_without_prioritization(self):
+        self.scheduler.close()
+        self.scheduler = CommandScheduler(prioritize=False)
+        blocker = threading.Event()
+        self.scheduler.submit(blocker.wait)
+
+        bulk = ScheduledControl(self.control, self.scheduler, CommandPriority.BULK)
+        futures = [
+            bulk.set_value(0, 0),
+            bulk.with_priority(CommandPriority.INTERACTIVE).set_value(1, 1),
+        ]
+        blocker.set()
+        for future in futures:
+            future.result(timeout=1)
+
+        self.assertEqual(self.control.calls, [(0, 0), (1, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
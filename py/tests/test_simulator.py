@@ -0,0 +1,131 @@
+import time
+import unittest
+
+from elb_ardu_disc.loopback import open_loopback
+from elb_ardu_disc.simulator import PulseStream, SimulatedBoard, threshold_v
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LSB_V = threshold_v(1) - threshold_v(0)
+
+
+def switch_on(ead, channels=range(4), current=512, threshold=512):
+    for channel in channels:
+        ead.timing_control.set_channel_delay_current(channel, current)
+        ead.timing_control.set_channel_delay_threshold(channel, threshold)
+        ead.timing_control.set_channel_pulse_width_current(channel, current)
+        ead.timing_control.set_channel_pulse_width_threshold(channel, threshold)
+
+
+class TestSimulatedBoard(unittest.TestCase):
+
+    def setUp(self):
+        self.board = SimulatedBoard([PulseStream(rate_hz=20000, amplitude_v=0.4)])
+        self.ead = open_loopback(self.board)
+
+    def test_threshold_formula(self):
+        self.ead.channel_control.set_threshold_v(2, 0.4)
+        self.assertAlmostEqual(
+            self.board.channel_state(2).threshold_v, 0.4, delta=LSB_V
+        )
+
+    def test_output_is_off_without_current(self):
+        self.ead.channel_control.set_threshold_v(0, 0.2)
+        self.assertEqual(self.ead.channel_control.count(100), 0)
+        switch_on(self.ead, [0])
+        self.assertAlmostEqual(self.ead.channel_control.count(100), 2000, delta=200)
+
+    def test_scan_faster_than_real_time(self):
+        switch_on(self.ead, [0])
+        low = int((0.2 - threshold_v(0)) / LSB_V)
+        start = time.perf_counter()
+        edge = self.ead.channel_control.scan_threshold(0, low=low)
+        elapsed = time.perf_counter() - start
+
+        self.assertAlmostEqual(threshold_v(edge.code), 0.4, delta=2 * LSB_V)
+        # the width of the edge is the noise
+        self.assertAlmostEqual(edge.width * LSB_V, 2 * 0.005, delta=2 * LSB_V)
+        self.assertGreater(self.board.now, 10 * elapsed)
+
+    def test_scan_of_another_channel(self):
+        self.board.streams = [
+            PulseStream(rate_hz=20000, amplitude_v=0.6, channels=(2,))
+        ]
+        switch_on(self.ead, [0, 2])
+        self.ead.channel_control.set_threshold_v(0, 0.2)
+        self.assertEqual(self.ead.channel_control.count(100, channel=0), 0)
+        low = int((0.2 - threshold_v(0)) / LSB_V)
+        edge = self.ead.channel_control.scan_threshold(2, low=low, with_width=False)
+        self.assertAlmostEqual(threshold_v(edge.code), 0.6, delta=2 * LSB_V)
+
+    def test_older_firmware_counts_the_aux_input(self):
+        board = SimulatedBoard(
+            [PulseStream(rate_hz=20000, amplitude_v=0.4, channels=(0,))],
+            version="0.1.5",
+        )
+        ead = open_loopback(board)
+        switch_on(ead, [0, 2])
+        with self.assertRaises(RuntimeError):
+            ead.channel_control.count(100, channel=2)
+        ead.channel_control.set_threshold_v(0, 0.2)
+        self.assertGreater(ead.channel_control.count(100), 1000)
+
+    def test_dead_time_of_the_output(self):
+        self.board.streams = [PulseStream(rate_hz=1e7, amplitude_v=0.4)]
+        switch_on(self.ead, [1], threshold=1000)
+        self.ead.channel_control.set_threshold_v(1, 0.2)
+        pulse_width_ns = self.board.channel_state(1).pulse_width_ns
+        self.assertAlmostEqual(pulse_width_ns, 5 + 20 * 1000 / 512)
+        self.assertAlmostEqual(
+            self.board.output_rate(1), 1e7 / (1 + 1e7 * pulse_width_ns * 1e-9)
+        )
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_rate_monitor(self):
+        switch_on(self.ead, [0, 1])
+        self.ead.channel_control.set_threshold_v(0, 0.2)
+        self.ead.channel_control.set_threshold_v(1, 0.6)
+        monitor = self.ead.start_rate_monitor(interval_ms=100)
+        self.board.advance(1.0)
+        monitor.poll()
+        rates = monitor.history.latest()
+        self.assertAlmostEqual(rates[0], self.board.output_rate(0), delta=1)
+        self.assertEqual(rates[1], 0)
+        self.ead.stop_rate_monitor()
+
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class TestOutputPulses(unittest.TestCase):
+
+    def test_coincidence_of_two_channels(self):
+        board = SimulatedBoard(
+            [PulseStream(rate_hz=1e5, amplitude_v=0.4, channels=(0, 1))], seed=3
+        )
+        ead = open_loopback(board)
+        switch_on(ead, [0, 1])
+        ead.timing_control.set_channel_delay_threshold(1, 700)
+        ead.timing_control.set_logic_delay_current(0, 512)
+        ead.timing_control.set_logic_pulse_width_current(0, 512)
+        for channel in range(4):
+            ead.channel_control.set_threshold_v(channel, 0.2)
+
+        outputs = board.output_pulses(0.01)
+        first = outputs["channel0"]
+        second = outputs["channel1"]
+        self.assertAlmostEqual(len(first.start_ns), 1000, delta=150)
+        numpy.testing.assert_allclose(
+            second.start_ns - first.start_ns, 20 * (700 - 512) / 512
+        )
+        # the channels 2 and 3 are switched off
+        self.assertEqual(len(outputs["logic1"].start_ns), 0)
+        logic = outputs["logic0"]
+        self.assertEqual(len(logic.start_ns), len(first.start_ns))
+        numpy.testing.assert_allclose(logic.start_ns, second.start_ns + 5)
+        self.assertEqual(logic.width_ns, 5)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,55 @@
+import unittest
+
+from elb_ardu_disc import DacCs, DacVrefOptions
+from elb_ardu_disc.loopback import FakeChipSelects, FakeSpiDev, open_spidev_loopback
+from elb_ardu_disc.spidev_io import SpiIoSpidev, check_cs_lines
+
+
+class TestSpiIoSpidev(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_spidev_loopback()
+        self.firmware = self.ead.loopback
+
+    def test_same_api(self):
+        self.ead.channel_control.set_threshold(2, 1234)
+        self.ead.timing_control.set_logic_pulse_width_threshold(1, 77)
+        self.assertEqual(self.firmware.dacs[DacCs.CHANNEL_THR.value].registers[2], 1234)
+        self.assertEqual(
+            self.firmware.dacs[DacCs.LOGIC_TIMING_TH.value].registers[3], 77
+        )
+        self.assertEqual(self.ead.registers.thr[2], 1234)
+        self.assertIsNone(self.ead.testpulser_control)
+
+    def test_refs_in_one_transfer(self):
+        transfers = self.ead._spi.transfers
+        self.ead._dac_control.broadcast_refs(DacVrefOptions.Internal_1V22)
+        self.assertEqual(self.ead._spi.transfers - transfers, 1)
+        self.assertEqual({dac.vref for dac in self.firmware.dacs.values()}, {0x55})
+
+    def test_read_back(self):
+        self.ead.registers.hys[:] = [1, 2, 3, 4]
+        dac = self.ead._dac_control.channel_hysteresis_dac
+        self.assertEqual(
+            [dac.get_channel(channel) for channel in range(4)], [1, 2, 3, 4]
+        )
+
+    def test_multicast_rejects_reads(self):
+        chip_selects = FakeChipSelects()
+        spi = SpiIoSpidev(FakeSpiDev(chip_selects), chip_selects)
+        self.assertEqual(spi.do_io_24_multicast([0x06, 0, 0], [1, 2]), [[0, 0, 0]] * 2)
+        self.assertEqual(chip_selects.selected, [])
+
+    def test_cs_lines(self):
+        lines = {cs: 10 + cs.value for cs in DacCs}
+        self.assertEqual(check_cs_lines(lines)[DacCs.DELAY_TH.value], 17)
+        del lines[DacCs.PULSE_I]
+        with self.assertRaises(ValueError):
+            check_cs_lines(lines)
+        lines[DacCs.PULSE_I] = 10
+        with self.assertRaises(ValueError):
+            check_cs_lines(lines)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
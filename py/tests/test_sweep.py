@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import unittest
+
+from elb_ardu_disc import LinearAxis, ListAxis, LogAxis, Product, SweepRunner, Zip
+from elb_ardu_disc import DacCs
+from elb_ardu_disc.loopback import open_loopback
+
+
+class TestSweepPlans(unittest.TestCase):
+
+    def test_axes(self):
+        self.assertEqual(list(LinearAxis("thr", 10, 4, step=3).values), [10, 7, 4])
+        self.assertEqual(list(LogAxis("thr", 1, 1000, 4).values), [1, 10, 100, 1000])
+        self.assertEqual(ListAxis("thr", [5, 1], channels=2)[1], {"thr[2]": 1})
+        with self.assertRaises(ValueError):
+            ListAxis("thr", [])
+
+    def test_product_random_access(self):
+        plan = Product(
+            ListAxis("thr", [1, 2, 3]), ListAxis("hys", [7, 8]), optimize=False
+        )
+        self.assertEqual(len(plan), 6)
+        self.assertEqual(plan[3], {"thr": 2, "hys": 8})
+        self.assertEqual(plan[-1], {"thr": 3, "hys": 8})
+        self.assertEqual(list(plan), [plan[i] for i in range(6)])
+        with self.assertRaises(IndexError):
+            plan[6]
+
+    def test_zip(self):
+        plan = Zip(LinearAxis("delay_th", 1, 3), LinearAxis("pulse_th", 4, 6))
+        self.assertEqual(plan[2], {"delay_th": 3, "pulse_th": 6})
+        with self.assertRaises(ValueError):
+            Zip(LinearAxis("thr", 1, 3), LinearAxis("hys", 1, 4))
+        with self.assertRaises(ValueError):
+            Zip(LinearAxis("thr", 1, 3), LinearAxis("thr", 1, 3))
+
+    def test_axes_setting_the_same_registers(self):
+        with self.assertRaises(ValueError):
+            Product(ListAxis("thr", [1]), ListAxis("thr", [2], channels=0))
+        with self.assertRaises(ValueError):
+            Zip(ListAxis("thr", [1], channels=[0, 1]), ListAxis("thr", [2], channels=1))
+        with self.assertRaises(ValueError):
+            Product(ListAxis("period_us", [1]), ListAxis("period_us", [2], channels=0))
+        plan = Product(
+            ListAxis("thr", [1], channels=0), ListAxis("thr", [2], channels=1)
+        )
+        self.assertEqual(len(plan), 1)
+
+    def test_order_minimizes_writes(self):
+        channel = LinearAxis("thr", 0, 3, channels=0)
+        all_channels = Zip(LinearAxis("delay_th", 0, 99), LinearAxis("pulse_th", 0, 99))
+        given = Product(channel, all_channels, optimize=False)
+        optimized = Product(channel, all_channels)
+        self.assertEqual(optimized.plans[0], all_channels)
+        self.assertLess(optimized.write_count(), given.write_count())
+
+
+class TestSweepRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.ead = open_loopback()
+        self.firmware = self.ead.loopback
+        self.path = os.path.join(tempfile.mkdtemp(), "sweep.json")
+        self.plan = Product(LinearAxis("delay_th", 350, 359), ListAxis("thr", [1, 2]))
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_only_changes_are_written(self):
+        commands = self.firmware.commands_processed
+        points = list(self.ead.sweep(self.plan))
+        self.assertEqual(len(points), 20)
+        writes = self.firmware.commands_processed - commands
+        self.assertEqual(writes, self.plan.write_count())
+        self.assertEqual(self.firmware.dacs[DacCs.DELAY_TH.value].registers, [359] * 4)
+
+    def test_resume_after_failure(self):
+        visited = []
+        with self.assertRaises(RuntimeError):
+            for index, point in self.ead.sweep(self.plan, self.path):
+                if index == 7:
+                    raise RuntimeError("measurement failed")
+                visited.append(index)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["completed"], 6)
+
+        # the board lost its settings in the meantime
+        for dac in self.firmware.dacs.values():
+            dac.reset()
+        ead = open_loopback(self.firmware)
+        for index, point in ead.sweep(self.plan, self.path):
+            if index == 7:
+                dac = self.firmware.dacs[DacCs.CHANNEL_THR.value]
+                self.assertEqual(dac.registers, [point["thr"]] * 4)
+            visited.append(index)
+        self.assertEqual(visited, list(range(20)))
+        self.assertEqual(list(ead.sweep(self.plan, self.path)), [])
+
+    def test_checkpoint_of_other_plan(self):
+        list(self.ead.sweep(self.plan, self.path))
+        with self.assertRaises(ValueError):
+            list(self.ead.sweep(LinearAxis("thr", 0, 3), self.path))
+
+    def test_setters(self):
+        periods = []
+        plan = Product(
+            ListAxis("period_us", [10, 20]), LinearAxis("hys", 0, 2), optimize=False
+        )
+        runner = SweepRunner(
+            self.ead.registers, plan, setters={"period_us": periods.append}
+        )
+        list(runner)
+        self.assertEqual(periods, [10, 20])
+        with self.assertRaises(ValueError):
+            SweepRunner(self.ead.registers, plan)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)